@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import random
+from unittest.mock import MagicMock
+
+# Add lambdas directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../lambdas')))
+
+# The benchmark never talks to AWS, mock boto3 before importing the lambdas
+sys.modules['boto3'] = MagicMock()
+
+import data_aggregator
+from hll import HyperLogLog
+from partial_aggregates import is_partial
+from quantiles import SpeedSketch
+from validation_benchmark import generate_payload
+
+BATCH_SIZES = (1000, 10000, 100000)
+REPEATS = 7
+
+
+def legacy_aggregate_metrics(data_points):
+    """
+    aggregate_metrics before the slotted accumulators: a dict per street and every
+    field looked up, and every sketch updated, once per record.
+    """
+    stats = {}
+    for data in data_points:
+        s_id = data.get('street_id')
+        if s_id not in stats:
+            stats[s_id] = {
+                'street_name': data.get('street_name', 'Unknown'),
+                'total_speed': 0,
+                'record_count': 0,
+                'min_speed': None,
+                'max_speed': None,
+                'vehicle_count': 0,
+                'speed_limit': data.get('speed_limit', 0),
+                'lanes': 1,
+                'vehicle_sketch': HyperLogLog(),
+                'speed_sketch': SpeedSketch(),
+                'latitude': data.get('latitude', 0),
+                'longitude': data.get('longitude', 0)
+            }
+        street = stats[s_id]
+        if is_partial(data):
+            raise ValueError("The benchmark only feeds raw records")
+        speed = data.get('speed_kph', 0)
+        street['total_speed'] += speed
+        street['record_count'] += 1
+        street['speed_sketch'].add(speed)
+        lanes = data.get('lane_id', 1)
+        street['vehicle_sketch'].add(data.get('license_plate', 'Unknown'))
+        if street['min_speed'] is None or speed < street['min_speed']:
+            street['min_speed'] = speed
+        if street['max_speed'] is None or speed > street['max_speed']:
+            street['max_speed'] = speed
+        if lanes > street['lanes']:
+            street['lanes'] = lanes
+
+    for street in stats.values():
+        street['vehicle_count'] = street['vehicle_sketch'].count()
+    return stats
+
+
+def main():
+    random.seed(42)
+    records = [generate_payload(0.0) for _ in range(max(BATCH_SIZES))]
+
+    print(f"{'records':>8} | {'legacy':>10} | {'slotted':>10} | {'speedup':>7}")
+    print("-" * 46)
+    for size in BATCH_SIZES:
+        batch = records[:size]
+        legacy = legacy_aggregate_metrics(batch)
+        slotted = data_aggregator.aggregate_metrics(batch)
+        for s_id, street in slotted.items():
+            assert street.record_count == legacy[s_id]['record_count']
+            assert street.vehicle_sketch == legacy[s_id]['vehicle_sketch']
+            assert street.speed_sketch == legacy[s_id]['speed_sketch']
+
+        # Best of REPEATS, the paths take turns so they see the same machine load
+        best = {"legacy": float("inf"), "slotted": float("inf")}
+        for _ in range(REPEATS):
+            for name, fn in (("legacy", legacy_aggregate_metrics), ("slotted", data_aggregator.aggregate_metrics)):
+                start = time.perf_counter()
+                fn(batch)
+                best[name] = min(best[name], time.perf_counter() - start)
+
+        print(f"{size:>8} | {best['legacy'] * 1e6 / size:>7.2f} us | {best['slotted'] * 1e6 / size:>7.2f} us | "
+              f"{best['legacy'] / best['slotted']:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import random
+import contextlib
+
+# Add lambdas directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../lambdas')))
+
+import congestion_calculation
+
+STREET_COUNT = 10000
+REPEATS = 20
+STOPPED_RATE = 0.05
+
+
+def scalar_path(limits, speeds):
+    """
+    One calculate_congestion_index call per street, as the aggregator used to do.
+    """
+    with contextlib.redirect_stdout(None):
+        return [congestion_calculation.calculate_congestion_index(l, s) for l, s in zip(limits, speeds)]
+
+
+def batch_path(limits, speeds):
+    return congestion_calculation.congestion_indices(limits, speeds)
+
+
+def main():
+    random.seed(42)
+    limits = [random.choice([30, 50, 80, 130]) for _ in range(STREET_COUNT)]
+    speeds = [0.0 if random.random() < STOPPED_RATE else random.uniform(5, 140) for _ in range(STREET_COUNT)]
+
+    assert scalar_path(limits, speeds) == batch_path(limits, speeds)
+
+    paths = {'scalar': scalar_path, 'batch': batch_path}
+    best = {name: float("inf") for name in paths}
+    for _ in range(REPEATS):
+        for name, fn in paths.items():
+            start = time.perf_counter()
+            fn(limits, speeds)
+            best[name] = min(best[name], time.perf_counter() - start)
+
+    print(f"{STREET_COUNT} streets, best of {REPEATS}")
+    for name, elapsed in best.items():
+        print(f"  {name:<8} {elapsed * 1000:8.2f} ms")
+    print(f"  speedup  {best['scalar'] / best['batch']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
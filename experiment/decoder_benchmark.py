@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import time
+import base64
+import random
+from unittest.mock import MagicMock
+
+# Add lambdas directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../lambdas')))
+
+# The benchmark never talks to AWS, mock boto3 before importing the lambdas
+sys.modules['boto3'] = MagicMock()
+
+import kinesis_decoder
+import validator
+from validation_benchmark import generate_payload
+
+BATCH_SIZE = 10000
+REPEATS = 20
+MALFORMED_RATE = 0.03
+
+
+def legacy_path(records):
+    """
+    Decoding as done before kinesis_decoder: base64 -> str -> dict, then the schema checks.
+    """
+    accepted = []
+    for record in records:
+        payload = json.loads(base64.b64decode(record['kinesis']['data']).decode('utf-8'))
+        if validator.validate_schema(payload)[0]:
+            accepted.append(payload)
+    return accepted
+
+
+def decoder_path(records):
+    events, _ = kinesis_decoder.decode_kinesis_records(records)
+    return events
+
+
+def time_paths(paths, records):
+    """
+    Best time of each path, the paths take turns so they all see the same machine load.
+    """
+    best = {name: float("inf") for name in paths}
+    for _ in range(REPEATS):
+        for name, (fn, backend) in paths.items():
+            kinesis_decoder.orjson = backend
+            start = time.perf_counter()
+            fn(records)
+            best[name] = min(best[name], time.perf_counter() - start)
+    return best
+
+
+def main():
+    random.seed(42)
+    payloads = [generate_payload(MALFORMED_RATE) for _ in range(BATCH_SIZE)]
+    records = [{'kinesis': {'data': base64.b64encode(json.dumps(p).encode('utf-8')).decode('ascii')}}
+               for p in payloads]
+    orjson = kinesis_decoder.orjson
+
+    paths = {"legacy (json + schema)": (legacy_path, orjson), "decoder (stdlib)": (decoder_path, None)}
+    if orjson is not None:
+        paths["decoder (orjson)"] = (decoder_path, orjson)
+
+    # The decoder must accept exactly the records the legacy path accepts
+    expected = [{field: p[field] for field in kinesis_decoder.FIELDS} for p in legacy_path(records)]
+    for name, (fn, backend) in paths.items():
+        kinesis_decoder.orjson = backend
+        if fn is decoder_path:
+            assert [e._asdict() for e in fn(records)] == expected, name
+
+    best = time_paths(paths, records)
+    kinesis_decoder.orjson = orjson
+
+    legacy_time = best["legacy (json + schema)"]
+    print(f"{BATCH_SIZE} camera payloads, {MALFORMED_RATE:.0%} malformed")
+    print(f"{'path':>24} | {'per record':>10} | {'speedup':>7}")
+    print("-" * 50)
+    for name, elapsed in best.items():
+        print(f"{name:>24} | {elapsed * 1e6 / BATCH_SIZE:>7.2f} us | {legacy_time / elapsed:>6.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,15 @@ import datetime
 import boto3
 import threading
 import csv
+import os
+import sys
 from botocore.config import Config
 
+# Shared KPL aggregation helper from the Lambdas
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../lambdas')))
+from kpl_aggregation import aggregate_records
+from partitioning import hot_street_sub_keys, partition_key
+
 # Configuration
 ENDPOINT_URL = "http://localhost:4566"
 REGION = "us-east-1"
@@ -22,6 +29,12 @@ WARM_UP_RATE = 500  # events/sec
 WARM_UP_DURATION = 18  # seconds (3 minutes)
 RAMP_UP_RATE = 10000  # events/sec
 RAMP_UP_DURATION = 30  # seconds (5 minutes)
+# Pack events into KPL aggregated records, so the shard's records/sec limit is not the bottleneck
+KPL_AGGREGATION = True
+KPL_EVENTS_PER_RECORD = 100
+# generate_record picks street ids 100-999, shard count of the stream (see kinesis.tf)
+STREET_COUNT = 900
+SHARD_COUNT = 1
 
 # AWS Clients
 dummy_creds = {
@@ -77,6 +90,7 @@ def load_generator(target_rate, duration, phase_name):
     next_batch_time = start_time
 
     BATCH_SIZE = 500
+    sub_keys = hot_street_sub_keys(target_rate / STREET_COUNT, SHARD_COUNT)
 
     # Calculate how many BATCHES we need per second
     batches_per_sec = max(1, target_rate // BATCH_SIZE)
@@ -95,14 +109,23 @@ def load_generator(target_rate, duration, phase_name):
 
             records_batch.append({
                 'Data': json.dumps(data),
-                'PartitionKey': data['street_id']
+                'PartitionKey': partition_key(data['street_id'], sub_keys)
             })
 
+        if KPL_AGGREGATION:
+            aggregated = aggregate_records(
+                [(record['PartitionKey'], record['Data']) for record in records_batch],
+                max_records=KPL_EVENTS_PER_RECORD
+            )
+            kinesis_records = [{'Data': data, 'PartitionKey': key} for key, data in aggregated]
+        else:
+            kinesis_records = records_batch
+
         # Send the Batch (One HTTP request instead of 500)
         try:
             kinesis.put_records(
                 StreamName=STREAM_NAME,
-                Records=records_batch
+                Records=kinesis_records
             )
             with stats_lock:
                 stats["sent_events"] += len(records_batch)
@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import random
+import string
+import datetime
+from unittest.mock import MagicMock
+
+# Add lambdas directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../lambdas')))
+
+# The benchmark never talks to AWS, mock boto3 before importing the lambdas
+sys.modules['boto3'] = MagicMock()
+
+import validator
+
+BATCH_SIZES = [100, 500, 10000]
+REPEATS = 20
+ERROR_RATE = 0.05  # same sensor error rate as camera_sim.py
+MALFORMED_RATES = [0.0, 0.03]  # camera_sim never sends malformed records, the second run does
+
+STREETS = [
+    ("Südosttangente (A23)", "VIE-001", 80, 2),
+    ("Westautobahn (A1)", "VIE-004", 130, 3),
+    ("Triester Straße", "VIE-006", 50, 2),
+    ("Gürtel", "VIE-010", 50, 3),
+]
+
+
+def generate_license_plate():
+    city = "".join(random.choices(string.ascii_uppercase, k=2))
+    numbers = "".join(random.choices(string.digits, k=3))
+    letters = "".join(random.choices(string.ascii_uppercase, k=2))
+    return f"{city} {numbers}{letters}"
+
+
+def generate_payload(malformed_rate):
+    """
+    Camera payload as produced by camera_sim.generate_vehicle_data, with the same error rate
+    plus malformed_rate records with a missing field, a wrong type or a broken timestamp.
+    """
+    street_name, street_id, speed_limit, lanes = random.choice(STREETS)
+    speed = round(random.gauss(speed_limit - 5, speed_limit * 0.15), 1)
+    ocr_confidence = round(random.uniform(0.85, 0.99), 2)
+    if random.random() < ERROR_RATE:
+        speed = round(random.uniform(300.0, 999.0), 1)
+        ocr_confidence = round(random.uniform(0.10, 0.50), 2)
+
+    payload = {
+        "street_name": street_name,
+        "street_id": street_id,
+        "camera_id": f"CAM-{street_id}-01",
+        "latitude": 48.2,
+        "longitude": 16.37,
+        "timestamp": datetime.datetime.now().isoformat(),
+        "license_plate": generate_license_plate(),
+        "speed_kph": speed,
+        "speed_limit": speed_limit,
+        "lane_id": random.randint(1, lanes),
+        "vehicle_type": random.choice(["Car", "Car", "Car", "Truck", "Motorcycle", "Bus"]),
+        "ocr_confidence": ocr_confidence,
+        "is_violation": speed > speed_limit,
+    }
+
+    roll = random.random()
+    if roll < malformed_rate / 3:
+        del payload["lane_id"]
+    elif roll < malformed_rate * 2 / 3:
+        payload["speed_kph"] = str(payload["speed_kph"])
+    elif roll < malformed_rate:
+        payload["timestamp"] = "yesterday"
+    return payload
+
+
+def time_it(fn, payloads):
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fn(payloads)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def per_record(payloads):
+    return [validator.validate_record(p) for p in payloads]
+
+
+def main():
+    random.seed(42)
+    for malformed_rate in MALFORMED_RATES:
+        print(f"\nMalformed records: {malformed_rate:.0%}")
+        print(f"{'records':>8} | {'per-record':>12} | {'batch':>12} | {'speedup':>7}")
+        print("-" * 50)
+        for size in BATCH_SIZES:
+            payloads = [generate_payload(malformed_rate) for _ in range(size)]
+
+            # Both paths must agree on every single record
+            assert per_record(payloads) == validator.validate_batch(payloads)
+
+            record_time = time_it(per_record, payloads)
+            batch_time = time_it(validator.validate_batch, payloads)
+            print(f"{size:>8} | {record_time * 1e6 / size:>9.2f} us | {batch_time * 1e6 / size:>9.2f} us | "
+                  f"{record_time / batch_time:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
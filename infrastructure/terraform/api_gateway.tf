@@ -1,6 +1,9 @@
 resource "aws_api_gateway_rest_api" "urbanflow_api" {
   name        = "UrbanFlowAPI"
   description = "UrbanFlow REST API (V1)"
+
+  # The reader returns gzip/brotli and MessagePack bodies base64 encoded, see lambdas/response_encoding.py
+  binary_media_types = ["*/*"]
 }
 
 resource "aws_api_gateway_resource" "traffic" {
@@ -68,6 +71,10 @@ resource "aws_api_gateway_integration" "options_integration" {
   http_method = aws_api_gateway_method.options_traffic.http_method
   type        = "MOCK"
 
+  # With binary_media_types = ["*/*"] the preflight body would be passed on as binary,
+  # the MOCK integration only maps its statusCode template from text
+  content_handling = "CONVERT_TO_TEXT"
+
   request_templates = {
     "application/json" = "{\"statusCode\": 200}"
   }
@@ -93,7 +100,7 @@ resource "aws_api_gateway_integration_response" "options_integration_response" {
   status_code = aws_api_gateway_method_response.options_200.status_code
 
   response_parameters = {
-    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'"
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,If-None-Match'"
     "method.response.header.Access-Control-Allow-Methods" = "'GET,OPTIONS'"
     "method.response.header.Access-Control-Allow-Origin"  = "'*'"
   }
@@ -141,6 +148,10 @@ resource "aws_api_gateway_integration" "options_alerts_integration" {
   http_method = aws_api_gateway_method.options_alerts.http_method
   type        = "MOCK"
 
+  # With binary_media_types = ["*/*"] the preflight body would be passed on as binary,
+  # the MOCK integration only maps its statusCode template from text
+  content_handling = "CONVERT_TO_TEXT"
+
   request_templates = {
     "application/json" = "{\"statusCode\": 200}"
   }
@@ -166,7 +177,7 @@ resource "aws_api_gateway_integration_response" "options_alerts_integration_resp
   status_code = aws_api_gateway_method_response.options_alerts_200.status_code
 
   response_parameters = {
-    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'"
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,If-None-Match'"
     "method.response.header.Access-Control-Allow-Methods" = "'GET,OPTIONS'"
     "method.response.header.Access-Control-Allow-Origin"  = "'*'"
   }
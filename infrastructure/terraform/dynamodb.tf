@@ -20,7 +20,8 @@ resource "aws_dynamodb_table" "traffic_data" {
   }
 }
 
-# Additional table for aggregated data
+# Additional table for aggregated data. Street rows are listed per latest-state shard in
+# write order by the update index, GET /traffic?since=<cursor> reads it (see lambdas/latest_state.py)
 resource "aws_dynamodb_table" "aggregated_traffic_data" {
   name           = "UrbanFlowAggregatedTrafficData"
   billing_mode   = "PAY_PER_REQUEST"
@@ -30,8 +31,73 @@ resource "aws_dynamodb_table" "aggregated_traffic_data" {
     name = "street_id"
     type = "S"
   }
+
+  attribute {
+    name = "latest_shard"
+    type = "N"
+  }
+
+  attribute {
+    name = "updated_at"
+    type = "N"
+  }
+
+  global_secondary_index {
+    name            = "latest_shard-updated_at-index"
+    hash_key        = "latest_shard"
+    range_key       = "updated_at"
+    projection_type = "ALL"
+  }
+}
+
+# Event-time window state, one item per street and pane (see lambdas/windowing.py)
+resource "aws_dynamodb_table" "window_state" {
+  name           = "UrbanFlowWindowState"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "street_id"
+  range_key      = "pane_start"
+
+  attribute {
+    name = "street_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "pane_start"
+    type = "N"
+  }
+
+  ttl {
+    attribute_name = "expiration_time"
+    enabled        = true
+  }
 }
 
+# Time-series history, one row per street and window_id "<resolution>#<window start>".
+# The aggregator writes the 1-minute rows, history_rollup the coarser ones.
+resource "aws_dynamodb_table" "traffic_history" {
+  name           = "UrbanFlowTrafficHistory"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "street_id"
+  range_key      = "window_id"
+
+  attribute {
+    name = "street_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "window_id"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expiration_time"
+    enabled        = true
+  }
+}
+
+# Alerts are queried through one timestamp-sorted GSI per filter shape (see lambdas/alert_index.py)
 resource "aws_dynamodb_table" "alerts" {
   name           = "UrbanFlowAlerts"
   billing_mode   = "PAY_PER_REQUEST"
@@ -42,6 +108,29 @@ resource "aws_dynamodb_table" "alerts" {
     type = "S"
   }
 
+  attribute {
+    name = "timestamp"
+    type = "S"
+  }
+
+  dynamic "attribute" {
+    for_each = ["feed", "sensor_id", "type", "sensor_type"]
+    content {
+      name = attribute.value
+      type = "S"
+    }
+  }
+
+  dynamic "global_secondary_index" {
+    for_each = ["feed", "sensor_id", "type", "sensor_type"]
+    content {
+      name            = "${global_secondary_index.value}-timestamp-index"
+      hash_key        = global_secondary_index.value
+      range_key       = "timestamp"
+      projection_type = "ALL"
+    }
+  }
+
   ttl {
     attribute_name = "expiration_time"
     enabled        = true
@@ -1,6 +1,6 @@
 resource "aws_kinesis_stream" "urbanflow_input_stream" {
   name             = "urbanflow-input-stream"
-  shard_count      = 1
+  shard_count      = var.kinesis_shard_count
   retention_period = 24
 
   shard_level_metrics = [
@@ -33,7 +33,9 @@ resource "aws_iam_policy" "lambda_kinesis_dynamodb_policy" {
           "kinesis:DescribeStream",
           "kinesis:ListStreams",
           "dynamodb:PutItem",
+          "dynamodb:BatchWriteItem",
           "dynamodb:GetItem",
+          "dynamodb:BatchGetItem",
           "dynamodb:Scan",
           "dynamodb:Query",
           "dynamodb:UpdateItem",
@@ -67,15 +69,25 @@ resource "aws_lambda_function" "ingestion_processor" {
   environment {
     variables = {
       AGGREGATION_QUEUE_URL = aws_sqs_queue.urbanflow_aggregation_queue.url
+      VALIDATION_MODE       = "batch"
+      AGGREGATION_DIMENSIONS = var.aggregation_dimensions
+      DEAD_LETTER_QUEUE_URL = aws_sqs_queue.urbanflow_rejected_records_queue.url
     }
   }
 }
 
 resource "aws_lambda_event_source_mapping" "kinesis_trigger" {
+  count             = var.single_stream_consumer ? 0 : 1
   event_source_arn  = aws_kinesis_stream.urbanflow_input_stream.arn
   function_name     = aws_lambda_function.ingestion_processor.arn
   starting_position = "LATEST"
   batch_size        = var.lambda_batch_size
+
+  # The handlers return batchItemFailures, see lambdas/batch_failures.py
+  function_response_types        = ["ReportBatchItemFailures"]
+  bisect_batch_on_function_error = true
+  maximum_retry_attempts         = var.kinesis_max_retry_attempts
+  parallelization_factor         = var.kinesis_parallelization_factor
 }
 
 resource "aws_lambda_function" "data_reader" {
@@ -93,6 +105,8 @@ resource "aws_lambda_function" "data_reader" {
     variables = {
       AGGREGATED_DATA_TABLE_NAME = aws_dynamodb_table.aggregated_traffic_data.name
       ALERTS_TABLE_NAME          = aws_dynamodb_table.alerts.name
+      LATEST_SNAPSHOT_SHARDS     = var.latest_snapshot_shards
+      RESPONSE_CACHE_TTL_SECONDS = var.response_cache_ttl_seconds
     }
   }
 }
@@ -112,10 +126,69 @@ resource "aws_lambda_function" "data_aggregator" {
     variables = {
       TABLE_NAME = aws_dynamodb_table.aggregated_traffic_data.name
       CONGESTION_CALCULATION_ARN = aws_lambda_function.congestion_calculation.arn
+      CONGESTION_MODE = "local"
+      CONGESTION_MODEL = "speed_ratio"
+      AGGREGATION_MODE = "window"
+      WINDOW_STATE_TABLE_NAME = aws_dynamodb_table.window_state.name
+      WINDOW_SIZES_SECONDS = var.window_sizes_seconds
+      WINDOW_SLIDE_SECONDS = var.window_slide_seconds
+      WINDOW_ALLOWED_LATENESS_SECONDS = var.window_allowed_lateness_seconds
+      WINDOW_MAX_CLOCK_SKEW_SECONDS = var.window_max_clock_skew_seconds
+      DEAD_LETTER_QUEUE_URL = aws_sqs_queue.urbanflow_rejected_records_queue.url
+      HISTORY_TABLE_NAME = aws_dynamodb_table.traffic_history.name
+      HISTORY_RETENTION_DAYS = var.history_retention_days
+      WRITE_BEHIND_SECONDS = var.write_behind_seconds
+      AGGREGATION_DIMENSIONS = var.aggregation_dimensions
+      LATEST_SNAPSHOT_SHARDS = var.latest_snapshot_shards
+    }
+  }
+}
+
+# Downsamples the 1-minute history into the coarser series on a schedule
+resource "aws_lambda_function" "history_rollup" {
+  function_name = "UrbanFlowHistoryRollup"
+  role          = aws_iam_role.lambda_exec.arn
+  handler       = "history_rollup.lambda_handler"
+  runtime       = "python3.13"
+  timeout       = 60
+
+  # Localstack Hot-Reload
+  s3_bucket = "hot-reload"
+  s3_key    = "$${HOST_LAMBDA_DIR}"
+
+  environment {
+    variables = {
+      TABLE_NAME = aws_dynamodb_table.aggregated_traffic_data.name
+      CONGESTION_MODE = "local"
+      CONGESTION_MODEL = "speed_ratio"
+      WINDOW_STATE_TABLE_NAME = aws_dynamodb_table.window_state.name
+      WINDOW_SIZES_SECONDS = var.window_sizes_seconds
+      WINDOW_SLIDE_SECONDS = var.window_slide_seconds
+      WINDOW_ALLOWED_LATENESS_SECONDS = var.window_allowed_lateness_seconds
+      HISTORY_TABLE_NAME = aws_dynamodb_table.traffic_history.name
+      HISTORY_RETENTION_DAYS = var.history_retention_days
     }
   }
 }
 
+resource "aws_cloudwatch_event_rule" "history_rollup" {
+  name                = "urbanflow-history-rollup"
+  schedule_expression = var.history_rollup_schedule
+}
+
+resource "aws_cloudwatch_event_target" "history_rollup" {
+  rule = aws_cloudwatch_event_rule.history_rollup.name
+  arn  = aws_lambda_function.history_rollup.arn
+}
+
+resource "aws_lambda_permission" "history_rollup_schedule" {
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.history_rollup.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.history_rollup.arn
+}
+
 resource "aws_lambda_function" "congestion_calculation" {
   function_name = "UrbanFlowCongestionCalculation"
   role          = aws_iam_role.lambda_exec.arn
@@ -147,10 +220,56 @@ resource "aws_lambda_function" "anomaly_detector" {
 }
 
 resource "aws_lambda_event_source_mapping" "anomaly_detector_kinesis" {
+  count             = var.single_stream_consumer ? 0 : 1
   event_source_arn  = aws_kinesis_stream.urbanflow_input_stream.arn
   function_name     = aws_lambda_function.anomaly_detector.arn
   starting_position = "LATEST"
   batch_size        = var.lambda_batch_size
+
+  # The handlers return batchItemFailures, see lambdas/batch_failures.py
+  function_response_types        = ["ReportBatchItemFailures"]
+  bisect_batch_on_function_error = true
+  maximum_retry_attempts         = var.kinesis_max_retry_attempts
+  parallelization_factor         = var.kinesis_parallelization_factor
+}
+
+# Decodes every Kinesis batch once and runs anomaly detection and validation as stages,
+# replaces the two mappings above when single_stream_consumer is set
+resource "aws_lambda_function" "stream_consumer" {
+  function_name = "UrbanFlowStreamConsumer"
+  role          = aws_iam_role.lambda_exec.arn
+  handler       = "stream_consumer.lambda_handler"
+  runtime       = "python3.13"
+  timeout       = 30
+
+  # Localstack Hot-Reload
+  s3_bucket = "hot-reload"
+  s3_key    = "$${HOST_LAMBDA_DIR}"
+
+  environment {
+    variables = {
+      AGGREGATION_QUEUE_URL = aws_sqs_queue.urbanflow_aggregation_queue.url
+      VALIDATION_MODE       = "batch"
+      AGGREGATION_DIMENSIONS = var.aggregation_dimensions
+      DEAD_LETTER_QUEUE_URL = aws_sqs_queue.urbanflow_rejected_records_queue.url
+      ALERTS_TABLE_NAME     = aws_dynamodb_table.alerts.name
+      CONSUMER_STAGES       = "anomalies,validation"
+    }
+  }
+}
+
+resource "aws_lambda_event_source_mapping" "stream_consumer_kinesis" {
+  count             = var.single_stream_consumer ? 1 : 0
+  event_source_arn  = aws_kinesis_stream.urbanflow_input_stream.arn
+  function_name     = aws_lambda_function.stream_consumer.arn
+  starting_position = "LATEST"
+  batch_size        = var.lambda_batch_size
+
+  # The handlers return batchItemFailures, see lambdas/batch_failures.py
+  function_response_types        = ["ReportBatchItemFailures"]
+  bisect_batch_on_function_error = true
+  maximum_retry_attempts         = var.kinesis_max_retry_attempts
+  parallelization_factor         = var.kinesis_parallelization_factor
 }
 
 resource "aws_lambda_event_source_mapping" "sqs_trigger" {
@@ -2,4 +2,10 @@ resource "aws_sqs_queue" "urbanflow_aggregation_queue" {
   name                       = "UrbanFlowAggregationQueue"
   visibility_timeout_seconds = 30
   message_retention_seconds  = 345600
-}
\ No newline at end of file
+}
+
+# Rejected records from the ingestion processor, kept for offline analysis
+resource "aws_sqs_queue" "urbanflow_rejected_records_queue" {
+  name                      = "UrbanFlowRejectedRecordsQueue"
+  message_retention_seconds = 1209600
+}
@@ -15,3 +15,88 @@ variable "aggregation_batch_window" {
   type        = number
   default     = 60
 }
+
+
+variable "single_stream_consumer" {
+  description = "Consume the input stream with one Lambda that decodes each batch once and runs validation and anomaly detection as stages"
+  type        = bool
+  default     = false
+}
+
+variable "kinesis_max_retry_attempts" {
+  description = "Retries of a failing Kinesis batch before Lambda skips it"
+  type        = number
+  default     = 5
+}
+
+variable "kinesis_shard_count" {
+  description = "Shards of the input stream, start the camera simulators with the same --shards value"
+  type        = number
+  default     = 1
+}
+
+variable "kinesis_parallelization_factor" {
+  description = "Concurrent Lambda batches per shard, records with the same partition key stay in order"
+  type        = number
+  default     = 1
+}
+
+variable "window_sizes_seconds" {
+  description = "Comma separated event-time window sizes the aggregator maintains per street"
+  type        = string
+  default     = "60,300,900"
+}
+
+variable "window_slide_seconds" {
+  description = "Slide of the event-time windows, windows of this size or smaller are tumbling"
+  type        = number
+  default     = 60
+}
+
+variable "window_allowed_lateness_seconds" {
+  description = "How far behind the newest event time records are still counted into their windows"
+  type        = number
+  default     = 120
+}
+
+variable "window_max_clock_skew_seconds" {
+  description = "How far ahead of the processing time record timestamps may be, later ones are dead-lettered"
+  type        = number
+  default     = 60
+}
+
+variable "history_retention_days" {
+  description = "resolution_seconds:days pairs, how long each history series is kept (the first is the 1-minute pane)"
+  type        = string
+  default     = "60:7,900:90,3600:400"
+}
+
+variable "history_rollup_schedule" {
+  description = "EventBridge schedule of the history rollup job"
+  type        = string
+  default     = "rate(15 minutes)"
+}
+
+variable "write_behind_seconds" {
+  description = "Write each street row of the aggregator at most once per this many seconds from a warm container, 0 disables the buffer"
+  type        = number
+  default     = 0
+}
+
+variable "aggregation_dimensions" {
+  description = "Comma separated breakdowns of the street aggregates (lane, vehicle_type, violation), '+' crosses them"
+  type        = string
+  default     = "lane,vehicle_type,violation"
+}
+
+variable "latest_snapshot_shards" {
+  description = "Number of latest-state snapshot items the streets are spread over, GET /traffic reads them all with one BatchGetItem"
+  type        = number
+  default     = 4
+}
+
+variable "response_cache_ttl_seconds" {
+  description = "Seconds a warm reader container serves a serialized response from memory, 0 disables the cache"
+  type        = number
+  default     = 5
+}
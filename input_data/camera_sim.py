@@ -7,6 +7,12 @@ import argparse
 import sys
 import json
 import base64
+import os
+
+# kpl_aggregation is shared with the Lambdas, the Docker image copies it next to this script
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas'))
+from kpl_aggregation import aggregate_records
+from partitioning import hot_street_sub_keys, partition_key
 
 # Configuration
 # SERVER_ENDPOINT = "http://localhost:5000/api/traffic-data"
@@ -42,6 +48,12 @@ def get_arguments():
                         help="The latitude of the camera (default: 1)")
     parser.add_argument("-w", "--longitude", type=float, default=1,
                         help="The longitude of the camera (default: 1)")
+    parser.add_argument("-s", "--shards", type=int, default=1,
+                        help="Number of shards of the Kinesis stream, busy streets are spread over "
+                             "several partition keys (default: 1)")
+    parser.add_argument("-a", "--aggregate", type=int, default=1,
+                        help="Number of events packed into one KPL aggregated Kinesis record, "
+                             "1 sends every event as its own record (default: 1)")
 
     return parser.parse_args()
 
@@ -120,10 +132,15 @@ def main():
     print(f"Interval: {args.interval} seconds")
     print(f"Latitude: {args.latitude}")
     print(f"Longitude: {args.longitude}")
+    print(f"Events per Kinesis record: {args.aggregate}")
     print("Press CTRL+C to stop.\n")
 
     # State variable to track persistent traffic jams
     jam_remaining_cycles = 0
+    # Events waiting to be sent as one aggregated record
+    pending_events = []
+    # Busy streets are spread over several partition keys, so they do not pile onto one shard
+    sub_keys = hot_street_sub_keys(1.0 / args.interval, args.shards)
 
     while True:
         try:
@@ -143,30 +160,42 @@ def main():
             # 2. Generate Data (passing the custom limit)
             vehicle_data = generate_vehicle_data(args.name, args.id, args.limit, args.lanes, args.position, args.latitude, args.longitude, is_jammed)
             json_payload = json.dumps(vehicle_data)
-            b64_payload = base64.b64encode(json_payload.encode('utf-8')).decode('utf-8')
-
-            kinesis_payload = {
-                "StreamName": STREAM_NAME,
-                "PartitionKey": args.id,
-                "Data": b64_payload
-            }
-
-            headers = {
-                "Content-Type": "application/x-amz-json-1.1",
-                "X-Amz-Target": "Kinesis_20131202.PutRecord"
-            }
-
-            # 3. Publish
-            try:
-                response = requests.post(
-                    SERVER_ENDPOINT,
-                    json=kinesis_payload,
-                    headers=headers,
-                    timeout=1
-                )
-                status = f"Sent ({response.status_code})"
-            except requests.exceptions.RequestException:
-                status = "Failed (Server Offline)"
+            pending_events.append((partition_key(args.id, sub_keys), json_payload))
+
+            if len(pending_events) < args.aggregate:
+                status = f"Buffered ({len(pending_events)}/{args.aggregate})"
+            else:
+                if args.aggregate > 1:
+                    # More events than fit into one record are split over several
+                    records = aggregate_records(pending_events)
+                else:
+                    records = [(pending_events[0][0], json_payload.encode('utf-8'))]
+                pending_events = []
+
+                headers = {
+                    "Content-Type": "application/x-amz-json-1.1",
+                    "X-Amz-Target": "Kinesis_20131202.PutRecord"
+                }
+
+                # 3. Publish
+                statuses = []
+                for key, data in records:
+                    kinesis_payload = {
+                        "StreamName": STREAM_NAME,
+                        "PartitionKey": key,
+                        "Data": base64.b64encode(data).decode('utf-8')
+                    }
+                    try:
+                        response = requests.post(
+                            SERVER_ENDPOINT,
+                            json=kinesis_payload,
+                            headers=headers,
+                            timeout=1
+                        )
+                        statuses.append(f"Sent ({response.status_code})")
+                    except requests.exceptions.RequestException:
+                        statuses.append("Failed (Server Offline)")
+                status = ", ".join(statuses)
 
             # 4. Log
             # Format timestamp to show HH:MM:SS
@@ -58,7 +58,8 @@ def generate_compose_file():
 
             # Only define build in the first service to prevent concurrent build failures
             if first_service:
-                service["build"] = "."
+                # Repository root as build context, the image also needs lambdas/kpl_aggregation.py
+                service["build"] = {"context": "..", "dockerfile": "input_data/Dockerfile"}
                 first_service = False
 
             # Add to the services dictionary
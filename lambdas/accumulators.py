@@ -0,0 +1,111 @@
+# Per-street aggregate state shared by the validator partials and the aggregator.
+# Street constants are captured from the first data point. The inner loop only appends
+# speeds, plates and the dimension fields to column buffers, and flush() reduces them with
+# C-level builtins (sum, min, max, Counter, set), feeds the sketches once per distinct value
+# and groups the columns into the dimension cells (see dimensions.py).
+from collections import Counter
+
+import dimensions
+from hll import HyperLogLog
+from quantiles import SpeedSketch
+
+
+class StreetAccumulator:
+    __slots__ = ('street_name', 'speed_limit', 'latitude', 'longitude',
+                 'total_speed', 'record_count', 'min_speed', 'max_speed', 'lanes', 'vehicle_count',
+                 'vehicle_sketch', 'speed_sketch', 'dimensions', 'speeds', 'plates', 'lane_ids',
+                 'vehicle_types', 'violations')
+
+    # Compared by __eq__, the column buffers are only state in transit
+    FIELDS = ('street_name', 'speed_limit', 'latitude', 'longitude', 'total_speed', 'record_count',
+              'min_speed', 'max_speed', 'lanes', 'vehicle_count', 'vehicle_sketch', 'speed_sketch',
+              'dimensions')
+
+    def __init__(self, data):
+        self.street_name = data.get('street_name', 'Unknown')
+        self.speed_limit = data.get('speed_limit', 0)
+        self.latitude = data.get('latitude', 0)
+        self.longitude = data.get('longitude', 0)
+        self.total_speed = 0
+        self.record_count = 0
+        self.min_speed = None
+        self.max_speed = None
+        self.lanes = 1
+        self.vehicle_count = 0
+        self.vehicle_sketch = HyperLogLog()
+        self.speed_sketch = SpeedSketch()
+        self.dimensions = {}
+        self.speeds = []
+        self.plates = []
+        self.lane_ids = []
+        self.vehicle_types = []
+        self.violations = []
+
+    def add_record(self, data):
+        self.speeds.append(data.get('speed_kph', 0))
+        self.plates.append(data.get('license_plate', 'Unknown'))
+        self.lane_ids.append(data.get('lane_id', 1))
+        self.vehicle_types.append(data.get('vehicle_type', 'Unknown'))
+        self.violations.append(data.get('is_violation', False))
+
+    def merge_partial(self, data):
+        """
+        Fold in a partial aggregate (see partial_aggregates.py) or a window state pane.
+        """
+        self.total_speed += data['speed_sum']
+        self.record_count += data['count']
+        self._bounds(data['speed_min'], data['speed_max'], data.get('lanes', 1))
+        if 'speed_sketch' in data:
+            self.speed_sketch.update_encoded(data['speed_sketch'])
+        else:
+            self.speed_sketch.update_counts(data.get('speed_buckets', {}))
+        self.vehicle_sketch.update_encoded(data.get('plate_registers', ()))
+        # Version 1 partials and older pane state carry the plates themselves
+        self.vehicle_sketch.update(data.get('license_plates', ()))
+        dimensions.merge(self.dimensions, data.get('dimensions', {}))
+
+    def merge(self, other):
+        """
+        Fold in another flushed accumulator, e.g. to roll finer windows up into coarser ones.
+        """
+        self.total_speed += other.total_speed
+        self.record_count += other.record_count
+        self._bounds(other.min_speed, other.max_speed, other.lanes)
+        self.speed_sketch.merge(other.speed_sketch)
+        self.vehicle_sketch.merge(other.vehicle_sketch)
+        dimensions.merge(self.dimensions, other.dimensions)
+
+    def flush(self):
+        """
+        Reduce the buffered columns into the totals and sketches, refresh vehicle_count.
+        """
+        speeds = self.speeds
+        if speeds:
+            self.total_speed += sum(speeds)
+            self.record_count += len(speeds)
+            self._bounds(min(speeds), max(speeds), max(self.lane_ids))
+            for speed, count in Counter(speeds).items():
+                self.speed_sketch.add(speed, count)
+            self.vehicle_sketch.update(set(self.plates))
+            if dimensions.GROUPINGS:
+                columns = {'lane': self.lane_ids, 'vehicle_type': self.vehicle_types, 'violation': self.violations}
+                dimensions.merge(self.dimensions, dimensions.group(columns, speeds))
+            self.speeds, self.plates, self.lane_ids, self.vehicle_types, self.violations = [], [], [], [], []
+        self.vehicle_count = self.vehicle_sketch.count()
+        return self
+
+    def _bounds(self, min_speed, max_speed, lanes):
+        if self.min_speed is None or min_speed < self.min_speed:
+            self.min_speed = min_speed
+        if self.max_speed is None or max_speed > self.max_speed:
+            self.max_speed = max_speed
+        if lanes > self.lanes:
+            self.lanes = lanes
+
+    def __eq__(self, other):
+        if not isinstance(other, StreetAccumulator):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.FIELDS)
+
+    def __repr__(self):
+        return f"StreetAccumulator({self.street_name!r}, records={self.record_count})"
@@ -0,0 +1,31 @@
+# Secondary indexes of the alerts table. Every alert is written with one partition attribute
+# per query shape, each the hash key of a GSI sorted by timestamp, so GET /alerts queries
+# exactly the matching alerts newest first instead of scanning the table:
+#   no filter        -> feed-timestamp-index         feed = 'ALL'
+#   street_id        -> sensor_id-timestamp-index    sensor_id
+#   type             -> type-timestamp-index         type
+#   street_id + type -> sensor_type-timestamp-index  sensor_type = '<sensor_id>#<type>'
+# Alerts live for minutes, the single 'ALL' partition of the feed index stays small.
+FEED = 'ALL'
+
+
+def index_attributes(alert):
+    """
+    The GSI partition attributes an alert is written with, next to sensor_id and type.
+    """
+    return {'feed': FEED, 'sensor_type': f"{alert['sensor_id']}#{alert['type']}"}
+
+
+def query_index(street_id=None, alert_type=None):
+    """
+    (index name, partition attribute, partition value) answering a street and type filter.
+    """
+    if street_id and alert_type:
+        attribute, value = 'sensor_type', f"{street_id}#{alert_type}"
+    elif street_id:
+        attribute, value = 'sensor_id', street_id
+    elif alert_type:
+        attribute, value = 'type', alert_type
+    else:
+        attribute, value = 'feed', FEED
+    return f"{attribute}-timestamp-index", attribute, value
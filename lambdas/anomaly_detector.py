@@ -1,64 +1,107 @@
-import json
 import os
 import boto3
 import uuid
 from datetime import datetime
 from decimal import Decimal
 
+from alert_index import index_attributes
+from batch_failures import DeliveryError, handle_kinesis_batch
+from kinesis_decoder import decode_kinesis_records
+
 ALERTS_TABLE_NAME = os.getenv('ALERTS_TABLE_NAME')
+ALERT_TTL_SECONDS = 300  # 5 mins TTL
+
+# Alert ids are derived from the event, a retried batch overwrites its alerts instead of duplicating them
+ALERT_ID_NAMESPACE = uuid.UUID('5b0c2a4e-8f0e-4d7a-9a51-3c1f6e2d9b47')
 
 dynamodb = boto3.resource('dynamodb')
 alerts_table = dynamodb.Table(ALERTS_TABLE_NAME) if ALERTS_TABLE_NAME else None
 
-def parse_kinesis_records(records):
-    parsed_records = []
-    # ... (keeping existing parse logic from previous turn, but simplified re-write for safety)
-    import base64
-    for record in records:
-        try:
-            payload = base64.b64decode(record['kinesis']['data']).decode('utf-8')
-            data = json.loads(payload)
-            parsed_records.append(data)
-        except Exception as e:
-            print(f"Error decoding record: {e}")
-            continue
-    return parsed_records
+
+def alert_id(record, alert_type):
+    return str(uuid.uuid5(ALERT_ID_NAMESPACE, '|'.join(
+        (record.camera_id, record.timestamp, record.license_plate, alert_type))))
+
+
+def build_alert(record, alert_type, details):
+    alert = {
+        'alert_id': alert_id(record, alert_type),
+        'sensor_id': record.street_id,
+        'street_name': record.street_name,
+        'timestamp': record.timestamp,
+        'type': alert_type,
+        'location': {
+            'lat': Decimal(str(record.latitude)),
+            'lng': Decimal(str(record.longitude))
+        },
+        'details': details,
+        'expiration_time': int(datetime.now().timestamp()) + ALERT_TTL_SECONDS
+    }
+    alert.update(index_attributes(alert))
+    return alert
+
+
+def detect_ghost_driver(record):
+    """
+    Ghost Driver Detection: speed_kph < 0
+    """
+    speed = record.speed_kph
+    if speed >= 0:
+        return None
+
+    print(f"👻 GHOST DRIVER DETECTED! Speed: {speed}, Plate: {record.license_plate}")
+    return build_alert(record, 'GHOST_DRIVER', {
+        'speed_kph': Decimal(str(speed)),
+        'license_plate': record.license_plate
+    })
+
+
+# Detectors take one decoded VehicleEvent and return an alert or None
+DETECTORS = [detect_ghost_driver]
+
+
+def detect_anomalies(events, detectors=DETECTORS):
+    """
+    Run every detector over the decoded events in one pass, returns the alerts.
+    """
+    alerts = []
+    for record in events:
+        for detector in detectors:
+            alert = detector(record)
+            if alert is not None:
+                alerts.append(alert)
+    return alerts
+
+
+def save_alerts(alerts):
+    if not alerts or not alerts_table:
+        return
+
+    # Save to DynamoDB, the whole batch is retried if that fails (see batch_failures)
+    try:
+        with alerts_table.batch_writer() as batch:
+            for alert in alerts:
+                batch.put_item(Item=alert)
+    except Exception as e:
+        raise DeliveryError(f"Saving {len(alerts)} alerts failed: {e}") from e
+    print(f"Saved {len(alerts)} alerts: {', '.join(alert['alert_id'] for alert in alerts)}")
+
+
+def process_events(events):
+    """
+    Anomaly detection stage over an already decoded batch.
+    """
+    save_alerts(detect_anomalies(events))
+
 
 def lambda_handler(event, context):
     records = event.get("Records", [])
     if not records:
         return
 
-    parsed_records = parse_kinesis_records(records)
-    
-    for record in parsed_records:
-        # Ghost Driver Detection: speed_kph < 0
-        speed = record.get('speed_kph', 0)
-        
-        if speed < 0:
-            print(f"👻 GHOST DRIVER DETECTED! Speed: {speed}, Plate: {record.get('license_plate')}")
-            
-            alert = {
-                'alert_id': str(uuid.uuid4()),
-                'sensor_id': record.get('street_id'),
-                'street_name': record.get('street_name'),
-                'timestamp': record.get('timestamp', datetime.now().isoformat()),
-                'type': 'GHOST_DRIVER',
-                'location': {
-                    'lat': Decimal(str(record.get('latitude'))),
-                    'lng': Decimal(str(record.get('longitude')))
-                },
-                'details': {
-                    'speed_kph': Decimal(str(speed)),
-                    'license_plate': record.get('license_plate')
-                },
-                'expiration_time': int(datetime.now().timestamp()) + 300 # 5 mins TTL
-            }
-            
-            # Save to DynamoDB
-            if alerts_table:
-                try:
-                    alerts_table.put_item(Item=alert)
-                    print(f"Alert saved: {alert['alert_id']}")
-                except Exception as e:
-                    print(f"Error saving alert: {e}")
+    return handle_kinesis_batch(records, process_records)
+
+
+def process_records(records):
+    events, _ = decode_kinesis_records(records)
+    process_events(events)
@@ -0,0 +1,122 @@
+import os
+
+from rejections import ship_dead_letters
+
+# 'report': process the batch in order and report the first record that fails, Lambda then
+#           checkpoints everything before it and retries from there
+# 'bisect': isolate the failing records by bisecting, process every healthy record once and
+#           send the poison records to the dead-letter sink instead of retrying them
+BATCH_FAILURE_MODE = os.getenv('BATCH_FAILURE_MODE', 'report')
+
+
+class DeliveryError(Exception):
+    """
+    Raised by process when a downstream write (SQS, DynamoDB) still fails after its own retries.
+    That is no fault of a record, so it is never bisected or dead-lettered: the batch is reported
+    from first_undelivered, the index of the first record (of the records handed to process)
+    whose output was not delivered. Everything before it was delivered and is not sent again.
+    """
+
+    def __init__(self, message, first_undelivered=0):
+        super().__init__(message)
+        self.first_undelivered = first_undelivered
+
+
+def _sequence_number(record):
+    return record['kinesis']['sequenceNumber']
+
+
+def _first_failure(records, process, errors):
+    """
+    Process records in order, bisecting chunks that raise for a record.
+    Returns the index of the first record that fails on its own or was not delivered, or None.
+    """
+    try:
+        process(records)
+        return None
+    except DeliveryError as e:
+        errors.append(e)
+        return e.first_undelivered
+    except Exception as e:
+        if len(records) == 1:
+            errors.append(e)
+            return 0
+
+    middle = len(records) // 2
+    failed = _first_failure(records[:middle], process, errors)
+    if failed is not None:
+        return failed
+    failed = _first_failure(records[middle:], process, errors)
+    return None if failed is None else middle + failed
+
+
+def _all_failures(records, process, failures, offset=0):
+    """
+    Process records, bisecting chunks that raise until every failing record is isolated.
+    Appends (record, exception) to failures. A DeliveryError stops the bisection, it is
+    raised with first_undelivered counted from the start of the batch.
+    """
+    try:
+        process(records)
+        return
+    except DeliveryError as e:
+        e.first_undelivered += offset
+        raise
+    except Exception as e:
+        if len(records) == 1:
+            failures.append((records[0], e))
+            return
+
+    middle = len(records) // 2
+    _all_failures(records[:middle], process, failures, offset)
+    _all_failures(records[middle:], process, failures, offset + middle)
+
+
+def handle_kinesis_batch(records, process):
+    """
+    Run process over the Kinesis records and build the partial batch response
+    (function_response_types = ["ReportBatchItemFailures"]).
+    process takes a list of Kinesis event records and raises if they could not be processed,
+    DeliveryError if their output could not be delivered.
+    """
+    if BATCH_FAILURE_MODE == 'bisect':
+        failures = []
+        undelivered = None
+        try:
+            _all_failures(records, process, failures)
+        except DeliveryError as e:
+            undelivered = e
+        if undelivered is not None:
+            # Poison records isolated before the delivery failure are done with
+            if failures:
+                ship_poison_records(failures, len(records))
+            print(f"Delivery failed from record {_sequence_number(records[undelivered.first_undelivered])}, "
+                  f"retrying from there: {undelivered}")
+            return {'batchItemFailures': [{'itemIdentifier': _sequence_number(records[undelivered.first_undelivered])}]}
+        if not failures:
+            return {'batchItemFailures': []}
+
+        if len(failures) == len(records):
+            # Nothing went through, not a poison record but e.g. a downstream outage: retry all
+            print(f"All {len(records)} records failed, last error: {failures[-1][1]}")
+            return {'batchItemFailures': [{'itemIdentifier': _sequence_number(records[0])}]}
+
+        ship_poison_records(failures, len(records))
+        return {'batchItemFailures': []}
+
+    errors = []
+    failed = _first_failure(records, process, errors)
+    if failed is None:
+        return {'batchItemFailures': []}
+
+    print(f"Processed {failed} of {len(records)} records, "
+          f"record {_sequence_number(records[failed])} failed: {errors[-1]}")
+    return {'batchItemFailures': [{'itemIdentifier': _sequence_number(records[failed])}]}
+
+
+def ship_poison_records(failures, batch_size):
+    print(f"Isolated {len(failures)} poison records out of {batch_size}")
+    ship_dead_letters([
+        {'stage': 'Processing', 'reason': str(error), 'payload': record['kinesis']}
+        for record, error in failures
+    ])
@@ -1,3 +1,15 @@
+import os
+from itertools import repeat
+from operator import itemgetter, mul, sub, truediv
+
+# Index reported for stopped traffic; the batch models saturate at this value
+STOPPED_INDEX = 999.0
+# Speeds are clamped to this floor so stopped traffic divides into the cap instead of raising
+MIN_SPEED = 1e-9
+# Jam density in vehicles per km and lane, the density model reports occupancy relative to it
+JAM_DENSITY = float(os.environ.get('JAM_DENSITY', '150'))
+# Length of one aggregation run, used to turn vehicle counts into a flow (vehicles per hour)
+CONGESTION_INTERVAL_SECONDS = float(os.environ.get('CONGESTION_INTERVAL_SECONDS', '60'))
 
 def calculate_congestion_index(speed_limit, avg_speed):
     """
@@ -13,12 +25,113 @@ def calculate_congestion_index(speed_limit, avg_speed):
     print(f"Calculating congestion index: {ci}")
     return ci
 
+def _clip(values, low, high):
+    return list(map(min, map(max, values, repeat(low)), repeat(high)))
+
+def speed_ratio_index(speed_limits, speeds, vehicle_counts, lanes, interval_seconds):
+    """
+    The original index, (vlimit - vavg) / vavg, floored at 0.
+    """
+    return _clip(map(truediv, map(sub, speed_limits, speeds), speeds), 0.0, STOPPED_INDEX)
+
+def travel_time_index(speed_limits, speeds, vehicle_counts, lanes, interval_seconds):
+    """
+    Travel time over free-flow travel time at the speed limit, vlimit / vavg, floored at 1.
+    """
+    return _clip(map(truediv, speed_limits, speeds), 1.0, STOPPED_INDEX)
+
+def density_index(speed_limits, speeds, vehicle_counts, lanes, interval_seconds):
+    """
+    Occupancy between 0 (free road) and 1 (jam density), from the density k = q / vavg
+    where q is the flow per lane in vehicles per hour.
+    """
+    flows = map(truediv, map(mul, vehicle_counts, repeat(3600.0 / interval_seconds)), lanes)
+    densities = map(truediv, flows, speeds)
+    return _clip(map(truediv, densities, repeat(JAM_DENSITY)), 0.0, 1.0)
+
+MODELS = {
+    'speed_ratio': speed_ratio_index,
+    'travel_time': travel_time_index,
+    'density': density_index,
+}
+
+def congestion_indices(speed_limits, avg_speeds, model='speed_ratio', vehicle_counts=None, lanes=None,
+                       interval_seconds=CONGESTION_INTERVAL_SECONDS):
+    """
+    Calculate congestion indices for whole columns of streets in one call.
+    Returns a list with one index per street, in input order.
+    """
+    if model not in MODELS:
+        raise ValueError(f"Unknown congestion model: {model}")
+
+    speed_limits = list(map(float, speed_limits))
+    speeds = list(map(max, map(float, avg_speeds), repeat(MIN_SPEED)))
+    if len(speeds) != len(speed_limits):
+        raise ValueError("speed_limits and avg_speeds differ in length")
+
+    if model == 'density':
+        if vehicle_counts is None:
+            raise ValueError("The density model needs vehicle_counts")
+        vehicle_counts = list(map(float, vehicle_counts))
+        lanes = list(map(max, map(float, lanes), repeat(1.0))) if lanes is not None else [1.0] * len(speeds)
+
+    return MODELS[model](speed_limits, speeds, vehicle_counts, lanes, float(interval_seconds))
+
+def calculate_congestion_indices(streets, model='speed_ratio', interval_seconds=CONGESTION_INTERVAL_SECONDS):
+    """
+    Calculate congestion indices for many streets at once.
+    Expects a list of dicts with 'street_id', 'speed_limit' and 'avg_speed' keys
+    ('vehicle_count' and 'lanes' for the density model) and returns a dict mapping
+    street_id -> congestion index. interval_seconds is the time the vehicle counts cover.
+    """
+    if not streets:
+        return {}
+
+    vehicle_counts = lanes = None
+    if model == 'density':
+        vehicle_counts = [street.get('vehicle_count', 0) for street in streets]
+        lanes = [street.get('lanes', 1) for street in streets]
+
+    indices = congestion_indices(
+        map(itemgetter('speed_limit'), streets),
+        map(itemgetter('avg_speed'), streets),
+        model=model,
+        vehicle_counts=vehicle_counts,
+        lanes=lanes,
+        interval_seconds=interval_seconds
+    )
+    return dict(zip(map(itemgetter('street_id'), streets), indices))
+
 def lambda_handler(event, context):
     """
     AWS Lambda function to calculate congestion index from speed limit and average speed.
-    Expects event to contain 'speed_limit' and 'avg_speed' keys.
+    Expects event to contain 'speed_limit' and 'avg_speed' keys, a batched 'streets'
+    list (see calculate_congestion_indices), or columnar 'speed_limits' / 'avg_speeds'
+    arrays (see congestion_indices). Batched events may select a 'model'.
     """
     try:
+        model = event.get('model', 'speed_ratio')
+
+        if 'streets' in event:
+            return {
+                'statusCode': 200,
+                'congestion_indices': calculate_congestion_indices(
+                    event['streets'], model, event.get('interval_seconds', CONGESTION_INTERVAL_SECONDS))
+            }
+
+        if 'speed_limits' in event:
+            return {
+                'statusCode': 200,
+                'congestion_indices': congestion_indices(
+                    event['speed_limits'],
+                    event['avg_speeds'],
+                    model=model,
+                    vehicle_counts=event.get('vehicle_counts'),
+                    lanes=event.get('lanes'),
+                    interval_seconds=event.get('interval_seconds', CONGESTION_INTERVAL_SECONDS)
+                )
+            }
+
         speed_limit = float(event.get('speed_limit', 0))
         avg_speed = float(event.get('avg_speed', 0))
 
@@ -34,4 +147,4 @@ def lambda_handler(event, context):
         return {
             'statusCode': 500,
             'error': str(e)
-        }
\ No newline at end of file
+        }
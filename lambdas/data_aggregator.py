@@ -1,10 +1,26 @@
 import json
 import base64
+import hashlib
 from time import time
 import boto3
 import os
+import signal
+import sys
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
+from itertools import repeat
+
+from accumulators import StreetAccumulator
+from congestion_calculation import CONGESTION_INTERVAL_SECONDS, calculate_congestion_indices
+from envelope import unpack_message
+from history import history_row, write_pane_row
+from latest_state import SNAPSHOT_UPDATE_STREETS, shard_of, snapshot_key, stamp_update
+from partial_aggregates import PARTIAL_VERSION, is_partial
+from rejections import ship_dead_letters
+from windowing import (PANE_SECONDS, WINDOW_ALLOWED_LATENESS_SECONDS, WINDOW_MAX_CLOCK_SKEW_SECONDS, WINDOW_SIZES,
+                       event_time, event_time_horizon, is_late, latest_window, pane_start, to_iso, watermark)
+from write_behind import WriteBehindBuffer
 
 dynamodb = boto3.resource('dynamodb')
 TABLE_NAME = os.environ.get('TABLE_NAME', 'StreetSpeedAggregates')
@@ -12,6 +28,40 @@ table = dynamodb.Table(TABLE_NAME)
 
 lambda_client = boto3.client('lambda')
 CALCULATION_ARN = os.environ.get('CONGESTION_CALCULATION_ARN')
+# 'local' computes congestion in-process, 'remote' sends one batched invoke per call
+CONGESTION_MODE = os.environ.get('CONGESTION_MODE', 'local')
+# Congestion model, see congestion_calculation.MODELS
+CONGESTION_MODEL = os.environ.get('CONGESTION_MODEL', 'speed_ratio')
+
+# 'window' aggregates event-time windows (see windowing.py), 'batch' aggregates each SQS batch as is
+AGGREGATION_MODE = os.environ.get('AGGREGATION_MODE', 'window')
+WINDOW_STATE_TABLE_NAME = os.environ.get('WINDOW_STATE_TABLE_NAME', 'UrbanFlowWindowState')
+window_table = dynamodb.Table(WINDOW_STATE_TABLE_NAME)
+# Key of the item holding the newest event time seen, the watermark trails it
+WATERMARK_KEY = {'street_id': '#watermark', 'pane_start': 0}
+# Pane items keep one counter per speed sketch bucket, so ADD can merge the sketch
+SPEED_BUCKET_PREFIX = 'speed_q'
+# and two counters per dimension cell, named '<prefix><grouping>|<cell>'
+DIMENSION_COUNT_PREFIX = 'dim_count|'
+DIMENSION_SPEED_PREFIX = 'dim_speed|'
+# and the markers (content hashes) of the SQS messages merged into them. An update only lands if
+# none of its messages was merged before, so a redelivered or re-sent message is not counted twice.
+# The markers live as long as the pane, each update names at most PANE_MARKER_LIMIT of them
+# (condition expressions are capped at 4 KB).
+MERGED_MESSAGES = 'merged_messages'
+PANE_MARKER_LIMIT = 100
+
+# DynamoDB calls of the window path (pane updates, pane queries, row puts) run concurrently,
+# at most this many in flight
+DYNAMODB_MAX_WORKERS = int(os.environ.get('DYNAMODB_MAX_WORKERS', '8'))
+
+# Write each street's row at most once per this many seconds from a warm container, 0 writes
+# it on every invocation. Only applies to AGGREGATION_MODE=window, where the panes are durably
+# merged before the rows are derived from them. History rows are always written at once.
+WRITE_BEHIND_SECONDS = float(os.environ.get('WRITE_BEHIND_SECONDS', '0'))
+# Flush everything when an invocation ends with less time left than this
+WRITE_BEHIND_FLUSH_MARGIN_MS = int(os.environ.get('WRITE_BEHIND_FLUSH_MARGIN_MS', '3000'))
+street_rows = WriteBehindBuffer(WRITE_BEHIND_SECONDS)
 
 def lambda_handler(event, context):
     """
@@ -19,106 +69,631 @@ def lambda_handler(event, context):
     """
     records = event.get('Records', [])
     data_points = []
+    markers = []
 
     for record in records:
         try:
-            body = json.loads(record['body'])
-            data_points.append(body)
+            points = unpack_message(record['body'])
         except Exception as e:
             print(f"Error parsing record: {e}")
             continue
+        data_points.extend(points)
+        markers.extend([message_marker(record['body'])] * len(points))
 
     if not data_points:
         print("No valid data points found in records.")
+        flush_write_behind(context, active=set())
         return {'statusCode': 200, 'message': 'No data points to process'}
     
-    street_stats = aggregate_metrics(data_points)
-    timestamp = datetime.now().isoformat()
-    persist_aggregated_data(street_stats, timestamp)
+    if AGGREGATION_MODE == 'window':
+        persist_windows(data_points, markers)
+        flush_write_behind(context, active={data.get('street_id') for data in data_points})
+    else:
+        street_stats = aggregate_metrics(data_points)
+        timestamp = datetime.now().isoformat()
+        persist_aggregated_data(street_stats, timestamp)
 
     return {'statusCode': 200, 'message': 'Data aggregated and persisted'}
 
+def in_parallel(function, items):
+    """
+    list(map(function, items)) with at most DYNAMODB_MAX_WORKERS calls in flight, the Table
+    resources only pass the calls on to their (thread safe) client.
+    """
+    items = list(items)
+    if len(items) <= 1 or DYNAMODB_MAX_WORKERS <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(DYNAMODB_MAX_WORKERS, len(items))) as executor:
+        return list(executor.map(function, items))
+
+def message_marker(body):
+    return hashlib.blake2b(body.encode('utf-8'), digest_size=12).hexdigest()
+
+def accumulate(street, data):
+    """
+    Fold one raw record or partial aggregate into the street accumulator.
+    Raw records are buffered until the accumulator is flushed.
+    """
+    if is_partial(data):
+        street.merge_partial(data)
+    else:
+        street.add_record(data)
+
 def aggregate_metrics(data_points):
     """
     Helper function to aggregate metrics from data points.
+    Data points are raw records or per-street partial aggregates built by the validator.
     """
     stats = {}
 
     for data in data_points:
         s_id = data.get('street_id')
-        speed = data.get('speed_kph', 0)
-        limit = data.get('speed_limit', 0)
-        s_name = data.get('street_name', 'Unknown')
-        license_plate = data.get('license_plate', 'Unknown')
-        lat = data.get('latitude', 0)
-        lng = data.get('longitude', 0)
-
-        if s_id not in stats:
-            stats[s_id] = {
-                'street_name': s_name,
-                'total_speed': 0,
-                'vehicle_count': 0,
-                'speed_limit': limit,
-                'license_plates': set(),
-                'latitude': lat,
-                'longitude': lng
-            }
-        stats[s_id]['total_speed'] += speed
-        if license_plate not in stats[s_id]['license_plates']:
-            stats[s_id]['license_plates'].add(license_plate)
-            stats[s_id]['vehicle_count'] += 1
+        street = stats.get(s_id)
+        if street is None:
+            street = stats[s_id] = StreetAccumulator(data)
+        if is_partial(data):
+            street.merge_partial(data)
+        else:
+            # Inlined add_record, the hot path of large batches
+            street.speeds.append(data.get('speed_kph', 0))
+            street.plates.append(data.get('license_plate', 'Unknown'))
+            street.lane_ids.append(data.get('lane_id', 1))
+            street.vehicle_types.append(data.get('vehicle_type', 'Unknown'))
+            street.violations.append(data.get('is_violation', False))
 
+    for street in stats.values():
+        street.flush()
     return stats
 
-def get_congestion_index(speed_limit, avg_speed):
+def aggregate_panes(data_points, current_watermark, markers=None, sources=None, future=None):
     """
-    Invoke congestion index calculation function
+    Fold data points into per (street_id, pane_start) stats, each data point is touched once.
+    Returns the pane stats, the number of late data points dropped and the newest event time.
+    If markers (the message marker of each data point) and a sources dict are given, the data
+    points of each pane are collected into sources[(street_id, pane_start)][marker].
+    Data points stamped beyond the event time horizon are left out, and appended to future if given.
     """
+    panes = {}
+    late = 0
+    max_event_time = None
+    horizon = event_time_horizon(time())
+
+    for data, marker in zip(data_points, markers or repeat(None)):
+        if is_partial(data):
+            if 'pane_start' in data:
+                pane, t = data['pane_start'], data['event_time_max']
+            else:
+                # Partials from before event-time windows carry no timestamps
+                t = datetime.now().timestamp()
+                pane = pane_start(t)
+        else:
+            t = event_time(data['timestamp'])
+            pane = pane_start(t)
+
+        if t > horizon:
+            if future is not None:
+                future.append(data)
+            continue
+        if is_late(pane, current_watermark):
+            late += 1
+            continue
+        if max_event_time is None or t > max_event_time:
+            max_event_time = t
+
+        key = (data.get('street_id'), pane)
+        street = panes.get(key)
+        if street is None:
+            street = panes[key] = StreetAccumulator(data)
+        accumulate(street, data)
+        if sources is not None:
+            sources.setdefault(key, {}).setdefault(marker, []).append(data)
+
+    for street in panes.values():
+        street.flush()
+    return panes, late, max_event_time
+
+def get_congestion_indices(streets, interval_seconds=CONGESTION_INTERVAL_SECONDS):
+    """
+    Compute congestion indices for all streets of one aggregation run, whose vehicle
+    counts cover interval_seconds (a window or rollup length).
+    Returns a dict street_id -> congestion index (-1 if unavailable).
+    """
+    if CONGESTION_MODE != 'remote':
+        return calculate_congestion_indices(streets, CONGESTION_MODEL, interval_seconds)
+
     if not CALCULATION_ARN:
         print("Congestion calculation ARN not set.")
-        return -1
+        return {street['street_id']: -1 for street in streets}
 
     try:
-        invoke_payload = {
-            'speed_limit': speed_limit,
-            'avg_speed': avg_speed
-        }
-
         response = lambda_client.invoke(
             FunctionName=CALCULATION_ARN,
             InvocationType='RequestResponse',
-            Payload=json.dumps(invoke_payload)
+            Payload=json.dumps({'streets': streets, 'model': CONGESTION_MODEL, 'interval_seconds': interval_seconds})
         )
 
         response_payload = json.loads(response['Payload'].read())
-        return response_payload.get('congestion_index', -1)
+        indices = response_payload.get('congestion_indices', {})
+        return {street['street_id']: indices.get(street['street_id'], -1) for street in streets}
 
     except Exception as e:
         print(f"Error invoking congestion calculation function: {e}")
-        return -1
+        return {street['street_id']: -1 for street in streets}
+
+def average_speed(stats):
+    # Speeds are summed over every record, so they are averaged over every record too
+    return stats.total_speed / stats.record_count if stats.record_count > 0 else 0
+
+def congestion_request(s_id, stats):
+    return {'street_id': s_id, 'speed_limit': stats.speed_limit, 'avg_speed': average_speed(stats),
+            'vehicle_count': stats.vehicle_count, 'lanes': stats.lanes}
+
+def build_item(s_id, stats, congestion_index, timestamp):
+    return {
+        'street_id': s_id,
+        'street_name': stats.street_name,
+        'average_speed_kph': Decimal(str(round(average_speed(stats), 2))),
+        'speed_limit_kph': Decimal(str(stats.speed_limit)),
+        'vehicle_count': stats.vehicle_count,
+        'congestion_index': Decimal(str(round(congestion_index, 4))),
+        'timestamp_utc': timestamp,
+        'latitude': Decimal(str(stats.latitude)),
+        'longitude': Decimal(str(stats.longitude)),
+        'min_speed_kph': Decimal(str(stats.min_speed)),
+        'max_speed_kph': Decimal(str(stats.max_speed)),
+        'speed_sketch': stats.speed_sketch.encode(),
+        'dimensions': dimension_summary(stats)
+    }
+
+def dimension_summary(stats):
+    """
+    Dimension cells of an item, with the sum next to the average so rows can be merged again.
+    """
+    return {
+        grouping: {
+            key: {'count': count, 'speed_sum': Decimal(str(speed_sum)),
+                  'average_speed_kph': Decimal(str(round(speed_sum / count, 2)))}
+            for key, (count, speed_sum) in cells.items()
+        }
+        for grouping, cells in stats.dimensions.items()
+    }
 
 def persist_aggregated_data(street_stats, timestamp):
     """
     Persist aggregated data to DynamoDB.
     """
+    congestion_indices = get_congestion_indices([
+        congestion_request(s_id, stats) for s_id, stats in street_stats.items()
+    ])
 
+    updated_at = int(time() * 1000)
+    items = [
+        stamp_update(build_item(s_id, stats, congestion_indices[s_id], timestamp), updated_at)
+        for s_id, stats in street_stats.items()
+    ]
     with table.batch_writer() as batch:
-        for s_id, stats in street_stats.items():
-            avg_speed = stats['total_speed'] / stats['vehicle_count'] if stats['vehicle_count'] > 0 else 0
-
-            congestion_index = get_congestion_index(stats['speed_limit'], avg_speed)
-
-            item = {
-                'street_id': s_id,
-                'street_name': stats['street_name'],
-                'average_speed_kph': Decimal(str(round(avg_speed, 2))),
-                'speed_limit_kph': stats['speed_limit'],
-                'vehicle_count': stats['vehicle_count'],
-                'congestion_index': Decimal(str(round(congestion_index, 4))),
-                'timestamp_utc': timestamp,
-                'latitude': Decimal(str(stats['latitude'])),
-                'longitude': Decimal(str(stats['longitude']))
-            }
+        for item in items:
             batch.put_item(Item=item)
+    update_latest_snapshot(items)
+
+    print(f"Saved aggregated data for {len(street_stats)} streets to DynamoDB.")
+
+def update_latest_snapshot(rows):
+    """
+    Copy freshly written street rows into their latest-state snapshot shards (see latest_state.py).
+    Entries are guarded like the rows, a chunk holding a stale row falls back to one update per street.
+    """
+    shards = {}
+    for row in rows:
+        shards.setdefault(shard_of(row['street_id']), []).append(row)
+
+    def update(entry):
+        shard, chunk = entry
+        try:
+            set_snapshot_rows(shard, chunk)
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            for row in chunk:
+                try:
+                    set_snapshot_rows(shard, [row])
+                except table.meta.client.exceptions.ConditionalCheckFailedException:
+                    pass
+
+    # Every chunk sets its own streets' entries, so the chunks can go out together
+    in_parallel(update, [(shard, shard_rows[i:i + SNAPSHOT_UPDATE_STREETS])
+                         for shard, shard_rows in shards.items()
+                         for i in range(0, len(shard_rows), SNAPSHOT_UPDATE_STREETS)])
+
+def set_snapshot_rows(shard, rows):
+    names, values, assignments, conditions = {}, {}, [], []
+    for n, row in enumerate(rows):
+        names[f'#s{n}'] = row['street_id']
+        values[f':r{n}'] = row
+        assignments.append(f'#s{n} = :r{n}')
+        if 'window_start_utc' in row:
+            values[f':w{n}'] = row['window_start_utc']
+            values[f':c{n}'] = row['record_count']
+            conditions.append(f'(attribute_not_exists(#s{n}.window_start_utc) OR #s{n}.window_start_utc < :w{n} '
+                              f'OR (#s{n}.window_start_utc = :w{n} AND #s{n}.record_count <= :c{n}))')
+        else:
+            values[f':t{n}'] = row['timestamp_utc']
+            conditions.append(f'(attribute_not_exists(#s{n}) OR #s{n}.timestamp_utc <= :t{n})')
+
+    table.update_item(
+        Key=snapshot_key(shard),
+        UpdateExpression='SET ' + ', '.join(assignments),
+        ConditionExpression=' AND '.join(conditions),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values
+    )
+
+def _number(value):
+    return int(value) if value == int(value) else float(value)
+
+def load_max_event_time():
+    item = window_table.get_item(Key=WATERMARK_KEY, ConsistentRead=True).get('Item')
+    if not item or 'max_event_time' not in item:
+        return None
+    return float(item['max_event_time'])
+
+def advance_max_event_time(stored, batch_max):
+    """
+    Move the newest event time forward, never backwards, and return it.
+    """
+    if batch_max is None or (stored is not None and batch_max <= stored):
+        return stored
+
+    try:
+        window_table.update_item(
+            Key=WATERMARK_KEY,
+            UpdateExpression='SET max_event_time = :t',
+            ConditionExpression='attribute_not_exists(max_event_time) OR max_event_time < :t',
+            ExpressionAttributeValues={':t': Decimal(str(batch_max))}
+        )
+    except window_table.meta.client.exceptions.ConditionalCheckFailedException:
+        # A concurrent invocation has already seen newer events
+        pass
+    return batch_max
+
+def save_panes(panes, sources=None, refused=None):
+    """
+    Merge pane stats into the window state table. ADD keeps concurrent invocations from
+    overwriting each other and lets late data update panes that were already written.
+    If sources (see aggregate_panes) is given, each update adds the markers of its messages and
+    only lands if none of them was merged before, the keys of refused updates (or of panes built
+    from more than PANE_MARKER_LIMIT messages) are appended to refused.
+    Returns the merged pane items, so the combined totals need no extra read.
+    """
+    retention = PANE_SECONDS + WINDOW_SIZES[-1] + WINDOW_ALLOWED_LATENESS_SECONDS
+
+    def save(entry):
+        (s_id, pane), stats = entry
+        marker_kwargs = {}
+        marker_values = {}
+        if sources is not None:
+            markers = sorted(sources[(s_id, pane)])
+            if len(markers) > PANE_MARKER_LIMIT:
+                return (s_id, pane), None
+            marker_values = {':markers': set(markers), **{f':m{n}': marker for n, marker in enumerate(markers)}}
+            marker_kwargs['ConditionExpression'] = ' AND '.join(
+                f'NOT contains({MERGED_MESSAGES}, :m{n})' for n in range(len(markers)))
+
+        buckets = stats.speed_sketch.counts
+        adds = ['speed_sum :sum', 'record_count :count', 'plate_registers :plates',
+                'speed_bounds :bounds', 'lanes_seen :lanes']
+        adds.extend(f'{SPEED_BUCKET_PREFIX}{i} :q{i}' for i in buckets)
+        if marker_values:
+            adds.append(f'{MERGED_MESSAGES} :markers')
+        cells = [(f'{grouping}|{key}', cell)
+                 for grouping, grouping_cells in stats.dimensions.items() for key, cell in grouping_cells.items()]
+        dimension_kwargs = {}
+        if cells:
+            # Cell names hold arbitrary values, so they go through placeholders
+            adds.extend(f'#c{n} :c{n}, #v{n} :v{n}' for n in range(len(cells)))
+            dimension_kwargs['ExpressionAttributeNames'] = {
+                **{f'#c{n}': DIMENSION_COUNT_PREFIX + name for n, (name, _) in enumerate(cells)},
+                **{f'#v{n}': DIMENSION_SPEED_PREFIX + name for n, (name, _) in enumerate(cells)}
+            }
+        try:
+            response = window_table.update_item(
+                Key={'street_id': s_id, 'pane_start': pane},
+                UpdateExpression='ADD ' + ', '.join(adds) + ' '
+                                 'SET street_name = :name, speed_limit = :limit, latitude = :lat, '
+                                 'longitude = :lon, expiration_time = :ttl',
+                ExpressionAttributeValues={
+                    **marker_values,
+                    **{f':q{i}': count for i, count in buckets.items()},
+                    **{f':c{n}': count for n, (_, (count, _)) in enumerate(cells)},
+                    **{f':v{n}': Decimal(str(speed_sum)) for n, (_, (_, speed_sum)) in enumerate(cells)},
+                    ':sum': Decimal(str(stats.total_speed)),
+                    ':count': stats.record_count,
+                    ':plates': set(stats.vehicle_sketch.encode()),
+                    ':bounds': {Decimal(str(stats.min_speed)), Decimal(str(stats.max_speed))},
+                    ':lanes': {stats.lanes},
+                    ':name': stats.street_name,
+                    ':limit': Decimal(str(stats.speed_limit)),
+                    ':lat': Decimal(str(stats.latitude)),
+                    ':lon': Decimal(str(stats.longitude)),
+                    ':ttl': pane + retention
+                },
+                ReturnValues='ALL_NEW',
+                **dimension_kwargs,
+                **marker_kwargs
+            )
+        except window_table.meta.client.exceptions.ConditionalCheckFailedException:
+            return (s_id, pane), None
+        return (s_id, pane), response['Attributes']
+
+    merged = {}
+    for key, attributes in in_parallel(save, panes.items()):
+        if attributes is None:
+            refused.append(key)
+        else:
+            merged[key] = attributes
+
+    return merged
+
+def save_message_panes(panes, sources):
+    """
+    save_panes with the messages behind each pane as markers. A refused pane is rebuilt from the
+    messages not merged into it yet, at most PANE_MARKER_LIMIT per update, until all of them are.
+    """
+    refused = []
+    merged = save_panes(panes, sources, refused)
+    while refused:
+        pending, refused = refused, []
+        for s_id, pane in pending:
+            key = (s_id, pane)
+            item = window_table.get_item(Key={'street_id': s_id, 'pane_start': pane}, ConsistentRead=True).get('Item')
+            missing = sorted(set(sources[key]) - set((item or {}).get(MERGED_MESSAGES, ())))
+            if not missing:
+                merged[key] = item
+                continue
+            chunk = {marker: sources[key][marker] for marker in missing[:PANE_MARKER_LIMIT]}
+            stats = None
+            for data in (data for points in chunk.values() for data in points):
+                stats = stats or StreetAccumulator(data)
+                accumulate(stats, data)
+            stats.flush()
+            merged.update(save_panes({key: stats}, {key: chunk}, refused))
+            if len(missing) > PANE_MARKER_LIMIT and key not in refused:
+                refused.append(key)
+    return merged
+
+def query_panes(s_id, from_pane):
+    items = []
+    kwargs = {
+        'KeyConditionExpression': 'street_id = :s AND pane_start >= :from',
+        'ExpressionAttributeValues': {':s': s_id, ':from': from_pane},
+        'ConsistentRead': True
+    }
+
+    while True:
+        response = window_table.query(**kwargs)
+        items.extend(response.get('Items', []))
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            break
+        kwargs['ExclusiveStartKey'] = last_key
+
+    return items
+
+def pane_partial(item):
+    """
+    Turn a window state item back into a partial aggregate.
+    """
+    return {
+        'partial_version': PARTIAL_VERSION,
+        'street_id': item['street_id'],
+        'street_name': item.get('street_name', 'Unknown'),
+        'speed_limit': _number(item.get('speed_limit', 0)),
+        'latitude': _number(item.get('latitude', 0)),
+        'longitude': _number(item.get('longitude', 0)),
+        'speed_sum': _number(item['speed_sum']),
+        'count': int(item['record_count']),
+        'speed_min': _number(min(item['speed_bounds'])),
+        'speed_max': _number(max(item['speed_bounds'])),
+        'lanes': int(max(item['lanes_seen'])),
+        'speed_buckets': {
+            int(key[len(SPEED_BUCKET_PREFIX):]): count
+            for key, count in item.items() if key.startswith(SPEED_BUCKET_PREFIX)
+        },
+        'plate_registers': item.get('plate_registers', ()),
+        'license_plates': item.get('license_plates', ()),
+        'dimensions': pane_dimensions(item)
+    }
+
+def pane_dimensions(item):
+    dimensions = {}
+    for name, count in item.items():
+        if name.startswith(DIMENSION_COUNT_PREFIX):
+            cell = name[len(DIMENSION_COUNT_PREFIX):]
+            grouping, key = cell.split('|', 1)
+            dimensions.setdefault(grouping, {})[key] = [int(count), _number(item[DIMENSION_SPEED_PREFIX + cell])]
+    return dimensions
+
+def street_windows(pane_items):
+    """
+    Assemble the newest window of every size from a street's panes.
+    Returns {size: (start, end, stats)}.
+    """
+    panes = {int(item['pane_start']): pane_partial(item) for item in pane_items}
+    latest = max(panes)
+    windows = {}
+
+    for size in WINDOW_SIZES:
+        start, end = latest_window(size, latest)
+        stats = StreetAccumulator(panes[latest])
+        for pane, partial in panes.items():
+            if start <= pane < end:
+                stats.merge_partial(partial)
+        windows[size] = (start, end, stats.flush())
+
+    return windows
+
+def persist_windows(data_points, markers=None):
+    """
+    Event-time path: fold the data points into panes, merge them into the window state
+    and write each touched street's newest windows to the aggregated table.
+    markers holds the marker of the SQS message each data point came from (see save_panes).
+    """
+    stored_max = load_max_event_time()
+    sources = {} if markers is not None else None
+    future = []
+    panes, late, batch_max = aggregate_panes(data_points, watermark(stored_max), markers, sources, future)
+    if late:
+        print(f"Dropped {late} data points behind the watermark "
+              f"(allowed lateness {WINDOW_ALLOWED_LATENESS_SECONDS}s).")
+    if future:
+        # Kept out of the panes and the watermark, a skewed camera clock would close everyone's windows
+        print(f"Rejected {len(future)} data points stamped more than {WINDOW_MAX_CLOCK_SKEW_SECONDS}s ahead.")
+        ship_dead_letters([
+            {'stage': 'Windowing', 'reason': 'Event time ahead of the processing time', 'payload': data}
+            for data in future
+        ])
+    if not panes:
+        return
+
+    merged = save_panes(panes) if sources is None else save_message_panes(panes, sources)
+    current_watermark = watermark(advance_max_event_time(stored_max, batch_max))
+
+    pane_bounds = {}
+    for s_id, pane in panes:
+        first, last = pane_bounds.get(s_id, (pane, pane))
+        pane_bounds[s_id] = (min(first, pane), max(last, pane))
+
+    pane_stats = {}
+    for key, attributes in merged.items():
+        partial = pane_partial(attributes)
+        pane_stats[key] = StreetAccumulator(partial)
+        pane_stats[key].merge_partial(partial)
+        pane_stats[key].flush()
+
+    def windows_of(entry):
+        s_id, (first, last) = entry
+        windows = {}
+        if WINDOW_SIZES[-1] > PANE_SECONDS:
+            # Windows longer than a pane need the street's other panes
+            windows = street_windows(query_panes(s_id, first - WINDOW_SIZES[-1]))
+        windows[PANE_SECONDS] = (last, last + PANE_SECONDS, pane_stats[(s_id, last)])
+        return s_id, windows
+
+    results = dict(in_parallel(windows_of, pane_bounds.items()))
+
+    persist_window_results(results, current_watermark)
+    persist_pane_history(pane_stats)
+
+def persist_pane_history(pane_stats):
+    """
+    Write the merged totals of every touched pane to the 1-minute history series.
+    """
+    congestion_indices = get_congestion_indices([
+        congestion_request(f"{s_id}#{pane}", stats) for (s_id, pane), stats in pane_stats.items()
+    ], PANE_SECONDS)
+    # Not buffered like the street rows (see write_behind.py), guarded like them on record_count
+    in_parallel(write_pane_row, [
+        history_row(build_item(s_id, stats, congestion_indices[f"{s_id}#{pane}"], to_iso(pane + PANE_SECONDS)),
+                    stats, PANE_SECONDS, pane)
+        for (s_id, pane), stats in pane_stats.items()
+    ])
+
+def persist_window_results(results, current_watermark):
+    """
+    One row per street: the newest pane's merged totals at the top level plus every window
+    size under 'windows'. Windows ending before the watermark are final.
+    The write only lands if the row does not already hold a newer pane or more records of
+    the same pane, so a slower concurrent invocation cannot replace fresher totals.
+    """
+    sizes = sorted(set(WINDOW_SIZES) | {PANE_SECONDS})
+    congestion_indices = {
+        size: get_congestion_indices([
+            congestion_request(s_id, windows[size][2]) for s_id, windows in results.items()
+        ], size)
+        for size in sizes
+    }
+
+    def summary(s_id, size, windows):
+        start, end, stats = windows[size]
+        item = build_item(s_id, stats, congestion_indices[size][s_id], to_iso(end))
+        item.update({
+            'window_start_utc': to_iso(start),
+            'window_final': current_watermark is not None and end <= current_watermark
+        })
+        return item
+
+    items = {}
+    for s_id, windows in results.items():
+        summaries = {}
+        for size in WINDOW_SIZES:
+            window = summary(s_id, size, windows)
+            for key in ('street_id', 'street_name', 'speed_limit_kph', 'latitude', 'longitude'):
+                del window[key]
+            summaries[str(size)] = window
+
+        item = summary(s_id, PANE_SECONDS, windows)
+        item.update({
+            'window_seconds': PANE_SECONDS,
+            'record_count': windows[PANE_SECONDS][2].record_count,
+            'windows': summaries
+        })
+        items[s_id] = item
+
+    if WRITE_BEHIND_SECONDS > 0:
+        for s_id, item in items.items():
+            street_rows.add(s_id, item)
+    else:
+        write_street_rows(items)
+
+def write_street_rows(items):
+    """
+    Guarded puts of the street rows built by persist_window_results, the rows that land
+    also go to the latest-state snapshot.
+    """
+    updated_at = int(time() * 1000)
+
+    def put(item):
+        stamp_update(item, updated_at)
+        try:
+            table.put_item(
+                Item=item,
+                ConditionExpression='attribute_not_exists(window_start_utc) OR window_start_utc < :start '
+                                    'OR (window_start_utc = :start AND record_count <= :count)',
+                ExpressionAttributeValues={':start': item['window_start_utc'], ':count': item['record_count']}
+            )
+            return item
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            return None
+
+    written = [item for item in in_parallel(put, items.values()) if item is not None]
+    update_latest_snapshot(written)
+
+    print(f"Saved windowed aggregates for {len(written)} streets to DynamoDB "
+          f"({len(items) - len(written)} superseded by newer totals).")
+
+def flush_write_behind(context=None, force=False, active=None):
+    """
+    Write the buffered rows that are due, or all of them when forced or when the invocation
+    is close to its timeout. active holds the street ids of the invocation, the rows of
+    streets missing from it have gone quiet and are written too (see write_behind.py).
+    """
+    if WRITE_BEHIND_SECONDS <= 0:
+        return
+    if context is not None and context.get_remaining_time_in_millis() < WRITE_BEHIND_FLUSH_MARGIN_MS:
+        force = True
+
+    # The panes behind these rows are already merged, a failed write must not fail the batch
+    rows = street_rows.take(force, active)
+    if rows:
+        try:
+            write_street_rows(rows)
+        except Exception as e:
+            print(f"Error flushing {len(rows)} buffered rows, keeping them for the next flush: {e}")
+            street_rows.restore(rows)
+    print(f"Write-behind: street rows {street_rows.stats}, {len(street_rows)} pending.")
+
+def _flush_on_shutdown(signum, frame):
+    # Lambda only sends SIGTERM to functions with a registered extension
+    flush_write_behind(force=True)
+    sys.exit(0)
 
-    print(f"Saved aggregated data for {len(street_stats)} streets to DynamoDB.")
\ No newline at end of file
+if WRITE_BEHIND_SECONDS > 0:
+    signal.signal(signal.SIGTERM, _flush_on_shutdown)
@@ -0,0 +1,80 @@
+# Breakdowns of the street aggregates by further record fields (lane, vehicle type,
+# violation flag), declared as groupings and computed in the same pass as the street
+# totals. Every cell keeps [count, speed_sum], so cells merge by addition like the
+# street totals do: across partials, panes, windows and history rollups.
+import os
+
+# Buffered by StreetAccumulator from lane_id, vehicle_type and is_violation
+DIMENSIONS = ('lane', 'vehicle_type', 'violation')
+# Comma separated groupings, '+' crosses dimensions, e.g. "lane,vehicle_type,lane+vehicle_type"
+AGGREGATION_DIMENSIONS = [
+    grouping for grouping in os.environ.get('AGGREGATION_DIMENSIONS', 'lane,vehicle_type,violation').split(',')
+    if grouping
+]
+GROUPINGS = [(grouping, grouping.split('+')) for grouping in AGGREGATION_DIMENSIONS]
+
+for _, _names in GROUPINGS:
+    for _name in _names:
+        if _name not in DIMENSIONS:
+            raise ValueError(f"Unknown aggregation dimension '{_name}', expected one of {DIMENSIONS}")
+
+
+def cell_key(value):
+    """
+    Cell name of a dimension value or a tuple of them, e.g. '2', 'Truck' or '2|Truck'.
+    """
+    if isinstance(value, tuple):
+        return '|'.join(map(cell_key, value))
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def group(columns, speeds):
+    """
+    Count and sum the speeds of every configured grouping over buffered record columns
+    ({dimension: values}, aligned with speeds). The records are counted once, by the
+    combination of every dimension the groupings use, and each grouping is then summed up
+    from those few combinations. Cell names are only built once per distinct value.
+    Returns {grouping: {cell: [count, speed_sum]}}.
+    """
+    if not GROUPINGS:
+        return {}
+    used = [name for name in DIMENSIONS if any(name in names for _, names in GROUPINGS)]
+    combinations = {}
+    for key, speed in zip(zip(*(columns[name] for name in used)), speeds):
+        cell = combinations.get(key)
+        if cell is None:
+            cell = combinations[key] = [0, 0]
+        cell[0] += 1
+        cell[1] += speed
+
+    result = {}
+    for grouping, names in GROUPINGS:
+        positions = [used.index(name) for name in names]
+        cells = {}
+        for combination, (count, speed_sum) in combinations.items():
+            key = tuple(combination[i] for i in positions) if len(positions) > 1 else combination[positions[0]]
+            cell = cells.get(key)
+            if cell is None:
+                cells[key] = [count, speed_sum]
+            else:
+                cell[0] += count
+                cell[1] += speed_sum
+        result[grouping] = {cell_key(key): cell for key, cell in cells.items()}
+    return result
+
+
+def merge(target, source):
+    """
+    Add the cells of source into target, both {grouping: {cell: [count, speed_sum]}}.
+    """
+    for grouping, cells in source.items():
+        merged = target.setdefault(grouping, {})
+        for key, (count, speed_sum) in cells.items():
+            cell = merged.get(key)
+            if cell is None:
+                merged[key] = [count, speed_sum]
+            else:
+                cell[0] += count
+                cell[1] += speed_sum
@@ -0,0 +1,86 @@
+import json
+import zlib
+import base64
+
+# Versioned envelope that packs many records into one SQS message:
+#   {"envelope_version": 1, "records": [...]}
+# or, compressed (zlib, base64 so the body stays valid SQS text):
+#   {"envelope_version": 1, "encoding": "zlib", "data": "<base64>"}
+# Messages without "envelope_version" are legacy single-record messages.
+ENVELOPE_VERSION = 1
+
+# SQS rejects message bodies above 256 KiB and batch requests whose bodies add up to more
+# than that, keep enough headroom that a single message always fits into a batch request
+MAX_MESSAGE_BYTES = 240 * 1024
+
+_PREFIX = f'{{"envelope_version": {ENVELOPE_VERSION}, "records": ['
+_SUFFIX = ']}'
+
+
+def _encode(serialized, compress):
+    body = _PREFIX + ",".join(serialized) + _SUFFIX
+    if not compress:
+        return body
+    data = base64.b64encode(zlib.compress(body.encode('utf-8'), 1)).decode('ascii')
+    return json.dumps({'envelope_version': ENVELOPE_VERSION, 'encoding': 'zlib', 'data': data})
+
+
+def _split_oversized(serialized, compress, max_bytes):
+    """
+    Encode a chunk of serialized records, halving it until every message fits into max_bytes.
+    """
+    body = _encode(serialized, compress)
+    if len(body) <= max_bytes or len(serialized) == 1:
+        return [(body, len(serialized))]
+    middle = len(serialized) // 2
+    return (_split_oversized(serialized[:middle], compress, max_bytes) +
+            _split_oversized(serialized[middle:], compress, max_bytes))
+
+
+def pack_records(records, compress=False, max_bytes=MAX_MESSAGE_BYTES):
+    """
+    Pack records into as few envelope messages as possible, each at most max_bytes long.
+    Returns a list of (message_body, record_count) tuples.
+    """
+    # json.dumps escapes non-ASCII characters, so the string length equals the byte length
+    serialized = [json.dumps(record) for record in records]
+    budget = max_bytes - len(_PREFIX) - len(_SUFFIX)
+    if compress:
+        # compressed JSON is far smaller, oversized messages get split after compression
+        budget *= 4
+
+    messages = []
+    chunk = []
+    size = 0
+    for item in serialized:
+        if chunk and size + len(item) + 1 > budget:
+            messages.extend(_split_oversized(chunk, compress, max_bytes))
+            chunk = []
+            size = 0
+        chunk.append(item)
+        size += len(item) + 1
+
+    if chunk:
+        messages.extend(_split_oversized(chunk, compress, max_bytes))
+    return messages
+
+
+def unpack_message(body):
+    """
+    Return the list of records carried by an SQS message body,
+    either an envelope (compressed or not) or a legacy single-record message.
+    """
+    message = json.loads(body)
+    if not isinstance(message, dict) or 'envelope_version' not in message:
+        return [message]
+
+    version = message['envelope_version']
+    if version != ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported envelope version: {version}")
+
+    if message.get('encoding') == 'zlib':
+        message = json.loads(zlib.decompress(base64.b64decode(message['data'])))
+    elif 'encoding' in message:
+        raise ValueError(f"Unsupported envelope encoding: {message['encoding']}")
+
+    return message.get('records', [])
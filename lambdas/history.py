@@ -0,0 +1,124 @@
+# Time-series history of the street aggregates, one row per street, resolution and window.
+# The aggregator writes the 1-minute pane rows, history_rollup downsamples them into the
+# coarser series. Rows keep the mergeable state (sums, counts, sketches) next to the
+# derived fields, so any series can be rolled up from a finer one.
+import os
+import boto3
+from decimal import Decimal
+
+from partial_aggregates import PARTIAL_VERSION
+from windowing import PANE_SECONDS, to_iso
+
+HISTORY_TABLE_NAME = os.environ.get('HISTORY_TABLE_NAME', 'UrbanFlowTrafficHistory')
+# resolution_seconds:retention_days for every series, the finest one is the pane
+HISTORY_RETENTION_DAYS = {
+    int(resolution): float(days)
+    for resolution, days in (pair.split(':') for pair in os.environ.get(
+        'HISTORY_RETENTION_DAYS', f'{PANE_SECONDS}:7,900:90,3600:400').split(','))
+}
+ROLLUP_RESOLUTIONS = sorted(r for r in HISTORY_RETENTION_DAYS if r > PANE_SECONDS)
+
+dynamodb = boto3.resource('dynamodb')
+history_table = dynamodb.Table(HISTORY_TABLE_NAME)
+
+
+def window_id(resolution, start):
+    """
+    Sort key of a history row, ISO timestamps keep the rows of one series in time order.
+    """
+    return f"{resolution}#{to_iso(start)}"
+
+
+def history_row(item, accumulator, resolution, start):
+    """
+    Extend an aggregate item (data_aggregator.build_item) into a history row.
+    """
+    row = dict(item)
+    row.update({
+        'window_id': window_id(resolution, start),
+        'resolution_seconds': resolution,
+        'window_start_utc': to_iso(start),
+        'window_end_utc': to_iso(start + resolution),
+        'record_count': accumulator.record_count,
+        'speed_sum': Decimal(str(accumulator.total_speed)),
+        'lanes': accumulator.lanes,
+        'expiration_time': int(start + resolution + HISTORY_RETENTION_DAYS[resolution] * 86400)
+    })
+    registers = accumulator.vehicle_sketch.encode()
+    if registers:
+        # DynamoDB rejects empty sets
+        row['plate_registers'] = set(registers)
+    return row
+
+
+def history_partial(row):
+    """
+    Turn a history row back into a partial aggregate for StreetAccumulator.merge_partial.
+    """
+    return {
+        'partial_version': PARTIAL_VERSION,
+        'street_id': row['street_id'],
+        'street_name': row.get('street_name', 'Unknown'),
+        'speed_limit': float(row['speed_limit_kph']),
+        'latitude': float(row['latitude']),
+        'longitude': float(row['longitude']),
+        'speed_sum': float(row['speed_sum']),
+        'count': int(row['record_count']),
+        'speed_min': float(row['min_speed_kph']),
+        'speed_max': float(row['max_speed_kph']),
+        'lanes': int(row['lanes']),
+        'speed_sketch': row['speed_sketch'],
+        'plate_registers': row.get('plate_registers', ()),
+        'dimensions': {
+            grouping: {key: [int(cell['count']), float(cell['speed_sum'])] for key, cell in cells.items()}
+            for grouping, cells in row.get('dimensions', {}).items()
+        }
+    }
+
+
+def write_rows(rows):
+    with history_table.batch_writer(overwrite_by_pkeys=['street_id', 'window_id']) as batch:
+        for row in rows:
+            batch.put_item(Item=row)
+
+
+def write_pane_row(row):
+    """
+    Guarded put of a pane row, it only lands if the stored row does not hold more records of the
+    pane, so a concurrent invocation with smaller merged totals cannot overwrite larger ones.
+    Returns whether the row was written.
+    """
+    try:
+        history_table.put_item(
+            Item=row,
+            ConditionExpression='attribute_not_exists(record_count) OR record_count <= :count',
+            ExpressionAttributeValues={':count': row['record_count']}
+        )
+        return True
+    except history_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+
+def query_rows(s_id, resolution, start, end):
+    """
+    Rows of one series with a window start in [start, end).
+    """
+    rows = []
+    kwargs = {
+        'KeyConditionExpression': 'street_id = :s AND window_id BETWEEN :from AND :to',
+        'ExpressionAttributeValues': {
+            ':s': s_id,
+            ':from': window_id(resolution, start),
+            ':to': window_id(resolution, end - 1)
+        }
+    }
+
+    while True:
+        response = history_table.query(**kwargs)
+        rows.extend(response.get('Items', []))
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            break
+        kwargs['ExclusiveStartKey'] = last_key
+
+    return rows
@@ -0,0 +1,109 @@
+# Scheduled downsampling of the 1-minute history into the coarser series (15 minutes and
+# hourly by default). Each resolution is built from the next finer one by merging the
+# accumulator state of its rows, so sums, bounds, distinct vehicles and percentiles are
+# exact merges rather than averages of averages. Only intervals that ended behind the
+# watermark are written, and rows are overwritten by key, so re-runs are harmless.
+import os
+
+import data_aggregator
+from accumulators import StreetAccumulator
+from history import ROLLUP_RESOLUTIONS, history_partial, history_row, query_rows, write_rows
+from windowing import PANE_SECONDS, event_time, to_iso, watermark
+
+# How far back each run re-reads the finest series, covers missed or late runs
+ROLLUP_LOOKBACK_SECONDS = int(os.environ.get('ROLLUP_LOOKBACK_SECONDS', '7200'))
+
+
+def lambda_handler(event, context):
+    current_watermark = watermark(data_aggregator.load_max_event_time())
+    if current_watermark is None:
+        print("No events seen yet, nothing to roll up.")
+        return {'statusCode': 200, 'body': 'No events'}
+
+    # Panes are read up to the end of the finest series, each series is written up to its own end
+    finest = ROLLUP_RESOLUTIONS[0] if ROLLUP_RESOLUTIONS else PANE_SECONDS
+    coarsest = ROLLUP_RESOLUTIONS[-1] if ROLLUP_RESOLUTIONS else PANE_SECONDS
+    end = int(current_watermark // finest) * finest
+    start = end - end % coarsest - max(ROLLUP_LOOKBACK_SECONDS // coarsest, 1) * coarsest
+
+    rows = 0
+    for s_id in list_street_ids():
+        rows += rollup_street(s_id, start, end)
+
+    print(f"Wrote {rows} rollup rows for [{to_iso(start)}, {to_iso(end)}).")
+    return {'statusCode': 200, 'body': f'Wrote {rows} rollup rows'}
+
+
+def list_street_ids():
+    """
+    Street ids from the aggregate table, keys starting with '#' are bookkeeping items.
+    """
+    street_ids = set()
+    kwargs = {'ProjectionExpression': 'street_id'}
+    while True:
+        response = data_aggregator.table.scan(**kwargs)
+        street_ids.update(item['street_id'] for item in response.get('Items', []))
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            break
+        kwargs['ExclusiveStartKey'] = last_key
+    return sorted(s for s in street_ids if not s.startswith('#'))
+
+
+def rollup(intervals, resolution):
+    """
+    Merge {start: accumulator} intervals into {start: accumulator} of the given resolution.
+    """
+    rolled = {}
+    for start in sorted(intervals):
+        bucket = start - start % resolution
+        accumulator = intervals[start]
+        if bucket not in rolled:
+            rolled[bucket] = StreetAccumulator({
+                'street_name': accumulator.street_name,
+                'speed_limit': accumulator.speed_limit,
+                'latitude': accumulator.latitude,
+                'longitude': accumulator.longitude
+            })
+        rolled[bucket].merge(accumulator)
+    for accumulator in rolled.values():
+        accumulator.flush()
+    return rolled
+
+
+def rollup_street(s_id, start, end):
+    """
+    Roll one street's pane rows in [start, end) up into every coarser series, returns rows written.
+    Only intervals ending by end are written, a coarser one still open at end is left for a later run.
+    """
+    intervals = {}
+    for row in query_rows(s_id, PANE_SECONDS, start, end):
+        partial = history_partial(row)
+        accumulator = StreetAccumulator(partial)
+        accumulator.merge_partial(partial)
+        intervals[int(event_time(row['window_start_utc']))] = accumulator.flush()
+
+    series = {}
+    for resolution in ROLLUP_RESOLUTIONS:
+        intervals = rollup(intervals, resolution)
+        series[resolution] = {bucket: accumulator for bucket, accumulator in intervals.items()
+                              if bucket + resolution <= end}
+    if not any(series.values()):
+        return 0
+
+    # One call per resolution, the vehicle counts of each cover a different interval
+    congestion_indices = {}
+    for resolution, rolled in series.items():
+        congestion_indices.update(data_aggregator.get_congestion_indices([
+            data_aggregator.congestion_request(f"{resolution}#{bucket}", accumulator)
+            for bucket, accumulator in rolled.items()
+        ], resolution))
+    rows = [
+        history_row(
+            data_aggregator.build_item(s_id, accumulator, congestion_indices[f"{resolution}#{bucket}"],
+                                       to_iso(bucket + resolution)),
+            accumulator, resolution, bucket)
+        for resolution, rolled in series.items() for bucket, accumulator in rolled.items()
+    ]
+    write_rows(rows)
+    return len(rows)
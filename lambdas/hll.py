@@ -0,0 +1,70 @@
+# HyperLogLog sketch for distinct license plates per street and window.
+# 2^HLL_PRECISION one-byte registers, so memory is fixed whatever the traffic.
+# The standard error of count() is 1.04 / sqrt(2^HLL_PRECISION), about 3.3% at
+# precision 10; small counts use linear counting and are close to exact.
+# Sketches only merge with sketches of the same precision, so it is not configurable.
+from hashlib import blake2b
+from math import log
+
+HLL_PRECISION = 10
+HLL_REGISTERS = 1 << HLL_PRECISION
+_RANK_BITS = 64 - HLL_PRECISION
+_RANK_MASK = (1 << _RANK_BITS) - 1
+# Sparse encoding of a register: index * _RANK_BASE + rank, ranks never exceed _RANK_BITS + 1
+_RANK_BASE = 64
+_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+
+
+class HyperLogLog:
+    __slots__ = ('registers',)
+
+    def __init__(self, encoded=()):
+        self.registers = bytearray(HLL_REGISTERS)
+        self.update_encoded(encoded)
+
+    def add(self, value):
+        self.update((value,))
+
+    def update(self, values):
+        registers = self.registers
+        from_bytes = int.from_bytes
+        for value in values:
+            h = from_bytes(blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+            index = h >> _RANK_BITS
+            rank = _RANK_BITS - (h & _RANK_MASK).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def update_encoded(self, encoded):
+        """
+        Merge registers in the sparse encoding produced by encode().
+        """
+        registers = self.registers
+        for value in encoded:
+            index, rank = divmod(int(value), _RANK_BASE)
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def encode(self):
+        """
+        Sparse encoding of the non-empty registers as a list of ints. Merging two sketches
+        is the union of their encodings, which DynamoDB can do with ADD on a number set.
+        """
+        return [index * _RANK_BASE + rank for index, rank in enumerate(self.registers) if rank]
+
+    def count(self):
+        registers = self.registers
+        estimate = _ALPHA * HLL_REGISTERS * HLL_REGISTERS / sum(2.0 ** -rank for rank in registers)
+        zeros = registers.count(0)
+        if estimate <= 2.5 * HLL_REGISTERS and zeros:
+            estimate = HLL_REGISTERS * log(HLL_REGISTERS / zeros)
+        return int(round(estimate))
+
+    def __eq__(self, other):
+        return isinstance(other, HyperLogLog) and self.registers == other.registers
+
+    def __repr__(self):
+        return f"HyperLogLog(~{self.count()})"
@@ -0,0 +1,188 @@
+import json
+import binascii
+from operator import itemgetter
+from typing import NamedTuple
+
+from kpl_aggregation import deaggregate
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib decoder is used without it
+    orjson = None
+
+FIELDS = {
+    "street_name": str,
+    "street_id": str,
+    "camera_id": str,
+    "timestamp": str,
+    "license_plate": str,
+    "speed_kph": (int, float),
+    "speed_limit": (int, float),
+    "lane_id": int,
+    "vehicle_type": str,
+    "ocr_confidence": (int, float),
+    "is_violation": bool,
+    "latitude": (int, float),
+    "longitude": (int, float),
+}
+
+
+class VehicleEvent(NamedTuple):
+    """
+    Decoded camera event, a slotted tuple with the FIELDS in order.
+    Fields that are not part of the schema are dropped while decoding.
+    """
+    street_name: str
+    street_id: str
+    camera_id: str
+    timestamp: str
+    license_plate: str
+    speed_kph: float
+    speed_limit: float
+    lane_id: int
+    vehicle_type: str
+    ocr_confidence: float
+    is_violation: bool
+    latitude: float
+    longitude: float
+
+
+class RecordDecodeError(ValueError):
+    """
+    Raised for payloads that are valid JSON but do not match the schema,
+    reason is the same message validator.validate_schema gives.
+    """
+
+    def __init__(self, reason, payload):
+        super().__init__(reason)
+        self.reason = reason
+        self.payload = payload
+
+
+_FIELD_NAMES = tuple(FIELDS)
+_RAW_DECODE = json.JSONDecoder().raw_decode
+_FIELD_GETTER = itemgetter(*FIELDS)
+# Tuples of value types (in FIELDS order) already known to pass the schema checks
+_VALID_TYPE_SIGNATURES = set()
+
+
+def is_valid_type_signature(signature):
+    if signature in _VALID_TYPE_SIGNATURES:
+        return True
+    if all(map(issubclass, signature, FIELDS.values())):
+        _VALID_TYPE_SIGNATURES.add(signature)
+        return True
+    return False
+
+
+def schema_error(payload):
+    """
+    First schema violation of a decoded payload in FIELDS order, None if it matches the schema.
+    """
+    if not isinstance(payload, dict):
+        return f"Missing field: {_FIELD_NAMES[0]}"
+    for field, field_type in FIELDS.items():
+        if field not in payload:
+            return f"Missing field: {field}"
+        if not isinstance(payload[field], field_type):
+            return f"Incorrect type for field: {field}. Expected {field_type}, got {type(payload[field]).__name__}"
+    return None
+
+
+def _event_from_dict(payload):
+    """
+    One itemgetter call plus a lookup of the tuple of value types replaces the per-field
+    isinstance loop, anything that does not match the schema is returned unchanged.
+    """
+    try:
+        row = _FIELD_GETTER(payload)
+        if is_valid_type_signature(tuple(map(type, row))):
+            return VehicleEvent._make(row)
+    except (KeyError, TypeError):
+        pass
+    return payload
+
+
+def decode_event(data):
+    """
+    Decode one JSON payload (bytes) into a VehicleEvent.
+    Raises RecordDecodeError if it does not match the schema and ValueError if it is not valid JSON.
+    """
+    # Both decoders build the dict in C, which measured faster than an object_pairs_hook
+    # building the event in Python
+    decoded = _event_from_dict(orjson.loads(data) if orjson is not None else json.loads(data.decode('utf-8')))
+
+    if isinstance(decoded, VehicleEvent):
+        return decoded
+    raise RecordDecodeError(schema_error(decoded), decoded)
+
+
+def parse_payloads(payloads):
+    """
+    Parse JSON payloads (bytes), an exception instead of the value for each one that is not valid JSON.
+    Without orjson a batch of ASCII objects is joined and parsed with one decoder, which saves the
+    per-call overhead of json.loads. Each value has to end exactly where its payload ends, broken
+    payloads completing each other (or one payload holding two objects) would otherwise be taken
+    for events of the wrong records; if any does not, the payloads are parsed one by one.
+    """
+    if orjson is None and payloads and all(p[:1] == b'{' and p[-1:] == b'}' and p.isascii() for p in payloads):
+        text = b','.join(payloads).decode('ascii')
+        parsed = []
+        start = 0
+        try:
+            for data in payloads:
+                value, end = _RAW_DECODE(text, start)
+                if end - start != len(data):
+                    break
+                parsed.append(value)
+                start = end + 1
+            else:
+                return parsed
+        except ValueError:
+            pass
+
+    loads = orjson.loads if orjson is not None else lambda data: json.loads(data.decode('utf-8'))
+    parsed = []
+    for data in payloads:
+        try:
+            parsed.append(loads(data))
+        except ValueError as e:
+            parsed.append(e)
+    return parsed
+
+
+def decode_kinesis_records(records, positions=None):
+    """
+    Decode the base64 data of Kinesis event records, KPL aggregated records are
+    split into their user records first.
+    Returns (events, rejected) where rejected holds (payload, reason) tuples
+    of the records that decoded but failed the schema checks.
+    If a positions list is given, the index of the Kinesis record each event
+    came from is appended to it, one per event.
+    Records that are not valid base64/JSON are logged and skipped.
+    """
+    payloads = []
+    origins = []
+    for position, record in enumerate(records):
+        try:
+            user_records = deaggregate(binascii.a2b_base64(record['kinesis']['data']))
+        except Exception as e:
+            print(f"Error decoding record: {e}")
+            continue
+        payloads.extend(data for _, data in user_records)
+        origins.extend([position] * len(user_records))
+
+    events = []
+    rejected = []
+    for position, decoded in zip(origins, parse_payloads(payloads)):
+        if isinstance(decoded, Exception):
+            print(f"Error decoding record: {decoded}")
+            continue
+        event = _event_from_dict(decoded)
+        if isinstance(event, VehicleEvent):
+            events.append(event)
+            if positions is not None:
+                positions.append(position)
+        else:
+            rejected.append((decoded, schema_error(decoded)))
+    return events, rejected
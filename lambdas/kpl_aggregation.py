@@ -0,0 +1,169 @@
+import hashlib
+
+# KPL aggregated record format, many user records packed into one Kinesis record:
+#   magic (4 bytes) | AggregatedRecord (protobuf) | MD5 of the protobuf bytes (16 bytes)
+#
+#   message AggregatedRecord {
+#     repeated string partition_key_table = 1;
+#     repeated string explicit_hash_key_table = 2;
+#     repeated Record records = 3;
+#   }
+#   message Record {
+#     required uint64 partition_key_index = 1;
+#     optional uint64 explicit_hash_key_index = 2;
+#     required bytes data = 3;
+#     repeated Tag tags = 4;
+#   }
+KPL_MAGIC = b'\xf3\x89\x9a\xc2'
+DIGEST_SIZE = 16
+
+# A Kinesis record (data plus partition key) may be at most 1 MiB
+MAX_AGGREGATE_BYTES = 1024 * 1024 - 1024
+
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+
+def _encode_varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _decode_varint(buffer, pos):
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(buffer):
+            raise ValueError("Truncated varint")
+        byte = buffer[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _length_delimited(field_number, payload):
+    return _encode_varint(field_number << 3 | _LENGTH_DELIMITED) + _encode_varint(len(payload)) + payload
+
+
+def _fields(buffer):
+    """
+    Iterate over (field_number, wire_type, value) of a protobuf message,
+    value is an int for varints and a memoryview for length-delimited fields.
+    """
+    view = memoryview(buffer)
+    pos = 0
+    while pos < len(view):
+        key, pos = _decode_varint(view, pos)
+        field_number, wire_type = key >> 3, key & 0x07
+        if wire_type == _VARINT:
+            value, pos = _decode_varint(view, pos)
+        elif wire_type == _LENGTH_DELIMITED:
+            length, pos = _decode_varint(view, pos)
+            if pos + length > len(view):
+                raise ValueError("Truncated field")
+            value = view[pos:pos + length]
+            pos += length
+        elif wire_type == _FIXED64:
+            value = view[pos:pos + 8]
+            pos += 8
+        elif wire_type == _FIXED32:
+            value = view[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported wire type: {wire_type}")
+        yield field_number, wire_type, value
+
+
+def is_aggregated(data):
+    """
+    True if data is a KPL aggregated record with a matching checksum.
+    Like the KCL, anything else is treated as a plain user record.
+    """
+    if len(data) <= len(KPL_MAGIC) + DIGEST_SIZE or not data.startswith(KPL_MAGIC):
+        return False
+    message = data[len(KPL_MAGIC):-DIGEST_SIZE]
+    return hashlib.md5(message).digest() == data[-DIGEST_SIZE:]
+
+
+def deaggregate(data):
+    """
+    Split a Kinesis record into its user records, a list of (partition_key, data) tuples.
+    Plain records come back as a single user record with partition_key None.
+    """
+    if not is_aggregated(data):
+        return [(None, data)]
+
+    partition_keys = []
+    user_records = []
+    for field_number, wire_type, value in _fields(data[len(KPL_MAGIC):-DIGEST_SIZE]):
+        if wire_type != _LENGTH_DELIMITED:
+            continue
+        if field_number == 1:
+            partition_keys.append(str(value, 'utf-8'))
+        elif field_number == 3:
+            key_index = 0
+            payload = b''
+            for record_field, record_wire_type, record_value in _fields(value):
+                if record_field == 1 and record_wire_type == _VARINT:
+                    key_index = record_value
+                elif record_field == 3 and record_wire_type == _LENGTH_DELIMITED:
+                    payload = bytes(record_value)
+            user_records.append((key_index, payload))
+
+    return [(partition_keys[key_index] if key_index < len(partition_keys) else None, payload)
+            for key_index, payload in user_records]
+
+
+def _encode_user_record(key_index, data):
+    return _length_delimited(3, _encode_varint(1 << 3 | _VARINT) + _encode_varint(key_index) +
+                             _length_delimited(3, data))
+
+
+def _build(partition_keys, encoded_records):
+    message = b''.join([_length_delimited(1, key.encode('utf-8')) for key in partition_keys] + encoded_records)
+    return KPL_MAGIC + message + hashlib.md5(message).digest()
+
+
+def aggregate_records(user_records, max_bytes=MAX_AGGREGATE_BYTES, max_records=None):
+    """
+    Pack (partition_key, data) user records into as few KPL aggregated Kinesis records as fit
+    into max_bytes (and max_records user records) each.
+    Returns a list of (partition_key, data) Kinesis records, the partition key of an
+    aggregated record is the one of its first user record.
+    """
+    aggregated = []
+    key_indexes = {}
+    encoded_records = []
+    size = len(KPL_MAGIC) + DIGEST_SIZE
+
+    for partition_key, data in user_records:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        for _ in range(2):
+            key_cost = 0 if partition_key in key_indexes else len(_length_delimited(1, partition_key.encode('utf-8')))
+            record = _encode_user_record(key_indexes.get(partition_key, len(key_indexes)), data)
+            full = max_records is not None and len(encoded_records) >= max_records
+            if not encoded_records or not (full or size + key_cost + len(record) > max_bytes):
+                break
+            # current aggregate is full, start a new one and encode the record again for it
+            aggregated.append((next(iter(key_indexes)), _build(list(key_indexes), encoded_records)))
+            key_indexes = {}
+            encoded_records = []
+            size = len(KPL_MAGIC) + DIGEST_SIZE
+
+        key_indexes.setdefault(partition_key, len(key_indexes))
+        encoded_records.append(record)
+        size += key_cost + len(record)
+
+    if encoded_records:
+        aggregated.append((next(iter(key_indexes)), _build(list(key_indexes), encoded_records)))
+    return aggregated
@@ -0,0 +1,59 @@
+# Latest-state snapshot of all streets, kept in the aggregated table next to the street rows.
+# Streets are spread over LATEST_SNAPSHOT_SHARDS items keyed '#latest#<shard>', each holding
+# one attribute per street with the street's newest row, so GET /traffic reads the whole
+# city with one BatchGetItem however many rows the table holds. An item holds at most
+# 400 KB, roughly 100 streets with all their windows, raise the shard count accordingly.
+import os
+from zlib import crc32
+
+LATEST_SNAPSHOT_SHARDS = int(os.environ.get('LATEST_SNAPSHOT_SHARDS', '4'))
+LATEST_KEY_PREFIX = '#latest#'
+# Streets per snapshot update, keeps the update and condition expressions below 4 KB
+SNAPSHOT_UPDATE_STREETS = 20
+# Key attribute of the aggregated table, every other snapshot attribute is a street
+KEY_ATTRIBUTE = 'street_id'
+# Every street row also carries its snapshot shard and the epoch milliseconds it was written
+# at, the GSI below lists a shard's streets in write order, so GET /traffic?since=<cursor>
+# reads only the streets written after the cursor, one Query per shard.
+UPDATE_INDEX = 'latest_shard-updated_at-index'
+
+
+def snapshot_key(shard):
+    return {KEY_ATTRIBUTE: f"{LATEST_KEY_PREFIX}{shard}"}
+
+
+def snapshot_keys():
+    return [snapshot_key(shard) for shard in range(LATEST_SNAPSHOT_SHARDS)]
+
+
+def shard_of(street_id):
+    # crc32 is stable across processes, unlike hash()
+    return crc32(street_id.encode('utf-8')) % LATEST_SNAPSHOT_SHARDS
+
+
+def stamp_update(row, updated_at):
+    """
+    Add the update index attributes to a street row about to be written.
+    """
+    row['latest_shard'] = shard_of(row[KEY_ATTRIBUTE])
+    row['updated_at'] = updated_at
+    return row
+
+
+def is_bookkeeping_key(street_id):
+    """
+    Snapshot and other bookkeeping items share the table with the street rows.
+    """
+    return street_id.startswith('#')
+
+
+def snapshot_streets(items):
+    """
+    Street rows of the snapshot items, in street_id order.
+    """
+    streets = {}
+    for item in items:
+        for name, row in item.items():
+            if name != KEY_ATTRIBUTE:
+                streets[name] = row
+    return [streets[street_id] for street_id in sorted(streets)]
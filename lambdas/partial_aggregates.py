@@ -0,0 +1,56 @@
+# Mergeable per-street partial aggregates, computed by the validator over one Kinesis batch
+# and merged by data_aggregator.aggregate_metrics together with raw records.
+from accumulators import StreetAccumulator
+from windowing import event_time, pane_start
+
+# Version 2 replaced the plate list with a HyperLogLog sketch ('plate_registers'),
+# version 3 added the speed quantile sketch ('speed_sketch'), version 4 the dimension cells
+PARTIAL_VERSION = 4
+
+
+def is_partial(item):
+    return 'partial_version' in item
+
+
+def build_partials(records):
+    """
+    Reduce validated records to one partial aggregate per street and event-time pane:
+    speed sum, count, min and max, the highest lane seen, sketches of the speeds and
+    the distinct plates plus the dimension cells.
+    """
+    accumulators = {}
+    event_times = {}
+    for record in records:
+        t = event_time(record['timestamp'])
+        key = (record['street_id'], pane_start(t))
+        accumulator = accumulators.get(key)
+        if accumulator is None:
+            accumulator = accumulators[key] = StreetAccumulator(record)
+            event_times[key] = t
+        elif t > event_times[key]:
+            event_times[key] = t
+        accumulator.add_record(record)
+
+    return [to_partial(s_id, pane, event_times[(s_id, pane)], accumulator.flush())
+            for (s_id, pane), accumulator in accumulators.items()]
+
+
+def to_partial(s_id, pane, event_time_max, accumulator):
+    return {
+        'partial_version': PARTIAL_VERSION,
+        'street_id': s_id,
+        'pane_start': pane,
+        'event_time_max': event_time_max,
+        'street_name': accumulator.street_name,
+        'speed_limit': accumulator.speed_limit,
+        'latitude': accumulator.latitude,
+        'longitude': accumulator.longitude,
+        'speed_sum': accumulator.total_speed,
+        'count': accumulator.record_count,
+        'speed_min': accumulator.min_speed,
+        'speed_max': accumulator.max_speed,
+        'lanes': accumulator.lanes,
+        'speed_sketch': accumulator.speed_sketch.encode(),
+        'plate_registers': accumulator.vehicle_sketch.encode(),
+        'dimensions': accumulator.dimensions
+    }
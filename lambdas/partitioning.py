@@ -0,0 +1,29 @@
+import math
+import random
+
+# Kinesis partition keys for camera events.
+# A street's events normally share the street_id as partition key, so a busy street lands on a
+# single shard. Hot streets are spread over "<street_id>#<n>" sub-keys instead, which hash to
+# different shards. Events keep their real street_id in the payload, so the consumers and
+# the aggregator merge the sub-keys back per street; ordering is only kept per sub-key.
+SUB_KEY_SEPARATOR = '#'
+# Streets producing at least this many events per second are spread over several sub-keys
+HOT_STREET_EVENTS_PER_SECOND = 1.0
+MAX_SUB_KEYS = 16
+
+
+def hot_street_sub_keys(events_per_second, shard_count=1):
+    """
+    Number of partition sub-keys for a street with the given event rate: 1 for normal streets,
+    for hot streets one per HOT_STREET_EVENTS_PER_SECOND, but at least one per shard.
+    """
+    if events_per_second < HOT_STREET_EVENTS_PER_SECOND:
+        return 1
+    sub_keys = max(shard_count, math.ceil(events_per_second / HOT_STREET_EVENTS_PER_SECOND))
+    return min(MAX_SUB_KEYS, sub_keys)
+
+
+def partition_key(street_id, sub_keys=1):
+    if sub_keys <= 1:
+        return street_id
+    return f"{street_id}{SUB_KEY_SEPARATOR}{random.randrange(sub_keys)}"
@@ -0,0 +1,88 @@
+# DDSketch-style quantile sketch for speeds. Speeds are counted in logarithmic buckets, so
+# every quantile is within SPEED_SKETCH_ACCURACY of the true value (relative), memory is
+# bounded by the bucket range and two sketches merge by adding their bucket counts.
+from math import ceil, log
+
+SPEED_SKETCH_ACCURACY = 0.02
+_GAMMA = (1 + SPEED_SKETCH_ACCURACY) / (1 - SPEED_SKETCH_ACCURACY)
+_LOG_GAMMA = log(_GAMMA)
+# Speeds up to 1 kph count as stopped (bucket 0), speeds beyond MAX_SPEED share the top bucket
+MAX_SPEED = 500
+MAX_BUCKET = ceil(log(MAX_SPEED) / _LOG_GAMMA)
+DEFAULT_PERCENTILES = (50, 85, 95)
+
+
+def bucket(speed):
+    if speed <= 1:
+        return 0
+    return min(ceil(log(speed) / _LOG_GAMMA), MAX_BUCKET)
+
+
+def bucket_value(index):
+    """
+    Representative speed of a bucket, the midpoint that keeps the relative error bound.
+    """
+    if index == 0:
+        return 0.0
+    return 2 * _GAMMA ** index / (_GAMMA + 1)
+
+
+class SpeedSketch:
+    __slots__ = ('counts',)
+
+    def __init__(self, encoded=None):
+        self.counts = {}
+        if encoded:
+            self.update_encoded(encoded)
+
+    def add(self, speed, count=1):
+        index = bucket(speed)
+        self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other):
+        self.update_counts(other.counts)
+
+    def update_counts(self, counts):
+        for index, count in counts.items():
+            index = int(index)
+            self.counts[index] = self.counts.get(index, 0) + int(count)
+
+    def update_encoded(self, encoded):
+        """
+        Merge a sketch serialized by encode().
+        """
+        first, _, counts = encoded.partition(':')
+        for index, count in enumerate(counts.split(','), int(first)):
+            if count != '0':
+                self.counts[index] = self.counts.get(index, 0) + int(count)
+
+    def encode(self):
+        """
+        Compact string form: the first bucket index, then the counts of every bucket from
+        there to the last one. Speeds cluster, so runs of empty buckets are short.
+        """
+        if not self.counts:
+            return ''
+        first, last = min(self.counts), max(self.counts)
+        return f"{first}:" + ','.join(str(self.counts.get(i, 0)) for i in range(first, last + 1))
+
+    def quantile(self, q):
+        total = sum(self.counts.values())
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen > rank:
+                return bucket_value(index)
+        return bucket_value(max(self.counts))
+
+    def percentiles(self, percentiles=DEFAULT_PERCENTILES):
+        return {f"p{p:g}": self.quantile(p / 100) for p in percentiles}
+
+    def __eq__(self, other):
+        return isinstance(other, SpeedSketch) and self.counts == other.counts
+
+    def __repr__(self):
+        return f"SpeedSketch({self.encode()!r})"
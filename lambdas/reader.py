@@ -1,39 +1,138 @@
+import base64
 import json
 import os
+import time
 import boto3
-from decimal import Decimal
 from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.transform import TransformationInjector
+from boto3.dynamodb.types import TypeDeserializer
+
+from alert_index import query_index
+from latest_state import LATEST_SNAPSHOT_SHARDS, UPDATE_INDEX, is_bookkeeping_key, snapshot_keys, snapshot_streets
+from quantiles import DEFAULT_PERCENTILES, SpeedSketch
+from response_cache import ResponseCache, etag_matches
+from response_encoding import NotAcceptable, content_encoding, encode, is_binary, response_format
+
+
+
+class NumberDeserializer(TypeDeserializer):
+    """
+    Deserializes DynamoDB numbers to ints, or floats if they have a fraction or an exponent,
+    instead of Decimals, so responses are encoded without converting every number again.
+    Ints stay exact and are accepted back by the serializer (ExclusiveStartKey).
+    """
+    def _deserialize_n(self, value):
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+
+
+def deserialize_numbers(resource):
+    """
+    Replace the deserializer the resource applies to every response with NumberDeserializer.
+    """
+    events = resource.meta.client.meta.events
+    events.unregister('after-call.dynamodb', unique_id='dynamodb-attr-value-output')
+    events.register('after-call.dynamodb',
+                    TransformationInjector(deserializer=NumberDeserializer()).inject_attribute_value_output,
+                    unique_id='dynamodb-attr-value-output')
+
 
 dynamodb = boto3.resource('dynamodb')
+deserialize_numbers(dynamodb)
 TABLE_NAME = os.getenv("AGGREGATED_DATA_TABLE_NAME")
 ALERTS_TABLE_NAME = os.getenv("ALERTS_TABLE_NAME")
 
 table = dynamodb.Table(TABLE_NAME)
 alerts_table = dynamodb.Table(ALERTS_TABLE_NAME) if ALERTS_TABLE_NAME else None
 
+# Seconds a warm container serves a serialized response from memory, 0 disables the cache
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "5"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+response_cache = ResponseCache(RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MAX_ENTRIES)
+
+ALERTS_DEFAULT_LIMIT = int(os.getenv("ALERTS_DEFAULT_LIMIT", "100"))
+ALERTS_MAX_LIMIT = 1000
+
+# A delta request also returns streets written this long before its cursor, covering
+# concurrent aggregators whose clocks differ and the lag of the update index
+CURSOR_OVERLAP_MS = int(os.getenv("CURSOR_OVERLAP_MS", "2000"))
 
-def decimal_to_float(val):
-    if isinstance(val, Decimal):
-        return float(val)
-    else:
-        raise TypeError
+# Bodies smaller than this are sent uncompressed whatever the Accept-Encoding
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
 
 
 def street_id_exists(street_id):
+    if is_bookkeeping_key(street_id):
+        return False
     res = table.get_item(
         Key={"street_id": street_id}
     )
     return "Item" in res
 
 
+def parse_percentiles(value):
+    if not value:
+        return DEFAULT_PERCENTILES
+    percentiles = tuple(float(p) for p in value.split(","))
+    if not all(0 <= p <= 100 for p in percentiles):
+        raise ValueError("percentiles must be between 0 and 100")
+    return percentiles
+
+
+def with_speed_percentiles(item, percentiles):
+    """
+    Replace the serialized speed sketch of an aggregate row, and of its windows,
+    by the requested speed percentiles.
+    """
+    encoded = item.pop("speed_sketch", None)
+    if encoded:
+        item["speed_percentiles_kph"] = {
+            name: round(value, 1) for name, value in SpeedSketch(encoded).percentiles(percentiles).items()
+        }
+    for window in item.get("windows", {}).values():
+        with_speed_percentiles(window, percentiles)
+    return item
+
+
 CORS_HEADERS = {
     "Content-Type": "application/json",
     "Access-Control-Allow-Origin": "*",
-    "Access-Control-Allow-Headers": "Content-Type",
+    "Access-Control-Allow-Headers": "Content-Type, If-None-Match, Accept",
+    "Access-Control-Expose-Headers": "ETag, X-Cache, X-Next-Token, X-Cursor",
     "Access-Control-Allow-Methods": "GET, OPTIONS"
 }
 
 
+def request_header(event, name):
+    # API Gateway passes the headers as the client sent them
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def cache_key(event, fmt, encoding):
+    params = event.get("queryStringParameters") or {}
+    return (event.get("resource"), tuple(sorted(params.items())), fmt, encoding)
+
+
+def cached_response(event, body, etag, extra_headers, cache_status):
+    headers = dict(CORS_HEADERS, ETag=etag)
+    headers.update(extra_headers)
+    headers["X-Cache"] = cache_status
+    if etag_matches(request_header(event, "if-none-match"), etag):
+        response_cache.stats["not_modified"] += 1
+        return {"statusCode": 304, "headers": headers, "body": ""}
+    return {"statusCode": 200, "headers": headers, "body": body, "isBase64Encoded": is_binary(headers)}
+
+
+def ok(data, headers=CORS_HEADERS):
+    # Serialized by lambda_handler in the negotiated format
+    return {"statusCode": 200, "headers": headers, "data": data}
+
+
 def lambda_handler(event, context):
     # Handle CORS preflight
     if event.get("httpMethod") == "OPTIONS":
@@ -43,15 +142,30 @@ def lambda_handler(event, context):
             "body": ""
         }
 
-    resource = event.get("resource")
-    
     try:
-        # Route: GET /alerts
-        if resource == "/alerts":
-            return handle_get_alerts(event)
+        fmt = response_format(event.get("queryStringParameters") or {}, request_header(event, "accept"))
+    except ValueError as e:
+        return {
+            "statusCode": 406 if isinstance(e, NotAcceptable) else 400,
+            "headers": CORS_HEADERS,
+            "body": json.dumps({"error": str(e)})
+        }
+    encoding = content_encoding(request_header(event, "accept-encoding"))
 
-        # Route: GET /traffic
-        return handle_get_traffic(event)
+    key = cache_key(event, fmt, encoding)
+    cached = response_cache.get(key)
+    try:
+        if cached:
+            return cached_response(event, *cached, "HIT")
+
+        response = route(event)
+        if response["statusCode"] != 200:
+            return response
+        body, extra_headers = encode(response["data"], fmt, encoding, RESPONSE_COMPRESSION_MIN_BYTES)
+        extra_headers.update(
+            (name, value) for name, value in response["headers"].items() if name not in CORS_HEADERS
+        )
+        return cached_response(event, *response_cache.put(key, body, extra_headers), "MISS")
 
     except Exception as e:
         print(e)
@@ -60,6 +174,19 @@ def lambda_handler(event, context):
             "headers": CORS_HEADERS,
             "body": json.dumps({"error": str(e)})
         }
+    finally:
+        print(f"Response cache: {response_cache.stats}")
+
+
+def route(event):
+    resource = event.get("resource")
+
+    # Route: GET /alerts
+    if resource == "/alerts":
+        return handle_get_alerts(event)
+
+    # Route: GET /traffic
+    return handle_get_traffic(event)
 
 
 def handle_get_alerts(event):
@@ -69,43 +196,88 @@ def handle_get_alerts(event):
             "headers": CORS_HEADERS,
             "body": json.dumps({"error": "Alerts table not configured"})
         }
-    
+
     params = event.get("queryStringParameters") or {}
-    street_id = params.get("street_id")
+    try:
+        limit = int(params.get("limit") or ALERTS_DEFAULT_LIMIT)
+        if not 1 <= limit <= ALERTS_MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {ALERTS_MAX_LIMIT}")
+        items, next_token = query_alerts(params.get("street_id"), params.get("type"), params.get("since"),
+                                         limit, params.get("next_token"))
+    except ValueError as e:
+        return {
+            "statusCode": 400,
+            "headers": CORS_HEADERS,
+            "body": json.dumps({"error": str(e)})
+        }
 
-    # If street_id is provided, filtering is needed. 
-    # Ideally use a GSI (Index: sensor_id-timestamp-index), but for legacy reasons/simplicity if table is small scan + filter works.
-    # Given the requirements, we'll scan and filter in memory for now as the table has TTL and won't be huge.
-    
-    response = alerts_table.scan()
-    items = response.get("Items", [])
-    
-    if street_id:
-        items = [i for i in items if i.get('sensor_id') == street_id]
+    headers = dict(CORS_HEADERS, **({"X-Next-Token": next_token} if next_token else {}))
+    return ok(items, headers)
 
-    # Sort by timestamp descending
-    items.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
 
-    return {
-        "statusCode": 200,
-        "headers": CORS_HEADERS,
-        "body": json.dumps(items, default=decimal_to_float)
-    }
+def query_alerts(street_id, alert_type, since, limit, token):
+    """
+    Newest alerts matching the filters from the alerts GSI for that filter (see alert_index.py),
+    at most limit of them. Returns the alerts and the continuation token of the next page, or None.
+    """
+    index_name, attribute, value = query_index(street_id, alert_type)
+    condition = Key(attribute).eq(value)
+    if since:
+        condition = condition & Key("timestamp").gte(since)
+
+    kwargs = {}
+    if token:
+        kwargs["ExclusiveStartKey"] = decode_token(token, index_name)
+
+    response = alerts_table.query(
+        IndexName=index_name,
+        KeyConditionExpression=condition,
+        ScanIndexForward=False,
+        Limit=limit,
+        **kwargs
+    )
+    last_key = response.get("LastEvaluatedKey")
+    return response.get("Items", []), encode_token(last_key, index_name) if last_key else None
+
+
+def encode_token(last_key, index_name):
+    # The index keys of an alert are strings, the key serializes as plain JSON
+    payload = json.dumps({"index": index_name, "key": last_key}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_token(token, index_name):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except ValueError:
+        raise ValueError("invalid next_token")
+    if not isinstance(payload, dict) or payload.get("index") != index_name:
+        raise ValueError("next_token does not belong to these filters")
+    return payload["key"]
 
 
 def handle_get_traffic(event):
     params = event.get("queryStringParameters") or {}
     street_id = params.get("street_id")
 
-    # If no street_id provided, return all streets' latest data
-    if not street_id:
-        data = get_all_latest_data()
+    try:
+        percentiles = parse_percentiles(params.get("percentiles"))
+        since = parse_cursor(params.get("since"))
+    except ValueError as e:
         return {
-            "statusCode": 200,
+            "statusCode": 400,
             "headers": CORS_HEADERS,
-            "body": json.dumps(data, default=decimal_to_float)
+            "body": json.dumps({"error": str(e)})
         }
 
+    # If no street_id provided, return all streets' latest data, or the ones changed since the cursor.
+    # The cursor of the next request is taken before reading.
+    if not street_id:
+        cursor = str(int(time.time() * 1000))
+        items = get_all_latest_data() if since is None else get_changed_data(since)
+        data = [with_speed_percentiles(item, percentiles) for item in items]
+        return ok(data, dict(CORS_HEADERS, **{"X-Cursor": cursor}))
+
     # Single street lookup
     if not street_id_exists(street_id):
         return {
@@ -115,11 +287,9 @@ def handle_get_traffic(event):
         }
 
     data = get_latest_data_for_street(street_id)
-    return {
-        "statusCode": 200,
-        "headers": CORS_HEADERS,
-        "body": json.dumps(data, default=decimal_to_float)
-    }
+    if data:
+        with_speed_percentiles(data, percentiles)
+    return ok(data)
 
 
 def get_latest_data_for_street(street_id):
@@ -134,10 +304,58 @@ def get_latest_data_for_street(street_id):
 
 
 def get_all_latest_data():
+    """
+    Return the latest entry for each street from the aggregator's latest-state snapshot,
+    one BatchGetItem for all snapshot shards (see latest_state.py).
+    Falls back to scanning the table until the first snapshot is written.
+    """
+    keys = snapshot_keys()
+    items = []
+    # BatchGetItem takes at most 100 keys
+    for i in range(0, len(keys), 100):
+        request = {TABLE_NAME: {"Keys": keys[i:i + 100]}}
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            items.extend(response.get("Responses", {}).get(TABLE_NAME, []))
+            request = response.get("UnprocessedKeys")
+
+    if items:
+        return snapshot_streets(items)
+    return scan_latest_data()
+
+
+def parse_cursor(value):
+    if value is None:
+        return None
+    if not value.isdigit():
+        raise ValueError("since must be a cursor returned in X-Cursor")
+    return int(value)
+
+
+def get_changed_data(since):
+    """
+    Return the street rows written after the cursor (epoch milliseconds), from the update index
+    of every snapshot shard (see latest_state.py). Reads only the changed streets.
+    """
+    items = []
+    for shard in range(LATEST_SNAPSHOT_SHARDS):
+        kwargs = {}
+        while True:
+            response = table.query(
+                IndexName=UPDATE_INDEX,
+                KeyConditionExpression=Key("latest_shard").eq(shard) & Key("updated_at").gt(since - CURSOR_OVERLAP_MS),
+                **kwargs
+            )
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                break
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    return sorted(items, key=lambda item: item["street_id"])
+
+
+def scan_latest_data():
     """
     Scan entire table and return the latest entry for each street.
-    Note: For production with large datasets, consider using a GSI or
-    maintaining a separate 'latest' table for efficiency.
     """
     all_items = []
     last_key = None
@@ -159,6 +377,8 @@ def get_all_latest_data():
     latest_by_street = {}
     for item in all_items:
         street_id = item.get("street_id")
+        if is_bookkeeping_key(street_id):
+            continue
         timestamp = item.get("timestamp_utc", "")
 
         if street_id not in latest_by_street:
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import random
+from collections import Counter
+from datetime import datetime
+
+from envelope import pack_records
+from sqs_fanout import fan_out
+
+# Rejected payloads go in bulk to a dead-letter queue, or to a local JSON lines file (e.g. in tests)
+DEAD_LETTER_QUEUE_URL = os.getenv('DEAD_LETTER_QUEUE_URL')
+DEAD_LETTER_FILE = os.getenv('DEAD_LETTER_FILE')
+# Example records logged per rejection reason and invocation (reservoir sampled)
+REJECTION_SAMPLES_PER_REASON = int(os.getenv('REJECTION_SAMPLES_PER_REASON', '1'))
+# Minimum seconds between two logged examples of the same reason within a warm container
+REJECTION_LOG_INTERVAL = float(os.getenv('REJECTION_LOG_INTERVAL', '60'))
+
+_last_logged = {}
+
+
+class RejectionLog:
+    """
+    Collects the rejected records of one invocation: counters per reason, a few sampled
+    examples for the log and the full payloads for the dead-letter sink.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.samples = {}
+        self.dead_letters = []
+
+    def add(self, stage, reason, payload):
+        key = (stage, reason)
+        self.counts[key] += 1
+
+        samples = self.samples.setdefault(key, [])
+        if len(samples) < REJECTION_SAMPLES_PER_REASON:
+            samples.append(payload)
+        else:
+            slot = random.randrange(self.counts[key])
+            if slot < REJECTION_SAMPLES_PER_REASON:
+                samples[slot] = payload
+
+        self.dead_letters.append({'stage': stage, 'reason': reason, 'payload': payload})
+
+    def flush(self):
+        """
+        Log one summary line plus the rate-limited examples and ship the payloads
+        to the dead-letter sink. Returns the number of rejected records.
+        """
+        total = sum(self.counts.values())
+        if not total:
+            return 0
+
+        summary = {f"{stage}: {reason}": count for (stage, reason), count in self.counts.most_common()}
+        print(f"Rejected {total} records: {json.dumps(summary)}")
+
+        now = time.monotonic()
+        for (stage, reason), samples in self.samples.items():
+            if now - _last_logged.get((stage, reason), float('-inf')) < REJECTION_LOG_INTERVAL:
+                continue
+            _last_logged[(stage, reason)] = now
+            for payload in samples:
+                print(f"{stage} validation failed: {payload} - {reason} "
+                      f"(example of {self.counts[(stage, reason)]})")
+
+        ship_dead_letters(self.dead_letters)
+        return total
+
+
+def ship_dead_letters(dead_letters):
+    if not dead_letters:
+        return
+
+    rejected_at = datetime.now().isoformat()
+    for dead_letter in dead_letters:
+        dead_letter['rejected_at'] = rejected_at
+
+    if DEAD_LETTER_FILE:
+        with open(DEAD_LETTER_FILE, 'a', encoding='utf-8') as file:
+            file.writelines(json.dumps(dead_letter) + "\n" for dead_letter in dead_letters)
+        return
+
+    if not DEAD_LETTER_QUEUE_URL:
+        return
+
+    messages = pack_records(dead_letters, compress=True)
+    delivered, dropped = fan_out(DEAD_LETTER_QUEUE_URL, [body for body, _ in messages],
+                                 [count for _, count in messages])
+    print(f"Sent {delivered} rejected records to the dead-letter queue, dropped {dropped}")
@@ -0,0 +1,59 @@
+# Per-container cache of the reader's serialized responses. The aggregated data only changes
+# when the aggregator writes, yet every dashboard polls, so a warm container answers repeated
+# requests from memory for a few seconds. Entries carry a content hash used as ETag, clients
+# that send it back in If-None-Match get a 304 without a body.
+import hashlib
+from time import monotonic
+
+
+def etag_of(body):
+    return '"' + hashlib.blake2b(body.encode('utf-8'), digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    True if an If-None-Match header value names the etag, weak validators included.
+    """
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in (tag[2:] if tag.startswith('W/') else tag for tag in candidates)
+
+
+class ResponseCache:
+    def __init__(self, ttl_seconds, max_entries=256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = {}
+        # not_modified: requests answered with a 304, hit or miss
+        self.stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+
+    def get(self, key):
+        """
+        The cached (body, etag, headers) for key, or None if missing or expired.
+        """
+        entry = self.entries.get(key)
+        if entry and monotonic() < entry[0]:
+            self.stats['hits'] += 1
+            return entry[1:]
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, key, body, headers=None):
+        """
+        Cache a response body and the headers that belong to it, returns (body, etag, headers).
+        """
+        etag = etag_of(body)
+        headers = headers or {}
+        if self.ttl_seconds <= 0:
+            return body, etag, headers
+
+        now = monotonic()
+        if key not in self.entries and len(self.entries) >= self.max_entries:
+            self.entries = {k: entry for k, entry in self.entries.items() if entry[0] > now}
+            # Still full, drop the oldest entry (dicts keep insertion order)
+            if len(self.entries) >= self.max_entries:
+                del self.entries[next(iter(self.entries))]
+        self.entries.pop(key, None)
+        self.entries[key] = (now + self.ttl_seconds, body, etag, headers)
+        return body, etag, headers
@@ -0,0 +1,113 @@
+# Representations of the reader's responses. The format is picked with ?format= or the Accept
+# header: plain JSON (default), columnar JSON with one array per field, or MessagePack. Bodies
+# above a minimum size are compressed with the best Accept-Encoding the container supports.
+# Items come from the reader's DynamoDB resource with plain ints and floats (see
+# NumberDeserializer in reader.py), the encoders take them without a default= hook.
+import base64
+import gzip
+import json
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, responses fall back to gzip without it
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, format=msgpack is refused without it
+    msgpack = None
+
+JSON_TYPE = "application/json"
+COLUMNAR_TYPE = "application/vnd.urbanflow.columnar+json"
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+FORMATS = ("json", "columnar", "msgpack")
+
+
+class NotAcceptable(ValueError):
+    """
+    Raised for a requested format this container cannot produce.
+    """
+
+
+def columnar(rows):
+    """
+    One array per field instead of one object per row, rows missing a field hold null.
+    Anything but a list of objects (a single street, an error) is returned as is.
+    """
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        return rows
+    fields = {}
+    for row in rows:
+        for field in row:
+            fields.setdefault(field, None)
+    return {"count": len(rows), "columns": {field: [row.get(field) for row in rows] for field in fields}}
+
+
+def response_format(params, accept):
+    """
+    The format named by the format query parameter, else the first one the Accept header names.
+    """
+    fmt = params.get("format")
+    if fmt is None:
+        fmt = "json"
+        for media_type in (part.split(";")[0].strip().lower() for part in (accept or "").split(",")):
+            if media_type == COLUMNAR_TYPE:
+                fmt = "columnar"
+                break
+            if media_type in MSGPACK_TYPES:
+                fmt = "msgpack"
+                break
+            if media_type == JSON_TYPE:
+                break
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    if fmt == "msgpack" and msgpack is None:
+        raise NotAcceptable("msgpack is not available")
+    return fmt
+
+
+def content_encoding(accept_encoding):
+    """
+    br or gzip if the client accepts it (q > 0), brotli only if installed, else None.
+    """
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().lower().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding] = q
+
+    for coding in ("br", "gzip") if brotli is not None else ("gzip",):
+        if accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+def encode(data, fmt, encoding, min_compress_bytes):
+    """
+    Serialize data in the format and compress it when worth it.
+    Returns the body, base64 for binary bodies (see is_binary), and the headers describing it.
+    """
+    if fmt == "msgpack":
+        raw, media_type = msgpack.packb(data), MSGPACK_TYPES[0]
+    else:
+        media_type = COLUMNAR_TYPE if fmt == "columnar" else JSON_TYPE
+        raw = json.dumps(columnar(data) if fmt == "columnar" else data, separators=(",", ":")).encode("utf-8")
+
+    headers = {"Content-Type": media_type, "Vary": "Accept, Accept-Encoding"}
+    if encoding and len(raw) >= min_compress_bytes:
+        # mtime=0 keeps the bytes, and so the ETag, the same across containers
+        raw = brotli.compress(raw) if encoding == "br" else gzip.compress(raw, mtime=0)
+        headers["Content-Encoding"] = encoding
+    elif fmt != "msgpack":
+        return raw.decode("utf-8"), headers
+    return base64.b64encode(raw).decode("ascii"), headers
+
+
+def is_binary(headers):
+    return "Content-Encoding" in headers or headers.get("Content-Type") in MSGPACK_TYPES
@@ -0,0 +1,133 @@
+import os
+import time
+import random
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+
+SQS_MAX_WORKERS = int(os.getenv('SQS_MAX_WORKERS', '8'))
+SQS_MAX_RETRIES = int(os.getenv('SQS_MAX_RETRIES', '3'))
+SQS_RETRY_BASE_DELAY = float(os.getenv('SQS_RETRY_BASE_DELAY', '0.05'))
+
+# send_message_batch accepts at most 10 entries per call, whose bodies add up to at most 256 KiB
+SQS_BATCH_LIMIT = 10
+SQS_BATCH_MAX_BYTES = 256 * 1024
+
+_sqs_client = None
+
+
+def get_sqs_client():
+    """
+    SQS client shared by all invocations of a warm Lambda container (boto3 clients are thread safe).
+    """
+    global _sqs_client
+    if _sqs_client is None:
+        _sqs_client = boto3.client('sqs')
+    return _sqs_client
+
+
+def _backoff(attempt):
+    # Exponential backoff with full jitter
+    time.sleep(random.uniform(0, SQS_RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def _undelivered(queue_url, bodies):
+    """
+    Send up to 10 message bodies with one send_message_batch call.
+    Only the entries SQS reports as failed are retried, with backoff, up to SQS_MAX_RETRIES times.
+    Entries failing through a sender fault (e.g. message too large) are not retried.
+    Returns (failed, rejected): the positions of the bodies still failing after the retries
+    and (position, reason) of the bodies SQS refused for good.
+    """
+    sqs_client = get_sqs_client()
+    pending = {str(idx): body for idx, body in enumerate(bodies)}
+    rejected = []
+
+    for attempt in range(SQS_MAX_RETRIES + 1):
+        if attempt > 0:
+            _backoff(attempt)
+
+        try:
+            response = sqs_client.send_message_batch(
+                QueueUrl=queue_url,
+                Entries=[{'Id': entry_id, 'MessageBody': body} for entry_id, body in pending.items()]
+            )
+        except Exception as e:
+            print(f"Failed to send batch to SQS (attempt {attempt + 1}): {e}")
+            continue
+
+        retry = {}
+        for failure in response.get('Failed') or []:
+            entry_id = failure.get('Id')
+            if entry_id not in pending:
+                continue
+            if failure.get('SenderFault'):
+                print(f"SQS rejected message {entry_id}: {failure.get('Code')} {failure.get('Message')}")
+                rejected.append((int(entry_id), f"{failure.get('Code')}: {failure.get('Message')}"))
+            else:
+                retry[entry_id] = pending[entry_id]
+
+        pending = retry
+        if not pending:
+            break
+
+    return sorted(int(entry_id) for entry_id in pending), rejected
+
+
+def batch_bounds(bodies):
+    """
+    (start, end) of consecutive batches holding at most SQS_BATCH_LIMIT bodies and
+    SQS_BATCH_MAX_BYTES of body bytes each.
+    """
+    bounds = []
+    start = 0
+    size = 0
+    for idx, body in enumerate(bodies):
+        body_size = len(body.encode('utf-8'))
+        if idx > start and (idx - start == SQS_BATCH_LIMIT or size + body_size > SQS_BATCH_MAX_BYTES):
+            bounds.append((start, idx))
+            start = idx
+            size = 0
+        size += body_size
+    if start < len(bodies):
+        bounds.append((start, len(bodies)))
+    return bounds
+
+
+def undelivered(queue_url, bodies, rejected=None):
+    """
+    Send all message bodies to SQS in batches (see batch_bounds), with at most SQS_MAX_WORKERS
+    batches in flight. Returns the positions of the bodies that were not delivered, in order.
+    If a rejected list is given, bodies SQS refuses for good (sender faults, bodies above the size
+    limit, which are not sent at all) are appended to it as (position, reason) instead of returned.
+    """
+    oversized = [(idx, f"Message of {len(body.encode('utf-8'))} bytes exceeds the SQS limit")
+                 for idx, body in enumerate(bodies) if len(body.encode('utf-8')) > SQS_BATCH_MAX_BYTES]
+    refused = set(idx for idx, _ in oversized)
+    positions = [idx for idx in range(len(bodies)) if idx not in refused]
+    sendable = [bodies[idx] for idx in positions]
+
+    bounds = batch_bounds(sendable)
+    if len(bounds) <= 1 or SQS_MAX_WORKERS <= 1:
+        results = [_undelivered(queue_url, sendable[start:end]) for start, end in bounds]
+    else:
+        with ThreadPoolExecutor(max_workers=min(SQS_MAX_WORKERS, len(bounds))) as executor:
+            results = list(executor.map(lambda bound: _undelivered(queue_url, sendable[bound[0]:bound[1]]), bounds))
+
+    failed = [positions[start + idx] for (start, _), (batch_failed, _) in zip(bounds, results) for idx in batch_failed]
+    refusals = oversized + [(positions[start + idx], reason)
+                            for (start, _), (_, batch_rejected) in zip(bounds, results) for idx, reason in batch_rejected]
+    if rejected is None:
+        return sorted(failed + [idx for idx, _ in refusals])
+    rejected.extend(sorted(refusals))
+    return failed
+
+
+def fan_out(queue_url, bodies, counts=None):
+    """
+    Send all message bodies to SQS, see undelivered.
+    counts optionally gives the number of records carried by each body (default 1 each).
+    Returns (delivered, dropped) in records.
+    """
+    counts = counts or [1] * len(bodies)
+    dropped = sum(counts[idx] for idx in undelivered(queue_url, bodies))
+    return sum(counts) - dropped, dropped
@@ -0,0 +1,35 @@
+import os
+
+import anomaly_detector
+import validator
+from batch_failures import handle_kinesis_batch
+from kinesis_decoder import decode_kinesis_records
+
+# Single consumer of the input stream: every Kinesis batch is decoded once and then handed
+# to each stage, instead of two Lambdas each reading and decoding the same records.
+# Stages take (events, rejected, positions) as returned by decode_kinesis_records.
+STAGES = {
+    'anomalies': lambda events, rejected, positions: anomaly_detector.process_events(events),
+    'validation': validator.process_events,
+}
+CONSUMER_STAGES = [name.strip() for name in os.getenv('CONSUMER_STAGES', 'anomalies,validation').split(',') if name.strip()]
+
+for _name in CONSUMER_STAGES:
+    if _name not in STAGES:
+        raise ValueError(f"Unknown consumer stage: {_name}")
+
+
+def lambda_handler(event, context):
+    records = event.get("Records", [])
+    if not records:
+        print("No records found in event")
+        return
+
+    return handle_kinesis_batch(records, process_records)
+
+
+def process_records(records):
+    positions = []
+    events, rejected = decode_kinesis_records(records, positions)
+    for name in CONSUMER_STAGES:
+        STAGES[name](events, rejected, positions)
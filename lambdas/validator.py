@@ -1,44 +1,45 @@
 import re
 from datetime import datetime
-import boto3
 import os
 import json
-import base64
+from collections import deque
+from itertools import compress, repeat
+from operator import itemgetter, not_
+
+from batch_failures import DeliveryError, handle_kinesis_batch
+from envelope import pack_records, unpack_message
+from kinesis_decoder import FIELDS, decode_kinesis_records, is_valid_type_signature, schema_error
+from partial_aggregates import build_partials
+from rejections import RejectionLog, ship_dead_letters
+from sqs_fanout import undelivered
 
 AGGREGATION_QUEUE_URL = os.getenv('AGGREGATION_QUEUE_URL')
+# 'batch' validates the whole Kinesis batch column by column, 'record' keeps the per-record path
+VALIDATION_MODE = os.getenv('VALIDATION_MODE', 'batch')
+# 'envelope' packs many records into one SQS message, 'record' sends one message per record
+AGGREGATION_MESSAGE_FORMAT = os.getenv('AGGREGATION_MESSAGE_FORMAT', 'envelope')
+AGGREGATION_COMPRESSION = os.getenv('AGGREGATION_COMPRESSION', 'false').lower() == 'true'
+# Forward per-street partial aggregates of the batch instead of the raw records
+PRE_AGGREGATE = os.getenv('PRE_AGGREGATE', 'false').lower() == 'true'
+# Valid records are forwarded in segments of at least this many records, cut between Kinesis
+# records, so a batch retried after a delivery failure resumes at the first undelivered segment
+FORWARD_SEGMENT_RECORDS = int(os.getenv('FORWARD_SEGMENT_RECORDS', '500'))
 
 CAMERA_ID_PATTERN = re.compile(r'CAM-[A-Z]{3}-\d{3}-\d{2}')
 LICENSE_PLATE_PATTERN = re.compile(r'[A-Z]{2} \d{3}[A-Z]{2}')
 
-FIELDS = {
-    "street_name": str,
-    "street_id": str,
-    "camera_id": str,
-    "timestamp": str,
-    "license_plate": str,
-    "speed_kph": (int, float),
-    "speed_limit": (int, float),
-    "lane_id": int,
-    "vehicle_type": str,
-    "ocr_confidence": (int, float),
-    "is_violation": bool,
-    "latitude": (int, float),
-    "longitude": (int, float),
-}
-
 VEHICLE_TYPES = ["Car", "Car", "Car", "Truck", "Motorcycle", "Bus"]
 
 MAX_VALID_SPEED = 299
 MIN_OCR_CONFIDENCE = 0.50
 
+_FIELD_GETTER = itemgetter(*FIELDS)
+_VEHICLE_TYPE_SET = frozenset(VEHICLE_TYPES)
+
 
 def validate_schema(payload):
-    for field, field_type in FIELDS.items():
-        if field not in payload:
-            return False, f"Missing field: {field}"
-        if not isinstance(payload[field], field_type):
-            return False, f"Incorrect type for field: {field}. Expected {field_type}, got {type(payload[field]).__name__}"
-    return True, None
+    error_message = schema_error(payload)
+    return error_message is None, error_message
 
 
 def validate_data(payload):
@@ -83,47 +84,258 @@ def validate_data(payload):
     return True, None
 
 
-def forward_to_aggregation(valid_records):
-    if not AGGREGATION_QUEUE_URL:
-        print("AGGREGATION_QUEUE_URL is not set. Skipping send...")
-        return
+def validate_record(payload):
+    """
+    Validate a single payload, returns None if it is valid or a (stage, error_message) tuple.
+    """
+    is_valid, error_message = validate_schema(payload)
+    if not is_valid:
+        return "Schema", error_message
 
-    sqs_client = boto3.client('sqs')
-    
-    # Batch send message to SQS (max 10 per batch call)
-    # We iterate and send in chunks
-    chunk_size = 10
-    
-    for i in range(0, len(valid_records), chunk_size):
-        chunk = valid_records[i:i + chunk_size]
-        entries = []
-        for idx, record in enumerate(chunk):
-            entries.append({
-                'Id': str(idx),
-                'MessageBody': json.dumps(record)
-            })
-            
-        try:
-            sqs_client.send_message_batch(
-                QueueUrl=AGGREGATION_QUEUE_URL,
-                Entries=entries
-            )
-            print(f"Sent batch of {len(entries)} records to SQS")
-        except Exception as e:
-            print(f"Failed to send batch to SQS: {e}")
-
-
-def parse_kinesis_records(records):
-    parsed_records = []
-    for record in records:
+    is_valid, error_message = validate_data(payload)
+    if not is_valid:
+        return "Data", error_message
+
+    return None
+
+
+def _is_iso_timestamp(value):
+    try:
+        datetime.fromisoformat(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _positions(flags):
+    """
+    Positions of the truthy entries of an iterable of flags, evaluated in C via compress.
+    """
+    flags = list(flags)
+    return list(compress(range(len(flags)), flags))
+
+
+def _empty_positions(column):
+    return _positions(map(not_, column)) if "" in column else []
+
+
+def _pattern_mismatch_positions(pattern, column, distinct=False):
+    # distinct: the column holds few distinct values (e.g. one camera_id per camera), match each once
+    values = set(column) if distinct else column
+    if all(map(pattern.match, values)):
+        return []
+    return _positions(map(not_, map(pattern.match, column)))
+
+
+def _invalid_timestamp_positions(column):
+    try:
+        # Fast path, fromisoformat over the whole column raises on the first bad timestamp
+        deque(map(datetime.fromisoformat, column), maxlen=0)
+        return []
+    except ValueError:
+        return _positions(not _is_iso_timestamp(v) for v in column)
+
+
+def _unknown_vehicle_type_positions(column):
+    if _VEHICLE_TYPE_SET.issuperset(column):
+        return []
+    return _positions(map(not_, map(_VEHICLE_TYPE_SET.__contains__, column)))
+
+
+def _within_bounds(column, low, high):
+    """
+    Fast path for the range checks: min/max over the whole column.
+    min/max are only trustworthy without NaNs, so the column sum has to be a number as well.
+    """
+    try:
+        total = sum(column)
+    except OverflowError:
+        return False
+    if total != total:
+        return False
+    return (low is None or min(column) >= low) and (high is None or max(column) <= high)
+
+
+def _below_positions(column, low):
+    if _within_bounds(column, low, None):
+        return []
+    # float.__gt__ keeps the exact semantics of `value < low` for int, float and bool values
+    return _positions(map(float(low).__gt__, column))
+
+
+def _above_positions(column, high):
+    if _within_bounds(column, None, high):
+        return []
+    return _positions(map(float(high).__lt__, column))
+
+
+def _out_of_range_positions(column, low, high):
+    if _within_bounds(column, low, high):
+        return []
+    return sorted(_below_positions(column, low) + _above_positions(column, high))
+
+
+# Data checks in the same order as validate_data, the first failing check wins.
+_DATA_CHECKS = [
+    ("street_name cannot be empty", lambda c: _empty_positions(c["street_name"])),
+    ("street_id cannot be empty", lambda c: _empty_positions(c["street_id"])),
+    ("camera_id format is invalid", lambda c: _pattern_mismatch_positions(CAMERA_ID_PATTERN, c["camera_id"], distinct=True)),
+    ("timestamp format is invalid", lambda c: _invalid_timestamp_positions(c["timestamp"])),
+    ("license_plate format is invalid", lambda c: _pattern_mismatch_positions(LICENSE_PLATE_PATTERN, c["license_plate"])),
+    ("Invalid speed_kph value", lambda c: _out_of_range_positions(c["speed_kph"], 0, MAX_VALID_SPEED)),
+    ("lane_id must be >= 1", lambda c: _below_positions(c["lane_id"], 1)),
+    ("Unknown vehicle_type", lambda c: _unknown_vehicle_type_positions(c["vehicle_type"])),
+    ("ocr_confidence is too low", lambda c: _below_positions(c["ocr_confidence"], MIN_OCR_CONFIDENCE)),
+    ("ocr_confidence cannot be greater than 1.0", lambda c: _above_positions(c["ocr_confidence"], 1.0)),
+    ("latitude must be between -90 and 90", lambda c: _out_of_range_positions(c["latitude"], -90, 90)),
+    ("longitude must be between -180 and 180", lambda c: _out_of_range_positions(c["longitude"], -180, 180)),
+]
+
+
+def validate_batch(payloads):
+    """
+    Validate a whole batch of decoded payloads in columnar form.
+    The schema is checked with one itemgetter call and one type-signature lookup per record,
+    the data checks then run once per column (map/compress, so the loops run in C) instead of
+    once per record, and positions are only computed for columns that contain a failure.
+    Returns one entry per payload: None if it is valid, otherwise a (stage, error_message)
+    tuple with exactly the messages of validate_schema / validate_data.
+    """
+    results = [None] * len(payloads)
+
+    # Fast path, every record has all fields with already known good types
+    try:
+        rows = list(map(_FIELD_GETTER, payloads))
+        signatures = set(map(tuple, map(map, repeat(type), rows)))
+        if all(map(is_valid_type_signature, signatures)):
+            return _validate_data_columns(rows, range(len(payloads)), results)
+    except (KeyError, TypeError):
+        pass
+
+    pending = []  # positions (into payloads) of the records that passed the schema checks
+    rows = []
+    for i, payload in enumerate(payloads):
         try:
-            payload = base64.b64decode(record['kinesis']['data']).decode('utf-8')
-            data = json.loads(payload)
-            parsed_records.append(data)
-        except Exception as e:
-            print(f"Error decoding record: {e}")
-            continue
-    return parsed_records
+            row = _FIELD_GETTER(payload)
+            if is_valid_type_signature(tuple(map(type, row))):
+                pending.append(i)
+                rows.append(row)
+                continue
+        except (KeyError, TypeError):
+            pass
+
+        results[i] = ("Schema", schema_error(payload))
+
+    return _validate_data_columns(rows, pending, results)
+
+
+def validate_events(events):
+    """
+    validate_batch for VehicleEvents from kinesis_decoder, which already passed the schema checks
+    while decoding, so only the data checks are left.
+    """
+    return _validate_data_columns(events, range(len(events)), [None] * len(events))
+
+
+def _validate_data_columns(rows, pending, results):
+    """
+    Run the data checks over the schema-valid rows (value tuples in FIELDS order),
+    pending maps each row to its position in results.
+    """
+    if not rows:
+        return results
+    columns = dict(zip(FIELDS, zip(*rows)))
+
+    # Data checks, resolve the first failing check per record
+    failed = set()
+    for error_message, check in _DATA_CHECKS:
+        for k in check(columns):
+            if k not in failed:
+                failed.add(k)
+                results[pending[k]] = ("Data", error_message)
+
+    return results
+
+
+def segment_records(valid_records, positions):
+    """
+    Cut the valid records into segments of at least FORWARD_SEGMENT_RECORDS records, only
+    between Kinesis records. positions holds the Kinesis record index of each valid record.
+    Returns (index of the segment's first Kinesis record, records) tuples. The cuts only
+    depend on the records before them, a retry from a cut gets the same segments again.
+    """
+    segments = []
+    start = 0
+    for idx in range(1, len(valid_records) + 1):
+        if idx == len(valid_records) or (idx - start >= FORWARD_SEGMENT_RECORDS
+                                         and positions[idx] != positions[idx - 1]):
+            segments.append((positions[start], valid_records[start:idx]))
+            start = idx
+    return segments
+
+
+def build_messages(valid_records):
+    """
+    Message bodies for the valid records (or their per-street partial aggregates if
+    PRE_AGGREGATE is set) and the number of items each body carries.
+    """
+    items = build_partials(valid_records) if PRE_AGGREGATE else valid_records
+    if AGGREGATION_MESSAGE_FORMAT == 'envelope':
+        messages = pack_records(items, compress=AGGREGATION_COMPRESSION)
+        return [body for body, _ in messages], [count for _, count in messages]
+    return [json.dumps(item) for item in items], [1] * len(items)
+
+
+def forward_to_aggregation(valid_records, positions=None):
+    """
+    Send the valid records to the aggregation queue, packed per segment (see segment_records).
+    positions holds the Kinesis record index of each valid record (default: one record each).
+    All messages are built before the first is sent. The segments but the last go out
+    concurrently, the last one, which a retried batch may extend with new records, only
+    once everything before it was delivered. Messages SQS refuses for good (e.g. an oversized
+    record) are dead-lettered and do not hold the batch back, only throttling and server-side
+    failures leave a segment undelivered.
+    Returns (delivered, dropped, first_undelivered) with the counts in forwarded items and
+    first_undelivered the Kinesis record index of the first segment not fully delivered, or None.
+    """
+    if not AGGREGATION_QUEUE_URL:
+        print("AGGREGATION_QUEUE_URL is not set. Skipping send...")
+        return 0, 0, None
+
+    segments = segment_records(valid_records, positions or range(len(valid_records)))
+    messages = [build_messages(records) for _, records in segments]
+    kind = "partials" if PRE_AGGREGATE else "records"
+
+    delivered = 0
+    failed = set()
+    dead_letters = []
+
+    def send(entries):
+        # entries: (segment, count, body), adds up the delivered items and failed segments
+        nonlocal delivered
+        rejected = []
+        failures = set(undelivered(AGGREGATION_QUEUE_URL, [body for _, _, body in entries], rejected))
+        refused = dict(rejected)
+        for idx, (segment, count, body) in enumerate(entries):
+            if idx in failures:
+                failed.add(segment)
+            elif idx in refused:
+                dead_letters.extend({'stage': 'Forwarding', 'reason': refused[idx], 'payload': item}
+                                    for item in unpack_message(body))
+            else:
+                delivered += count
+
+    send([(segment, count, body) for segment, (bodies, counts) in enumerate(messages[:-1])
+          for body, count in zip(bodies, counts)])
+    if not failed and messages:
+        bodies, counts = messages[-1]
+        send([(len(messages) - 1, count, body) for body, count in zip(bodies, counts)])
+    ship_dead_letters(dead_letters)
+
+    dropped = sum(sum(counts) for _, counts in messages) - delivered
+    print(f"Sent {delivered} {kind} in {len(segments)} segments to SQS, {dropped} not delivered "
+          f"({len(dead_letters)} refused by SQS and dead-lettered)")
+    return delivered, dropped, segments[min(failed)][0] if failed else None
 
 
 def lambda_handler(event, context):
@@ -132,25 +344,52 @@ def lambda_handler(event, context):
         print("No records found in event")
         return
 
-    parsed_records = parse_kinesis_records(records)
-    print(f"Validating {len(parsed_records)} records...")
+    return handle_kinesis_batch(records, process_records)
+
+
+def process_records(records):
+    positions = []
+    events, rejected = decode_kinesis_records(records, positions)
+    process_events(events, rejected, positions)
+
+
+def process_events(events, rejected, positions=None):
+    """
+    Validation and forwarding stage over an already decoded batch,
+    rejected holds the (payload, reason) tuples the decoder rejected and positions
+    the Kinesis record index of each event (see decode_kinesis_records).
+    """
+    rejections = RejectionLog()
+    for payload, error_message in rejected:
+        rejections.add("Schema", error_message, payload)
+
+    print(f"Validating {len(events)} records...")
+    if VALIDATION_MODE == 'batch':
+        results = validate_events(events)
+    else:
+        results = [validate_record(vehicle_event._asdict()) for vehicle_event in events]
+
+    positions = positions if positions is not None else range(len(events))
     valids = []
-    for record in parsed_records:
-        is_valid, error_message = validate_schema(record)
-        if not is_valid:
-            print(f"Schema validation failed: {record} - {error_message}")
+    valid_positions = []
+    for vehicle_event, position, result in zip(events, positions, results):
+        if result is not None:
+            stage, error_message = result
+            rejections.add(stage, error_message, vehicle_event._asdict())
             continue
 
-        is_valid, error_message = validate_data(record)
-        if not is_valid:
-            print(f"Data validation failed: {record} - {error_message}")
-            continue
+        valids.append(vehicle_event._asdict())
+        valid_positions.append(position)
 
-        valids.append(record)
+    rejections.flush()
 
     if not valids:
         print("No valid records to forward")
         return
 
     print(f"Forwarding {len(valids)} valid records to aggregation")
-    forward_to_aggregation(valids)
+    delivered, dropped, first_undelivered = forward_to_aggregation(valids, valid_positions)
+    if first_undelivered is not None:
+        # Retried from the first undelivered segment, see batch_failures
+        raise DeliveryError(f"{dropped} items ({len(valids)} valid records in total) could not be delivered to SQS",
+                            first_undelivered)
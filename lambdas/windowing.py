@@ -0,0 +1,60 @@
+# Event-time windows over the record timestamps. Records are folded once into fixed
+# panes, windows of every size are assembled from the panes they cover.
+import os
+from datetime import datetime
+from math import gcd
+
+# Window sizes in seconds. A window as large as the slide is tumbling, larger ones slide.
+WINDOW_SIZES = sorted(int(s) for s in os.getenv("WINDOW_SIZES_SECONDS", "60,300,900").split(","))
+WINDOW_SLIDE_SECONDS = int(os.getenv("WINDOW_SLIDE_SECONDS", "60"))
+# How far behind the newest event time a record may arrive and still be counted
+WINDOW_ALLOWED_LATENESS_SECONDS = int(os.getenv("WINDOW_ALLOWED_LATENESS_SECONDS", "120"))
+# How far ahead of the processing time an event time may be. The watermark follows the newest
+# event time of all streets, one camera with a skewed clock must not push it past everyone else.
+WINDOW_MAX_CLOCK_SKEW_SECONDS = int(os.getenv("WINDOW_MAX_CLOCK_SKEW_SECONDS", "60"))
+PANE_SECONDS = gcd(WINDOW_SLIDE_SECONDS, *WINDOW_SIZES)
+
+
+def event_time(timestamp):
+    return datetime.fromisoformat(str(timestamp)).timestamp()
+
+
+def to_iso(epoch):
+    return datetime.fromtimestamp(epoch).isoformat()
+
+
+def pane_start(epoch):
+    return int(epoch // PANE_SECONDS) * PANE_SECONDS
+
+
+def event_time_horizon(now):
+    """
+    Newest event time accepted at processing time now (epoch seconds), later ones are rejected.
+    """
+    return now + WINDOW_MAX_CLOCK_SKEW_SECONDS
+
+
+def watermark(max_event_time):
+    """
+    Event time up to which all windows are complete, None before any event was seen.
+    """
+    if max_event_time is None:
+        return None
+    return max_event_time - WINDOW_ALLOWED_LATENESS_SECONDS
+
+
+def is_late(pane, current_watermark):
+    """
+    A pane that ended before the watermark belongs to closed windows only.
+    """
+    return current_watermark is not None and pane + PANE_SECONDS <= current_watermark
+
+
+def latest_window(size, latest_pane):
+    """
+    (start, end) of the newest window of the given size containing latest_pane.
+    Windows end on multiples of their slide.
+    """
+    step = min(WINDOW_SLIDE_SECONDS, size)
+    end = -(-(latest_pane + PANE_SECONDS) // step) * step
+    return end - size, end
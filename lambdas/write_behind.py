@@ -0,0 +1,57 @@
+# Write-behind buffer for the street rows a warm aggregator container derives from the window
+# state. The panes themselves are still merged into the state table on every invocation,
+# before the SQS batch is acknowledged, so only rebuildable snapshots are held back: the
+# newest row per key, written at most once per interval. Only keys that are still active
+# keep a row pending past an invocation, the row of a key that went quiet is written by the
+# next invocation: it would otherwise stay stale until the key is written again, and be lost
+# if the container is recycled meanwhile (plain Lambdas get no SIGTERM to flush on).
+# History rows are not buffered: each belongs to one pane, once the pane closes its key is
+# never written again and a lost row would be missing from the history for good.
+from time import monotonic
+
+
+class WriteBehindBuffer:
+    def __init__(self, interval_seconds):
+        self.interval_seconds = interval_seconds
+        self.pending = {}
+        self.flushed_at = {}
+        # buffered: rows handed in, coalesced: rows replaced before they were written
+        self.stats = {'buffered': 0, 'coalesced': 0, 'written': 0}
+
+    def add(self, key, row):
+        if key in self.pending:
+            self.stats['coalesced'] += 1
+        self.pending[key] = row
+        self.stats['buffered'] += 1
+
+    def take(self, force=False, active=None):
+        """
+        Remove and return the rows due for writing: keys not written within the interval,
+        keys missing from active (the keys still receiving data) if given, or every pending
+        row when forced.
+        """
+        now = monotonic()
+        due = {
+            key: row for key, row in self.pending.items()
+            if force or (active is not None and key not in active)
+            or key not in self.flushed_at or now - self.flushed_at[key] >= self.interval_seconds
+        }
+        # Keys written longer ago than the interval are due anyway, forget them
+        self.flushed_at = {key: at for key, at in self.flushed_at.items() if now - at < self.interval_seconds}
+        for key in due:
+            del self.pending[key]
+            self.flushed_at[key] = now
+        self.stats['written'] += len(due)
+        return due
+
+    def restore(self, rows):
+        """
+        Put back rows whose write failed, unless a newer row for the key arrived meanwhile.
+        """
+        for key, row in rows.items():
+            self.pending.setdefault(key, row)
+            self.flushed_at.pop(key, None)
+        self.stats['written'] -= len(rows)
+
+    def __len__(self):
+        return len(self.pending)
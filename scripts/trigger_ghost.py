@@ -3,6 +3,11 @@ import json
 import base64
 import time
 import random
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../lambdas')))
+from partitioning import partition_key
 
 STREAM_NAME = "urbanflow-input-stream"
 kinesis = boto3.client(
@@ -38,7 +43,7 @@ def send_ghost_driver():
     kinesis.put_record(
         StreamName=STREAM_NAME,
         Data=data,
-        PartitionKey=street_id
+        PartitionKey=partition_key(street_id)
     )
     print("Sent!")
 
@@ -0,0 +1,208 @@
+import unittest
+from unittest.mock import MagicMock
+import os
+import sys
+import io
+import json
+import base64
+import tempfile
+from contextlib import redirect_stdout
+
+# Add lambdas directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../lambdas')))
+
+# Mock boto3 before importing lambdas
+sys.modules['boto3'] = MagicMock()
+
+import validator
+import kinesis_decoder
+import kpl_aggregation
+import rejections
+
+VALID_RECORD = {
+    "street_name": "Gürtel",
+    "street_id": "VIE-010",
+    "camera_id": "CAM-VIE-010-01",
+    "timestamp": "2025-12-15T14:36:04.272179",
+    "license_plate": "OZ 638IS",
+    "speed_kph": 48.5,
+    "speed_limit": 50,
+    "lane_id": 2,
+    "vehicle_type": "Bus",
+    "ocr_confidence": 0.91,
+    "is_violation": False,
+    "latitude": 48.2363472,
+    "longitude": 16.3616113,
+}
+
+
+def variant(**changes):
+    record = dict(VALID_RECORD)
+    for field, value in changes.items():
+        if value is None:
+            del record[field]
+        else:
+            record[field] = value
+    return record
+
+
+class TestBatchValidation(unittest.TestCase):
+    def assert_same_as_per_record(self, payloads):
+        expected = [validator.validate_record(p) for p in payloads]
+        self.assertEqual(validator.validate_batch(payloads), expected)
+
+    def test_valid_batch(self):
+        payloads = [variant(speed_kph=float(i)) for i in range(50)]
+        self.assertEqual(validator.validate_batch(payloads), [None] * 50)
+
+    def test_schema_errors(self):
+        self.assert_same_as_per_record([
+            VALID_RECORD,
+            variant(lane_id=None),
+            variant(speed_kph="80"),
+            variant(lane_id=1.0),
+            variant(street_name=None, speed_kph="fast"),
+            variant(is_violation=1),
+            variant(speed_kph=True),
+            [],
+            VALID_RECORD,
+        ])
+
+    def test_data_errors(self):
+        self.assert_same_as_per_record([
+            variant(street_name=""),
+            variant(street_id="", camera_id="nope"),
+            variant(camera_id="CAM-VIE-10-01"),
+            variant(timestamp="yesterday"),
+            variant(license_plate="oz 638is"),
+            variant(speed_kph=-1.5),
+            variant(speed_kph=300),
+            variant(lane_id=0),
+            variant(vehicle_type="Tram"),
+            variant(ocr_confidence=0.49),
+            variant(ocr_confidence=1.01),
+            variant(latitude=-90.5),
+            variant(longitude=180.1),
+            variant(speed_kph=999.0, ocr_confidence=0.2),
+            VALID_RECORD,
+        ])
+
+    def test_special_numbers(self):
+        self.assert_same_as_per_record([
+            variant(speed_kph=float("nan")),
+            variant(speed_kph=-5.0),
+            variant(latitude=float("inf")),
+            variant(longitude=10 ** 400),
+            VALID_RECORD,
+        ])
+
+
+class TestKinesisDecoder(unittest.TestCase):
+    PAYLOADS = [
+        VALID_RECORD,
+        dict(VALID_RECORD, request_id="extra fields are dropped"),
+        variant(lane_id=None),
+        variant(speed_kph="80"),
+        variant(is_violation=1),
+        [1, 2, 3],
+    ]
+
+    def setUp(self):
+        self.orjson = kinesis_decoder.orjson
+
+    def tearDown(self):
+        kinesis_decoder.orjson = self.orjson
+
+    def decode(self):
+        records = [{"kinesis": {"data": base64.b64encode(json.dumps(p).encode("utf-8")).decode("ascii")}}
+                   for p in self.PAYLOADS]
+        records.append({"kinesis": {"data": base64.b64encode(b"{not json").decode("ascii")}})
+        return kinesis_decoder.decode_kinesis_records(records)
+
+    def assert_decodes_like_validate_schema(self):
+        events, rejected = self.decode()
+        self.assertEqual([e._asdict() for e in events], [VALID_RECORD, VALID_RECORD])
+        self.assertEqual([reason for _, reason in rejected],
+                         [validator.validate_schema(p)[1] for p in self.PAYLOADS[2:]])
+
+    def test_stdlib_backend(self):
+        kinesis_decoder.orjson = None
+        self.assert_decodes_like_validate_schema()
+
+    def test_stdlib_backend_parses_batch_with_one_decoder(self):
+        kinesis_decoder.orjson = None
+        payloads = [json.dumps(p).encode("utf-8") for p in self.PAYLOADS[:5]]
+        self.assertEqual(kinesis_decoder.parse_payloads(payloads), self.PAYLOADS[:5])
+        # A payload that is not an object, or not JSON, sends the batch through json.loads one by one
+        parsed = kinesis_decoder.parse_payloads(payloads + [b"{not json}", b"1, 2"])
+        self.assertEqual(parsed[:5], self.PAYLOADS[:5])
+        self.assertIsInstance(parsed[5], ValueError)
+        self.assertIsInstance(parsed[6], ValueError)
+
+    def test_stdlib_backend_keeps_values_on_their_payloads(self):
+        kinesis_decoder.orjson = None
+        # Three payloads, three values once joined: two from the first, the next two merged
+        payloads = [b'{"a":1},{"b":2}', b'{"c":"}', b'{","d":1}']
+        parsed = kinesis_decoder.parse_payloads(payloads)
+        self.assertEqual(len(parsed), 3)
+        self.assertTrue(all(isinstance(value, ValueError) for value in parsed))
+
+    @unittest.skipIf(kinesis_decoder.orjson is None, "orjson is not installed")
+    def test_orjson_backend(self):
+        self.assert_decodes_like_validate_schema()
+
+    def test_kpl_aggregated_records(self):
+        user_records = [(f"VIE-{i:03d}", json.dumps(variant(speed_kph=float(i)))) for i in range(250)]
+        user_records.append(("VIE-999", json.dumps(variant(lane_id=None))))
+        aggregated = kpl_aggregation.aggregate_records(user_records, max_bytes=16 * 1024)
+        self.assertGreater(len(aggregated), 1)
+        self.assertLess(len(aggregated), 30)
+
+        records = [{"kinesis": {"data": base64.b64encode(data).decode("ascii")}} for _, data in aggregated]
+        # plain records and aggregated records can be mixed in one batch
+        records.append({"kinesis": {"data": base64.b64encode(json.dumps(VALID_RECORD).encode("utf-8")).decode("ascii")}})
+        events, rejected = kinesis_decoder.decode_kinesis_records(records)
+
+        self.assertEqual([e.speed_kph for e in events], [float(i) for i in range(250)] + [VALID_RECORD["speed_kph"]])
+        self.assertEqual([reason for _, reason in rejected], ["Missing field: lane_id"])
+
+
+class TestRejectionLog(unittest.TestCase):
+    def setUp(self):
+        self.dead_letter_file = tempfile.NamedTemporaryFile(suffix=".jsonl", delete=False).name
+        rejections.DEAD_LETTER_FILE = self.dead_letter_file
+        rejections._last_logged.clear()
+
+    def tearDown(self):
+        rejections.DEAD_LETTER_FILE = None
+        os.remove(self.dead_letter_file)
+
+    def flush(self, count):
+        log = rejections.RejectionLog()
+        for i in range(count):
+            log.add("Data", "Invalid speed_kph value", variant(speed_kph=300.0 + i))
+        log.add("Schema", "Missing field: lane_id", variant(lane_id=None))
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(log.flush(), count + 1)
+        return output.getvalue().splitlines()
+
+    def test_counts_samples_and_dead_letters(self):
+        lines = self.flush(50)
+        self.assertIn('"Data: Invalid speed_kph value": 50', lines[0])
+        # one example per reason instead of one line per record
+        self.assertEqual(len(lines), 3)
+
+        with open(self.dead_letter_file, encoding="utf-8") as file:
+            dead_letters = [json.loads(line) for line in file]
+        self.assertEqual(len(dead_letters), 51)
+        self.assertEqual(dead_letters[0]["payload"]["speed_kph"], 300.0)
+
+    def test_examples_are_rate_limited(self):
+        self.flush(5)
+        lines = self.flush(5)
+        self.assertEqual(len(lines), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
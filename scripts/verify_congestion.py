@@ -0,0 +1,55 @@
+import unittest
+import os
+import sys
+
+# Add lambdas directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../lambdas')))
+
+import congestion_calculation
+
+LIMITS = [50, 50, 130, 80, 50]
+SPEEDS = [50.0, 25.0, 100.0, 0.0, -3.0]
+
+
+class TestCongestionModels(unittest.TestCase):
+    def test_speed_ratio_matches_scalar(self):
+        print("\nTesting batched speed ratio against the scalar index...")
+        indices = congestion_calculation.congestion_indices(LIMITS, SPEEDS)
+        expected = [congestion_calculation.calculate_congestion_index(l, s) for l, s in zip(LIMITS, SPEEDS)]
+        self.assertEqual(indices, expected)
+        self.assertEqual(indices[3:], [congestion_calculation.STOPPED_INDEX] * 2)
+        print("Batched speed ratio matches, stopped traffic saturates at the cap.")
+
+    def test_travel_time_and_density(self):
+        print("\nTesting travel time and density models...")
+        tti = congestion_calculation.congestion_indices(LIMITS, SPEEDS, model='travel_time')
+        self.assertEqual(tti[:3], [1.0, 2.0, 1.3])
+        self.assertEqual(tti[3], congestion_calculation.STOPPED_INDEX)
+
+        # 60 vehicles a minute on 2 lanes at 30 km/h: 1800 veh/h/lane -> 60 veh/km/lane
+        density = congestion_calculation.congestion_indices(
+            [50, 50, 50], [30.0, 30.0, 0.0], model='density',
+            vehicle_counts=[60, 0, 10], lanes=[2, 1, 1], interval_seconds=60
+        )
+        self.assertAlmostEqual(density[0], 60 / congestion_calculation.JAM_DENSITY)
+        self.assertEqual(density[1:], [0.0, 1.0])
+        print("Travel time index and occupancy computed per street.")
+
+    def test_handler_batches(self):
+        print("\nTesting batched handler payloads...")
+        response = congestion_calculation.lambda_handler({
+            'model': 'travel_time',
+            'streets': [{'street_id': 'S1', 'speed_limit': 50, 'avg_speed': 25}]
+        }, None)
+        self.assertEqual(response, {'statusCode': 200, 'congestion_indices': {'S1': 2.0}})
+
+        response = congestion_calculation.lambda_handler({'speed_limits': LIMITS, 'avg_speeds': SPEEDS}, None)
+        self.assertEqual(len(response['congestion_indices']), len(LIMITS))
+
+        response = congestion_calculation.lambda_handler({'speed_limits': [50], 'avg_speeds': [1], 'model': 'x'}, None)
+        self.assertEqual(response['statusCode'], 500)
+        print("Handler accepts street lists and columnar arrays.")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+from unittest.mock import MagicMock
+import os
+import sys
+
+# Add lambdas directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../lambdas')))
+
+# Mock boto3 before importing lambdas
+sys.modules['boto3'] = MagicMock()
+
+import data_aggregator
+import history
+import hll
+import history_rollup
+import windowing
+from verify_windowing import ConditionalCheckFailedException, FakeRowTable, FakeStateTable, record
+
+
+class FakeHistoryTable:
+    """
+    In-memory history table keyed by (street_id, window_id), BETWEEN queries over the sort key.
+    """
+    def __init__(self):
+        self.rows = {}
+        self.meta = MagicMock()
+        self.meta.client.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+
+    def put_item(self, Item, ExpressionAttributeValues, **kwargs):
+        # Pane rows, guarded on record_count
+        row = self.rows.get((Item['street_id'], Item['window_id']))
+        if row and row['record_count'] > ExpressionAttributeValues[':count']:
+            raise ConditionalCheckFailedException()
+        self.rows[(Item['street_id'], Item['window_id'])] = Item
+
+    def batch_writer(self, **kwargs):
+        table = self
+
+        class Writer:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                return False
+
+            def put_item(self, Item):
+                table.rows[(Item['street_id'], Item['window_id'])] = Item
+
+        return Writer()
+
+    def query(self, ExpressionAttributeValues, **kwargs):
+        values = ExpressionAttributeValues
+        return {'Items': [row for (s_id, w_id), row in sorted(self.rows.items())
+                          if s_id == values[':s'] and values[':from'] <= w_id <= values[':to']]}
+
+    def series(self, resolution):
+        return {row['window_start_utc']: row for row in self.rows.values()
+                if row['resolution_seconds'] == resolution}
+
+
+class TestHistoryRollups(unittest.TestCase):
+    def setUp(self):
+        data_aggregator.window_table = FakeStateTable()
+        data_aggregator.table = FakeRowTable()
+        data_aggregator.CONGESTION_MODE = 'local'
+        history.history_table = FakeHistoryTable()
+
+    def test_panes_roll_up_into_coarser_series(self):
+        print("\nTesting history rollups...")
+        # Two records a minute from 14:00 to 15:39, every third vehicle passes twice an hour
+        for minute in range(100):
+            hour, minute = 14 + minute // 60, minute % 60
+            records = [dict(record(minute, second, 20 + minute, f"P{(minute * 2 + i) % 90}"),
+                            timestamp=f"2025-12-15T{hour}:{minute:02d}:{second:02d}")
+                       for i, second in enumerate((10, 40))]
+            data_aggregator.persist_windows(records)
+
+        minutes = history.history_table.series(windowing.PANE_SECONDS)
+        self.assertEqual(len(minutes), 100)
+        self.assertEqual(minutes["2025-12-15T14:05:00"]['record_count'], 2)
+
+        data_aggregator.table.rows = {"S1": {"street_id": "S1"}, "#snapshot": {"street_id": "#snapshot"}}
+        data_aggregator.table.scan = lambda **kwargs: {'Items': list(data_aggregator.table.rows.values())}
+        history_rollup.lambda_handler({}, None)
+
+        quarters = history.history_table.series(900)
+        # 15:30-15:45 has not ended behind the watermark (15:39 - 120s), the quarters before it have
+        self.assertEqual(sorted(quarters), [f"2025-12-15T{h}:{m:02d}:00" for h in (14, 15) for m in (0, 15, 30, 45)
+                                            if (h, m) < (15, 30)])
+        quarter = quarters["2025-12-15T14:15:00"]
+        self.assertEqual(quarter['record_count'], 30)
+        self.assertEqual(quarter['average_speed_kph'], 42)
+        self.assertEqual((quarter['min_speed_kph'], quarter['max_speed_kph']), (35, 49))
+        self.assertEqual(quarter['vehicle_count'], 30)
+        self.assertEqual(quarter['window_end_utc'], "2025-12-15T14:30:00")
+
+        # The 15:00 hour is still open
+        self.assertEqual(sorted(history.history_table.series(3600)), ["2025-12-15T14:00:00"])
+        hour = history.history_table.series(3600)["2025-12-15T14:00:00"]
+        self.assertEqual(hour['record_count'], 120)
+        # Merged registers equal the sketch of every plate seen in the hour
+        sketch = hll.HyperLogLog()
+        sketch.update(f"P{p}" for p in range(90))
+        self.assertEqual(hour['vehicle_count'], sketch.count())
+        self.assertEqual(hll.HyperLogLog(hour['plate_registers']), sketch)
+        self.assertEqual(hour['speed_sum'], sum(2 * (20 + m) for m in range(60)))
+        self.assertEqual(hour['dimensions']['lane']['1']['count'], 120)
+
+        # Re-running rewrites the same rows
+        rows = dict(history.history_table.rows)
+        history_rollup.lambda_handler({}, None)
+        self.assertEqual(history.history_table.rows, rows)
+        print("Minute rows merge into exact 15-minute and hourly rows.")
+
+    def test_stale_pane_row_does_not_overwrite(self):
+        print("\nTesting guarded pane history rows...")
+        data_aggregator.persist_windows([record(30, 10, 40, "A")])
+        pane = windowing.pane_start(windowing.event_time("2025-12-15T14:30:00"))
+        partial = data_aggregator.pane_partial(data_aggregator.window_table.items[("S1", pane)])
+        stale = data_aggregator.StreetAccumulator(partial)
+        stale.merge_partial(partial)
+        stale.flush()
+
+        # A concurrent invocation merged a second record and wrote its row first
+        data_aggregator.persist_windows([record(30, 40, 60, "B")])
+        data_aggregator.persist_pane_history({("S1", pane): stale})
+
+        self.assertEqual(history.history_table.series(windowing.PANE_SECONDS)["2025-12-15T14:30:00"]['record_count'], 2)
+        print("The pane row keeps the larger merged totals.")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+import unittest
+from unittest.mock import MagicMock
+import os
+import sys
+import json
+import base64
+import gzip
+
+# Add lambdas directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../lambdas')))
+
+# Mock boto3 before importing lambdas
+sys.modules['boto3'] = MagicMock()
+sys.modules['boto3.dynamodb'] = MagicMock()
+sys.modules['boto3.dynamodb.conditions'] = MagicMock()
+sys.modules['boto3.dynamodb.transform'] = MagicMock()
+sys.modules['boto3.dynamodb.types'] = MagicMock(TypeDeserializer=object)
+
+import latest_state
+import quantiles
+import reader
+import response_encoding
+from response_cache import ResponseCache
+
+
+def row(street_id, speeds):
+    sketch = quantiles.SpeedSketch()
+    for speed in speeds:
+        sketch.add(speed)
+    return {"street_id": street_id, "timestamp_utc": "2025-12-15T14:31:00", "speed_sketch": sketch.encode(),
+            "windows": {"300": {"timestamp_utc": "2025-12-15T14:31:00", "speed_sketch": sketch.encode()}}}
+
+
+class TestTrafficReader(unittest.TestCase):
+    def setUp(self):
+        reader.table = MagicMock()
+        reader.dynamodb = MagicMock()
+        reader.dynamodb.batch_get_item.return_value = {"Responses": {}}
+        reader.response_cache = ResponseCache(ttl_seconds=60)
+
+    def test_traffic_exposes_speed_percentiles(self):
+        print("\nTesting speed percentiles on GET /traffic...")
+        reader.table.scan.return_value = {"Items": [row("S1", range(1, 101))]}
+        response = reader.lambda_handler({"resource": "/traffic"}, None)
+        self.assertEqual(response["statusCode"], 200)
+        street = json.loads(response["body"])[0]
+        self.assertNotIn("speed_sketch", street)
+        self.assertEqual(set(street["speed_percentiles_kph"]), {"p50", "p85", "p95"})
+        self.assertAlmostEqual(street["speed_percentiles_kph"]["p85"], 85, delta=85 * 0.02)
+        self.assertIn("p85", street["windows"]["300"]["speed_percentiles_kph"])
+
+        reader.table.get_item.return_value = {"Item": {"street_id": "S1"}}
+        reader.table.query.return_value = {"Items": [row("S1", [40] * 10)]}
+        response = reader.lambda_handler({"resource": "/traffic",
+                                          "queryStringParameters": {"street_id": "S1", "percentiles": "50,99.5"}}, None)
+        self.assertEqual(set(json.loads(response["body"])["speed_percentiles_kph"]), {"p50", "p99.5"})
+
+        response = reader.lambda_handler({"resource": "/traffic", "queryStringParameters": {"percentiles": "120"}}, None)
+        self.assertEqual(response["statusCode"], 400)
+        print("Percentiles decoded from the stored sketches.")
+
+    def test_traffic_reads_latest_snapshot(self):
+        print("\nTesting GET /traffic from the latest-state snapshot...")
+        shards = {}
+        for street_id in ("S2", "S1", "S3"):
+            key = latest_state.snapshot_key(latest_state.shard_of(street_id))["street_id"]
+            shards.setdefault(key, {"street_id": key})[street_id] = row(street_id, [50])
+        reader.dynamodb.batch_get_item.return_value = {"Responses": {reader.TABLE_NAME: list(shards.values())}}
+
+        response = reader.lambda_handler({"resource": "/traffic"}, None)
+        self.assertEqual([s["street_id"] for s in json.loads(response["body"])], ["S1", "S2", "S3"])
+        reader.table.scan.assert_not_called()
+        request = reader.dynamodb.batch_get_item.call_args.kwargs["RequestItems"][reader.TABLE_NAME]
+        self.assertEqual(len(request["Keys"]), latest_state.LATEST_SNAPSHOT_SHARDS)
+        print("One BatchGetItem, no scan.")
+
+    def test_traffic_delta_since_cursor(self):
+        print("\nTesting GET /traffic?since=<cursor>...")
+        reader.table.scan.return_value = {"Items": []}
+        response = reader.lambda_handler({"resource": "/traffic"}, None)
+        cursor = response["headers"]["X-Cursor"]
+
+        changed = [{"Items": [row("S2", [50])]}, {"Items": [row("S1", [50])]}]
+        reader.table.query.side_effect = changed + [{"Items": []}] * (latest_state.LATEST_SNAPSHOT_SHARDS - 2)
+        response = reader.lambda_handler({"resource": "/traffic", "queryStringParameters": {"since": cursor}}, None)
+        self.assertEqual([s["street_id"] for s in json.loads(response["body"])], ["S1", "S2"])
+        self.assertGreaterEqual(int(response["headers"]["X-Cursor"]), int(cursor))
+        self.assertEqual(reader.table.query.call_count, latest_state.LATEST_SNAPSHOT_SHARDS)
+        self.assertEqual({call.kwargs["IndexName"] for call in reader.table.query.call_args_list}, {latest_state.UPDATE_INDEX})
+
+        response = reader.lambda_handler({"resource": "/traffic", "queryStringParameters": {"since": "yesterday"}}, None)
+        self.assertEqual(response["statusCode"], 400)
+        print("Only the streets of the update index past the cursor are read.")
+
+    def test_numbers_deserialize_to_plain_values(self):
+        print("\nTesting DynamoDB number deserialization...")
+        deserializer = reader.NumberDeserializer()
+        self.assertEqual([deserializer._deserialize_n(value) for value in ("12", "-3", "41.5", "1E+2")],
+                         [12, -3, 41.5, 100.0])
+        self.assertIsInstance(deserializer._deserialize_n("1700000000123"), int)
+
+        resource = MagicMock()
+        reader.deserialize_numbers(resource)
+        events = resource.meta.client.meta.events
+        events.unregister.assert_called_once_with('after-call.dynamodb', unique_id='dynamodb-attr-value-output')
+        self.assertEqual(events.register.call_args.kwargs["unique_id"], 'dynamodb-attr-value-output')
+        print("Numbers arrive as ints and floats, the encoders take them as they are.")
+
+    def test_negotiated_encoding_and_columnar_format(self):
+        print("\nTesting compressed and columnar GET /traffic...")
+        reader.table.scan.return_value = {"Items": [dict(row(f"S{i}", [50]), vehicle_count=i)
+                                                    for i in range(50)]}
+        plain_response = reader.lambda_handler({"resource": "/traffic"}, None)
+        streets = json.loads(plain_response["body"])
+        self.assertEqual(streets[3]["vehicle_count"], 3)
+        self.assertFalse(plain_response["isBase64Encoded"])
+
+        compressed = reader.lambda_handler({"resource": "/traffic",
+                                            "headers": {"Accept-Encoding": "br;q=0, gzip, deflate"}}, None)
+        self.assertEqual(compressed["headers"]["Content-Encoding"], "gzip")
+        self.assertTrue(compressed["isBase64Encoded"])
+        self.assertEqual(json.loads(gzip.decompress(base64.b64decode(compressed["body"]))), streets)
+        self.assertNotEqual(compressed["headers"]["ETag"], plain_response["headers"]["ETag"])
+
+        for event in ({"resource": "/traffic", "queryStringParameters": {"format": "columnar"}},
+                      {"resource": "/traffic", "headers": {"Accept": response_encoding.COLUMNAR_TYPE}}):
+            response = reader.lambda_handler(event, None)
+            self.assertEqual(response["headers"]["Content-Type"], response_encoding.COLUMNAR_TYPE)
+            table = json.loads(response["body"])
+            self.assertEqual(table["count"], 50)
+            self.assertEqual(table["columns"]["street_id"][:2], ["S0", "S1"])
+            self.assertEqual(table["columns"]["vehicle_count"][3], 3)
+
+        response = reader.lambda_handler({"resource": "/traffic", "queryStringParameters": {"format": "xml"}}, None)
+        self.assertEqual(response["statusCode"], 400)
+        if response_encoding.msgpack is None:
+            response = reader.lambda_handler({"resource": "/traffic", "queryStringParameters": {"format": "msgpack"}},
+                                             None)
+            self.assertEqual(response["statusCode"], 406)
+        print("Gzip and the columnar layout are negotiated per request.")
+
+    def test_cached_responses_and_etags(self):
+        print("\nTesting the response cache and conditional requests...")
+        reader.table.scan.return_value = {"Items": [row("S1", [50])]}
+        first = reader.lambda_handler({"resource": "/traffic"}, None)
+        self.assertEqual(first["headers"]["X-Cache"], "MISS")
+        etag = first["headers"]["ETag"]
+
+        second = reader.lambda_handler({"resource": "/traffic"}, None)
+        self.assertEqual((second["headers"]["X-Cache"], second["body"]), ("HIT", first["body"]))
+        self.assertEqual(reader.table.scan.call_count, 1)
+
+        not_modified = reader.lambda_handler({"resource": "/traffic", "headers": {"If-None-Match": etag}}, None)
+        self.assertEqual((not_modified["statusCode"], not_modified["body"]), (304, ""))
+        changed = reader.lambda_handler({"resource": "/traffic", "headers": {"if-none-match": '"other"'}}, None)
+        self.assertEqual(changed["statusCode"], 200)
+        self.assertEqual(reader.response_cache.stats, {"hits": 3, "misses": 1, "not_modified": 1})
+
+        # Errors are not cached
+        reader.lambda_handler({"resource": "/traffic", "queryStringParameters": {"percentiles": "120"}}, None)
+        reader.lambda_handler({"resource": "/traffic", "queryStringParameters": {"percentiles": "120"}}, None)
+        self.assertEqual(reader.response_cache.stats["misses"], 3)
+        print("Repeated polls are served from memory, matching ETags get a 304.")
+
+    def test_alerts_query_the_matching_index(self):
+        print("\nTesting indexed, paginated GET /alerts...")
+        reader.alerts_table = MagicMock()
+        last_key = {"alert_id": "A2", "sensor_type": "S1#GHOST_DRIVER", "timestamp": "2025-12-15T14:31:00"}
+        reader.alerts_table.query.return_value = {"Items": [{"alert_id": "A2"}], "LastEvaluatedKey": last_key}
+
+        params = {"street_id": "S1", "type": "GHOST_DRIVER", "since": "2025-12-15T14:00:00", "limit": "1"}
+        response = reader.lambda_handler({"resource": "/alerts", "queryStringParameters": params}, None)
+        self.assertEqual(json.loads(response["body"]), [{"alert_id": "A2"}])
+        query = reader.alerts_table.query.call_args.kwargs
+        self.assertEqual(query["IndexName"], "sensor_type-timestamp-index")
+        self.assertEqual((query["Limit"], query["ScanIndexForward"]), (1, False))
+        reader.alerts_table.scan.assert_not_called()
+
+        # The token resumes the same query, and survives the response cache
+        token = reader.lambda_handler({"resource": "/alerts", "queryStringParameters": params}, None)["headers"]
+        self.assertEqual(token["X-Cache"], "HIT")
+        next_page = dict(params, next_token=token["X-Next-Token"])
+        reader.alerts_table.query.return_value = {"Items": []}
+        response = reader.lambda_handler({"resource": "/alerts", "queryStringParameters": next_page}, None)
+        self.assertNotIn("X-Next-Token", response["headers"])
+        self.assertEqual(reader.alerts_table.query.call_args.kwargs["ExclusiveStartKey"], last_key)
+
+        # A token of another filter, or a bad limit, is rejected
+        response = reader.lambda_handler({"resource": "/alerts", "queryStringParameters": {
+            "street_id": "S1", "next_token": token["X-Next-Token"]}}, None)
+        self.assertEqual(response["statusCode"], 400)
+        response = reader.lambda_handler({"resource": "/alerts", "queryStringParameters": {"limit": "0"}}, None)
+        self.assertEqual(response["statusCode"], 400)
+
+        reader.lambda_handler({"resource": "/alerts"}, None)
+        self.assertEqual(reader.alerts_table.query.call_args.kwargs["IndexName"], "feed-timestamp-index")
+        print("Each filter reads its own index, newest first, one page at a time.")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+from unittest.mock import MagicMock
+import os
+import sys
+
+# Add lambdas directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../lambdas')))
+
+# Mock boto3 before importing lambdas
+sys.modules['boto3'] = MagicMock()
+
+import data_aggregator
+import hll
+import partial_aggregates
+import quantiles
+
+
+def plates(start, stop):
+    return [f"W-{i:05d}" for i in range(start, stop)]
+
+
+class TestDistinctVehicles(unittest.TestCase):
+    def test_estimate_within_error_bound(self):
+        print("\nTesting HyperLogLog accuracy...")
+        self.assertEqual(hll.HyperLogLog().count(), 0)
+        small = hll.HyperLogLog()
+        for plate in plates(0, 50) * 3:
+            small.add(plate)
+        self.assertEqual(small.count(), 50)
+
+        sketch = hll.HyperLogLog()
+        for plate in plates(0, 20000):
+            sketch.add(plate)
+        standard_error = 1.04 / hll.HLL_REGISTERS ** 0.5
+        self.assertLess(abs(sketch.count() - 20000) / 20000, 3 * standard_error)
+        self.assertEqual(len(sketch.registers), hll.HLL_REGISTERS)
+        print(f"Estimated {sketch.count()} of 20000 distinct plates in {hll.HLL_REGISTERS} registers.")
+
+    def test_sketches_merge_like_sets(self):
+        print("\nTesting HyperLogLog merges...")
+        a, b, union = hll.HyperLogLog(), hll.HyperLogLog(), hll.HyperLogLog()
+        for plate in plates(0, 3000):
+            a.add(plate)
+            union.add(plate)
+        for plate in plates(2000, 5000):
+            b.add(plate)
+            union.add(plate)
+
+        merged = hll.HyperLogLog(a.encode())
+        merged.merge(b)
+        self.assertEqual(merged, union)
+        # The sparse encodings merge by plain set union, as DynamoDB ADD does
+        self.assertEqual(hll.HyperLogLog(set(a.encode()) | set(b.encode())), union)
+        print("Merged sketches equal the sketch of the union.")
+
+    def test_average_uses_record_count(self):
+        print("\nTesting averages over repeated plates...")
+        records = [
+            {"street_id": "S1", "street_name": "Main St", "speed_kph": speed, "speed_limit": 50,
+             "license_plate": "SAME", "lane_id": 1, "latitude": 48.2, "longitude": 16.3,
+             "timestamp": "2025-12-15T14:30:00"}
+            for speed in (30, 50, 70)
+        ]
+        stats = data_aggregator.aggregate_metrics(partial_aggregates.build_partials(records))["S1"]
+        self.assertEqual(stats.vehicle_count, 1)
+        self.assertEqual(stats.record_count, 3)
+        self.assertEqual(data_aggregator.average_speed(stats), 50)
+
+        legacy = dict(partial_aggregates.build_partials(records)[0], license_plates=["SAME", "OTHER"])
+        del legacy["plate_registers"]
+        self.assertEqual(data_aggregator.aggregate_metrics([legacy])["S1"].vehicle_count, 2)
+        print("Speeds are averaged over every record, vehicles are counted once.")
+
+
+class TestSpeedPercentiles(unittest.TestCase):
+    def test_percentiles_within_relative_error(self):
+        print("\nTesting speed sketch percentiles...")
+        # A jam mixed with free flow, the average hides both
+        speeds = [8 + i % 7 for i in range(300)] + [95 + i % 30 for i in range(700)]
+        sketch = quantiles.SpeedSketch()
+        for speed in speeds:
+            sketch.add(speed)
+
+        ordered = sorted(speeds)
+        for p, value in sketch.percentiles((10, 50, 85, 95)).items():
+            exact = ordered[int(float(p[1:]) / 100 * (len(ordered) - 1))]
+            self.assertLessEqual(abs(value - exact) / exact, quantiles.SPEED_SKETCH_ACCURACY + 1e-9)
+        self.assertLessEqual(len(sketch.counts), quantiles.MAX_BUCKET + 1)
+        print(f"Percentiles {sketch.percentiles()} from {len(sketch.counts)} buckets.")
+
+    def test_sketches_merge_and_encode(self):
+        print("\nTesting speed sketch merges and encoding...")
+        a, b, union = quantiles.SpeedSketch(), quantiles.SpeedSketch(), quantiles.SpeedSketch()
+        for i in range(200):
+            a.add(30 + i % 40)
+            b.add(0 if i % 10 == 0 else 60 + i % 50)
+            union.add(30 + i % 40)
+            union.add(0 if i % 10 == 0 else 60 + i % 50)
+
+        merged = quantiles.SpeedSketch(a.encode())
+        merged.update_encoded(b.encode())
+        self.assertEqual(merged, union)
+        self.assertEqual(quantiles.SpeedSketch(union.encode()), union)
+        self.assertEqual(union.quantile(0), 0.0)
+        self.assertIsNone(quantiles.SpeedSketch().quantile(0.5))
+
+        records = [
+            {"street_id": "S1", "street_name": "Main St", "speed_kph": 30 + i, "speed_limit": 50,
+             "license_plate": f"P{i}", "lane_id": 1, "latitude": 48.2, "longitude": 16.3,
+             "timestamp": "2025-12-15T14:30:00"}
+            for i in range(40)
+        ]
+        from_partials = data_aggregator.aggregate_metrics(partial_aggregates.build_partials(records))["S1"]
+        self.assertEqual(from_partials.speed_sketch, data_aggregator.aggregate_metrics(records)["S1"].speed_sketch)
+        print("Merged and decoded sketches equal the sketch of all speeds.")
+
+
+if __name__ == '__main__':
+    unittest.main()
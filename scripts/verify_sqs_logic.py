@@ -13,16 +13,27 @@ sys.modules['boto3'] = MagicMock()
 
 import validator
 import data_aggregator
+import sqs_fanout
+import envelope
+import partial_aggregates
+import partitioning
+
+persist_aggregated_data = data_aggregator.persist_aggregated_data
 
 class TestSQSFlow(unittest.TestCase):
     def setUp(self):
         # Setup mocks
         self.mock_sqs = MagicMock()
         self.mock_boto3_client = MagicMock(return_value=self.mock_sqs)
-        validator.boto3.client = self.mock_boto3_client
+        sqs_fanout.boto3.client = self.mock_boto3_client
+        sqs_fanout._sqs_client = None
+        sqs_fanout.SQS_RETRY_BASE_DELAY = 0
         
         # Set env var
         validator.AGGREGATION_QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/123456789012/UrbanFlowAggregationQueue"
+        validator.AGGREGATION_MESSAGE_FORMAT = "record"
+        validator.AGGREGATION_COMPRESSION = False
+        data_aggregator.AGGREGATION_MODE = "batch"
 
     def test_validator_producer_batch(self):
         print("\nTesting Validator Producer Logic...")
@@ -35,37 +46,221 @@ class TestSQSFlow(unittest.TestCase):
         self.assertEqual(self.mock_sqs.send_message_batch.call_count, 2)
         print("Validator correctly batched calls to SQS.")
 
+    def test_validator_reuses_client(self):
+        records = [{"id": i} for i in range(5)]
+        validator.forward_to_aggregation(records)
+        validator.forward_to_aggregation(records)
+        self.assertEqual(self.mock_boto3_client.call_count, 1)
+
+    def test_validator_retries_failed_entries(self):
+        print("\nTesting Validator partial failure retry...")
+        # First call: entry 3 is throttled and entry 7 is rejected for good, the retry succeeds
+        self.mock_sqs.send_message_batch.side_effect = [
+            {"Successful": [], "Failed": [
+                {"Id": "3", "SenderFault": False, "Code": "ThrottlingException"},
+                {"Id": "7", "SenderFault": True, "Code": "InvalidMessageContents"},
+            ]},
+            {"Successful": [{"Id": "3"}], "Failed": []},
+        ]
+        records = [{"id": i} for i in range(10)]
+
+        with patch.object(validator, "ship_dead_letters") as ship:
+            delivered, dropped, first_undelivered = validator.forward_to_aggregation(records)
+
+        # the refused entry is dead-lettered and does not fail the batch
+        self.assertEqual((delivered, dropped, first_undelivered), (9, 1, None))
+        retry_entries = self.mock_sqs.send_message_batch.call_args_list[1].kwargs["Entries"]
+        self.assertEqual(retry_entries, [{"Id": "3", "MessageBody": json.dumps({"id": 3})}])
+        self.assertEqual([d["payload"] for d in ship.call_args.args[0]], [{"id": 7}])
+        print("Validator retried only the failed entry.")
+
+    def test_oversized_record_is_dead_lettered(self):
+        print("\nTesting Validator oversized record...")
+        records = [{"id": 0}, {"id": 1, "content": "x" * sqs_fanout.SQS_BATCH_MAX_BYTES}, {"id": 2}]
+
+        with patch.object(validator, "ship_dead_letters") as ship:
+            delivered, dropped, first_undelivered = validator.forward_to_aggregation(records)
+
+        self.assertEqual((delivered, dropped, first_undelivered), (2, 1, None))
+        sent = [entry["MessageBody"] for call in self.mock_sqs.send_message_batch.call_args_list
+                for entry in call.kwargs["Entries"]]
+        self.assertEqual(sent, [json.dumps({"id": 0}), json.dumps({"id": 2})])
+        self.assertEqual([d["payload"]["id"] for d in ship.call_args.args[0]], [1])
+        print("The oversized record went to the dead letters, the others were forwarded.")
+
+    def test_validator_packs_envelopes(self):
+        print("\nTesting Validator envelope packing...")
+        validator.AGGREGATION_MESSAGE_FORMAT = "envelope"
+        records = [{"id": i, "content": "data"} for i in range(500)]
+
+        delivered, dropped, first_undelivered = validator.forward_to_aggregation(records)
+
+        self.assertEqual((delivered, dropped, first_undelivered), (500, 0, None))
+        self.assertEqual(self.mock_sqs.send_message_batch.call_count, 1)
+        entries = self.mock_sqs.send_message_batch.call_args.kwargs["Entries"]
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(envelope.unpack_message(entries[0]["MessageBody"]), records)
+        print("Validator packed 500 records into one message.")
+
+    def test_validator_resumes_at_failed_segment(self):
+        print("\nTesting Validator segmented forwarding...")
+        validator.FORWARD_SEGMENT_RECORDS = 4
+        # 12 records from 6 Kinesis records, cut into 3 segments starting at records 0, 2 and 4
+        records = [{"id": i} for i in range(12)]
+        positions = [i // 2 for i in range(12)]
+        sent = []
+
+        def send_message_batch(QueueUrl, Entries):
+            sent.extend(json.loads(entry["MessageBody"])["id"] for entry in Entries)
+            return {"Failed": [{"Id": e["Id"], "SenderFault": False} for e in Entries
+                               if json.loads(e["MessageBody"])["id"] == 5]}
+        self.mock_sqs.send_message_batch.side_effect = send_message_batch
+        try:
+            delivered, dropped, first_undelivered = validator.forward_to_aggregation(records, positions)
+        finally:
+            validator.FORWARD_SEGMENT_RECORDS = 500
+
+        # the second segment failed, the retry starts at its first record, the last segment was held back
+        self.assertEqual((delivered, dropped, first_undelivered), (7, 5, 2))
+        self.assertNotIn(8, sent)
+        print("Validator held back the last segment and reported the failed one.")
+
+    def test_batches_stay_under_request_size_limit(self):
+        print("\nTesting SQS batch request size limit...")
+        validator.AGGREGATION_MESSAGE_FORMAT = "envelope"
+        # Every record fills most of an envelope, so each message is close to the size limit
+        records = [{"id": i, "content": "x" * (envelope.MAX_MESSAGE_BYTES - 100)} for i in range(25)]
+
+        delivered, dropped, first_undelivered = validator.forward_to_aggregation(records)
+
+        self.assertEqual((delivered, dropped, first_undelivered), (25, 0, None))
+        calls = self.mock_sqs.send_message_batch.call_args_list
+        self.assertEqual(sum(len(call.kwargs["Entries"]) for call in calls), 25)
+        for call in calls:
+            size = sum(len(entry["MessageBody"].encode("utf-8")) for entry in call.kwargs["Entries"])
+            self.assertLessEqual(size, sqs_fanout.SQS_BATCH_MAX_BYTES)
+        print("Near-limit envelopes are sent one per batch request.")
+
+    def test_envelope_size_limit_and_compression(self):
+        records = [{"id": i, "content": "x" * 1000} for i in range(1000)]
+        for compress in (False, True):
+            messages = envelope.pack_records(records, compress=compress, max_bytes=64 * 1024)
+            self.assertTrue(all(len(body) <= 64 * 1024 for body, _ in messages))
+            self.assertEqual(sum(count for _, count in messages), len(records))
+            unpacked = [r for body, _ in messages for r in envelope.unpack_message(body)]
+            self.assertEqual(unpacked, records)
+
     def test_aggregator_consumer_logic(self):
         print("\nTesting Aggregator Consumer Logic...")
         
-        # Create a dummy SQS event with 2 records
+        # Create a dummy SQS event with 2 legacy single-record messages and one compressed envelope
         record_body_1 = json.dumps({"street_id": "S1", "speed_kph": 50, "vehicle_type": "Car", "license_plate": "A"})
         record_body_2 = json.dumps({"street_id": "S1", "speed_kph": 60, "vehicle_type": "Car", "license_plate": "B"})
         
+        record_body_3, _ = envelope.pack_records([
+            {"street_id": "S1", "speed_kph": 70, "vehicle_type": "Car", "license_plate": "C"},
+            {"street_id": "S1", "speed_kph": 80, "vehicle_type": "Car", "license_plate": "D"},
+        ], compress=True)[0]
+
         event = {
             "Records": [
                 {"body": record_body_1},
-                {"body": record_body_2}
+                {"body": record_body_2},
+                {"body": record_body_3}
             ]
         }
         
-        # Mock aggregator's internal calls (Dynamo, Congestion calc)
+        # Mock aggregator's internal calls (Dynamo)
         data_aggregator.persist_aggregated_data = MagicMock()
-        data_aggregator.get_congestion_index = MagicMock(return_value=1.0) # Mock if needed inside aggregate_metrics
         
         # Invoke handler
         response = data_aggregator.lambda_handler(event, None)
         
         self.assertEqual(response['statusCode'], 200)
         
-        # Calculate expected average: (50+60)/2 = 55
+        # Calculate expected average: (50+60+70+80)/4 = 65
         # Check if persist_aggregated_data was called with correct data
         args, _ = data_aggregator.persist_aggregated_data.call_args
         street_stats = args[0]
         self.assertIn("S1", street_stats)
-        self.assertEqual(street_stats["S1"]["total_speed"], 110)
-        self.assertEqual(street_stats["S1"]["vehicle_count"], 2)
+        self.assertEqual(street_stats["S1"].total_speed, 260)
+        self.assertEqual(street_stats["S1"].vehicle_count, 4)
         print("Aggregator correctly processed SQS records.")
 
+    def test_partials_match_raw_aggregation(self):
+        print("\nTesting producer-side partial aggregation...")
+        records = [
+            {"street_id": f"S{i % 3}", "street_name": f"Street {i % 3}", "speed_kph": 30 + i,
+             "speed_limit": 50, "license_plate": f"AB {i % 7:03d}CD", "lane_id": 1 + i % 2,
+             "timestamp": f"2025-12-15T14:{i % 3:02d}:{i:02d}", "latitude": 48.2, "longitude": 16.3}
+            for i in range(40)
+        ]
+        partials = partial_aggregates.build_partials(records[:25]) + partial_aggregates.build_partials(records[25:])
+        self.assertEqual(len(partials), 6)
+
+        self.assertEqual(data_aggregator.aggregate_metrics(partials), data_aggregator.aggregate_metrics(records))
+        print("Merged partials match the raw record aggregation.")
+
+    def test_sub_keyed_shards_merge_per_street(self):
+        print("\nTesting hot street sub-keys across shards...")
+        records = [
+            {"street_id": "VIE-004", "street_name": "Westautobahn (A1)", "speed_kph": 100 + i % 30,
+             "speed_limit": 130, "license_plate": f"AB {i:03d}CD", "lane_id": 1 + i % 3,
+             "timestamp": f"2025-12-15T14:36:{i % 60:02d}", "latitude": 48.2, "longitude": 16.2}
+            for i in range(200)
+        ]
+        sub_keys = partitioning.hot_street_sub_keys(20.0, shard_count=4)
+        self.assertGreaterEqual(sub_keys, 4)
+
+        # Every sub-key is consumed by its own validator (shard), each forwarding its own partials
+        shards = {}
+        for record in records:
+            key = partitioning.partition_key(record["street_id"], sub_keys)
+            self.assertTrue(key.startswith("VIE-004#"))
+            shards.setdefault(key, []).append(record)
+        self.assertGreater(len(shards), 1)
+        partials = [p for shard in shards.values() for p in partial_aggregates.build_partials(shard)]
+
+        stats = data_aggregator.aggregate_metrics(partials)
+        self.assertEqual(list(stats), ["VIE-004"])
+        self.assertEqual(stats, data_aggregator.aggregate_metrics(records))
+        print("Sub-keyed partials recombined into one street aggregate.")
+
+    def test_congestion_batched_per_invocation(self):
+        print("\nTesting batched congestion computation...")
+        stats = data_aggregator.aggregate_metrics([
+            {"street_id": f"S{i % 5}", "street_name": f"Street {i % 5}", "speed_kph": 20 + i,
+             "speed_limit": 50, "license_plate": f"AB {i:03d}CD", "latitude": 48.2, "longitude": 16.3}
+            for i in range(20)
+        ])
+        data_aggregator.table = MagicMock()
+        batch = data_aggregator.table.batch_writer.return_value.__enter__.return_value
+        data_aggregator.lambda_client = MagicMock()
+
+        # Same write time for both runs, the rows carry it as updated_at
+        with patch.object(data_aggregator, 'CONGESTION_MODE', 'local'), \
+                patch.object(data_aggregator, 'time', return_value=1767225600.0):
+            persist_aggregated_data(stats, "2026-01-01T00:00:00")
+        data_aggregator.lambda_client.invoke.assert_not_called()
+        local_items = {c.kwargs['Item']['street_id']: c.kwargs['Item'] for c in batch.put_item.call_args_list}
+        self.assertEqual(len(local_items), 5)
+
+        indices = {s_id: float(item['congestion_index']) for s_id, item in local_items.items()}
+        data_aggregator.lambda_client.invoke.return_value = {
+            'Payload': MagicMock(read=MagicMock(return_value=json.dumps({'congestion_indices': indices})))
+        }
+        batch.put_item.reset_mock()
+        with patch.object(data_aggregator, 'CONGESTION_MODE', 'remote'), \
+                patch.object(data_aggregator, 'CALCULATION_ARN', 'arn:congestion'), \
+                patch.object(data_aggregator, 'time', return_value=1767225600.0):
+            persist_aggregated_data(stats, "2026-01-01T00:00:00")
+        self.assertEqual(data_aggregator.lambda_client.invoke.call_count, 1)
+        payload = json.loads(data_aggregator.lambda_client.invoke.call_args.kwargs['Payload'])
+        self.assertEqual(len(payload['streets']), 5)
+        remote_items = {c.kwargs['Item']['street_id']: c.kwargs['Item'] for c in batch.put_item.call_args_list}
+        self.assertEqual(remote_items, local_items)
+        print("Congestion computed once per invocation, locally or in a single batched invoke.")
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import os
+import sys
+import json
+import base64
+
+# Add lambdas directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../lambdas')))
+
+# Mock boto3 before importing lambdas
+sys.modules['boto3'] = MagicMock()
+
+import anomaly_detector
+import batch_failures
+import kinesis_decoder
+import stream_consumer
+import validator
+
+RECORD = {
+    "street_name": "Main St",
+    "street_id": "S1",
+    "camera_id": "CAM-SST-001-01",
+    "timestamp": "2025-12-15T14:36:04",
+    "license_plate": "GH 066ST",
+    "speed_kph": 42.0,
+    "speed_limit": 50,
+    "lane_id": 1,
+    "vehicle_type": "Car",
+    "ocr_confidence": 0.99,
+    "is_violation": False,
+    "latitude": 40.7128,
+    "longitude": -74.0060,
+}
+
+
+def kinesis_event(payloads):
+    return {"Records": [
+        {"kinesis": {"data": base64.b64encode(json.dumps(p).encode("utf-8")).decode("ascii"),
+                     "sequenceNumber": str(i)}}
+        for i, p in enumerate(payloads)
+    ]}
+
+
+class TestStreamConsumer(unittest.TestCase):
+    def setUp(self):
+        anomaly_detector.alerts_table = MagicMock()
+        validator.AGGREGATION_QUEUE_URL = None
+
+    def test_ghost_driver_detector(self):
+        events, _ = kinesis_decoder.decode_kinesis_records(
+            kinesis_event([RECORD, dict(RECORD, speed_kph=-50.5)])["Records"])
+        alerts = anomaly_detector.detect_anomalies(events)
+        self.assertEqual([a["type"] for a in alerts], ["GHOST_DRIVER"])
+        self.assertEqual(alerts[0]["sensor_id"], "S1")
+        self.assertEqual((alerts[0]["feed"], alerts[0]["sensor_type"]), ("ALL", "S1#GHOST_DRIVER"))
+
+    def test_single_decode_runs_all_stages(self):
+        event = kinesis_event([RECORD, dict(RECORD, speed_kph=-50.5)])
+        decode = MagicMock(side_effect=kinesis_decoder.decode_kinesis_records)
+        forward = MagicMock(return_value=(1, 0, None))
+
+        with patch.object(stream_consumer, "decode_kinesis_records", decode), \
+                patch.object(validator, "forward_to_aggregation", forward):
+            stream_consumer.lambda_handler(event, None)
+
+        self.assertEqual(decode.call_count, 1)
+        # the ghost driver is alerted on and rejected by validation, the normal record is forwarded
+        batch = anomaly_detector.alerts_table.batch_writer.return_value.__enter__.return_value
+        self.assertEqual(batch.put_item.call_count, 1)
+        self.assertEqual([r["speed_kph"] for r in forward.call_args.args[0]], [42.0])
+
+
+class TestBatchItemFailures(unittest.TestCase):
+    def setUp(self):
+        self.records = kinesis_event([dict(RECORD, speed_kph=float(i)) for i in range(16)])["Records"]
+        self.processed = []
+        self.mode = batch_failures.BATCH_FAILURE_MODE
+
+    def tearDown(self):
+        batch_failures.BATCH_FAILURE_MODE = self.mode
+
+    def process(self, poison):
+        def process(records):
+            if any(r["kinesis"]["sequenceNumber"] in poison for r in records):
+                raise ValueError("poison record")
+            self.processed.extend(r["kinesis"]["sequenceNumber"] for r in records)
+        return process
+
+    def test_report_first_failure_in_order(self):
+        batch_failures.BATCH_FAILURE_MODE = "report"
+        response = batch_failures.handle_kinesis_batch(self.records, self.process({"5", "11"}))
+
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "5"}]})
+        # everything before the checkpoint is processed exactly once, nothing after it
+        self.assertEqual(sorted(self.processed, key=int), [str(i) for i in range(5)])
+
+    def test_bisect_isolates_poison_records(self):
+        batch_failures.BATCH_FAILURE_MODE = "bisect"
+        with patch.object(batch_failures, "ship_dead_letters") as ship:
+            response = batch_failures.handle_kinesis_batch(self.records, self.process({"5", "11"}))
+
+        self.assertEqual(response, {"batchItemFailures": []})
+        self.assertEqual(sorted(self.processed, key=int), [str(i) for i in range(16) if i not in (5, 11)])
+        self.assertEqual([d["payload"]["sequenceNumber"] for d in ship.call_args.args[0]], ["5", "11"])
+
+    def test_bisect_retries_whole_batch_on_outage(self):
+        batch_failures.BATCH_FAILURE_MODE = "bisect"
+        response = batch_failures.handle_kinesis_batch(self.records, self.process({str(i) for i in range(16)}))
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "0"}]})
+
+    def test_bisect_does_not_split_delivery_failures(self):
+        batch_failures.BATCH_FAILURE_MODE = "bisect"
+        calls = []
+
+        def process(records):
+            calls.append(len(records))
+            if records[0]["kinesis"]["sequenceNumber"] == "0":
+                raise batch_failures.DeliveryError("SQS throttled", 6)
+            self.processed.extend(r["kinesis"]["sequenceNumber"] for r in records)
+
+        with patch.object(batch_failures, "ship_dead_letters") as ship:
+            response = batch_failures.handle_kinesis_batch(self.records, process)
+
+        # retried from the first undelivered record, delivered chunks are not sent again
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "6"}]})
+        self.assertEqual(calls, [16])
+        ship.assert_not_called()
+
+    def test_handler_reports_failed_sqs_delivery(self):
+        batch_failures.BATCH_FAILURE_MODE = "report"
+        validator.AGGREGATION_QUEUE_URL = "queue"
+        try:
+            with patch.object(validator, "undelivered", return_value=[0]):
+                response = validator.lambda_handler(kinesis_event([RECORD]), None)
+        finally:
+            validator.AGGREGATION_QUEUE_URL = None
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "0"}]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,316 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from datetime import datetime
+import json
+import os
+import re
+import sys
+import time
+
+# Add lambdas directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../lambdas')))
+
+# Mock boto3 before importing lambdas
+sys.modules['boto3'] = MagicMock()
+
+import congestion_calculation
+import data_aggregator
+import dimensions
+import history
+import latest_state
+import partial_aggregates
+import quantiles
+import windowing
+from write_behind import WriteBehindBuffer
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class FakeStateTable:
+    """
+    In-memory stand-in for the window state table, understands the ADD/SET updates the aggregator sends.
+    """
+    def __init__(self):
+        self.items = {}
+        self.meta = MagicMock()
+        self.meta.client.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+
+    def _item(self, key):
+        return self.items.setdefault((key['street_id'], key['pane_start']), dict(key))
+
+    def get_item(self, Key, **kwargs):
+        item = self.items.get((Key['street_id'], Key['pane_start']))
+        return {'Item': dict(item)} if item else {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+                    ConditionExpression=None, **kwargs):
+        # Only the message marker conditions of save_panes are understood
+        merged = self.items.get((Key['street_id'], Key['pane_start']), {}).get('merged_messages', set())
+        if any(ExpressionAttributeValues[value] in merged for value in re.findall(r':m\d+', ConditionExpression or '')):
+            raise ConditionalCheckFailedException()
+        item = self._item(Key)
+        names = ExpressionAttributeNames or {}
+        add, _, assign = UpdateExpression.partition('SET ')
+        for clause in add.replace('ADD ', '').split(','):
+            if clause.strip():
+                name, value = clause.split()
+                name, value = names.get(name, name), ExpressionAttributeValues[value]
+                if isinstance(value, set):
+                    item[name] = item.get(name, set()) | value
+                else:
+                    item[name] = item.get(name, 0) + value
+        for clause in assign.split(','):
+            if clause.strip():
+                name, value = (part.strip() for part in clause.split('='))
+                item[name] = ExpressionAttributeValues[value]
+        return {'Attributes': dict(item)}
+
+    def query(self, ExpressionAttributeValues, **kwargs):
+        s_id, start = ExpressionAttributeValues[':s'], ExpressionAttributeValues[':from']
+        return {'Items': [dict(item) for (key, pane), item in sorted(self.items.items())
+                          if key == s_id and pane >= start]}
+
+
+class FakeRowTable:
+    """
+    In-memory aggregated table, applies the aggregator's newer-or-more-complete guard on puts.
+    """
+    def __init__(self):
+        self.rows = {}
+        self.puts = []
+        self.meta = MagicMock()
+        self.meta.client.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+
+    def put_item(self, Item, ExpressionAttributeValues, **kwargs):
+        self.puts.append(Item)
+        row = self.rows.get(Item['street_id'])
+        if row and (row['window_start_utc'], row['record_count']) > (Item['window_start_utc'], Item['record_count']):
+            raise ConditionalCheckFailedException()
+        self.rows[Item['street_id']] = Item
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues, **kwargs):
+        # Latest-state snapshot updates, one 'SET #sN = :rN' per street
+        snapshot = self.rows.setdefault(Key['street_id'], dict(Key))
+        for clause in UpdateExpression.replace('SET ', '').split(','):
+            name, value = (part.strip() for part in clause.split('='))
+            snapshot[ExpressionAttributeNames[name]] = ExpressionAttributeValues[value]
+
+
+def record(minute, second, speed, plate, street="S1"):
+    return {"street_id": street, "street_name": "Main St", "speed_kph": speed, "speed_limit": 50,
+            "license_plate": plate, "lane_id": 1, "latitude": 48.2, "longitude": 16.3,
+            "timestamp": f"2025-12-15T14:{minute:02d}:{second:02d}"}
+
+
+class TestEventTimeWindows(unittest.TestCase):
+    def setUp(self):
+        data_aggregator.window_table = FakeStateTable()
+        data_aggregator.table = FakeRowTable()
+        data_aggregator.CONGESTION_MODE = 'local'
+
+    def written(self):
+        return data_aggregator.table.puts[-1]
+
+    def test_window_bounds(self):
+        print("\nTesting pane and window assignment...")
+        pane = windowing.pane_start(windowing.event_time("2025-12-15T14:36:04"))
+        self.assertEqual(windowing.to_iso(pane), "2025-12-15T14:36:00")
+        start, end = windowing.latest_window(900, pane)
+        self.assertEqual((windowing.to_iso(start), windowing.to_iso(end)),
+                         ("2025-12-15T14:22:00", "2025-12-15T14:37:00"))
+        self.assertEqual(windowing.latest_window(60, pane), (pane, pane + 60))
+        print("Records fall into one pane, windows end on their slide.")
+
+    def test_windows_accumulate_across_invocations(self):
+        print("\nTesting event-time windows across invocations...")
+        data_aggregator.persist_windows([record(30, 10, 40, "A"), record(30, 50, 60, "B")])
+        item = self.written()
+        self.assertEqual(item['timestamp_utc'], "2025-12-15T14:31:00")
+        self.assertEqual(item['average_speed_kph'], 50)
+
+        # A later invocation, plus a record for the earlier minute arriving late but within tolerance
+        data_aggregator.persist_windows([record(33, 0, 30, "C"), record(31, 59, 70, "D")])
+        item = self.written()
+        self.assertEqual(item['timestamp_utc'], "2025-12-15T14:34:00")
+        self.assertEqual(item['vehicle_count'], 1)
+        self.assertEqual(item['windows']['300']['vehicle_count'], 4)
+        self.assertEqual(item['windows']['300']['average_speed_kph'], 50)
+        self.assertEqual(item['windows']['300']['min_speed_kph'], 30)
+        self.assertEqual(sum(quantiles.SpeedSketch(item['windows']['300']['speed_sketch']).counts.values()), 4)
+        self.assertFalse(item['window_final'])
+
+        # Too late: the 14:30 pane ended before the watermark (14:33 - 120s)
+        data_aggregator.persist_windows([record(30, 20, 100, "E")])
+        self.assertEqual(len(data_aggregator.table.puts), 2)
+        pane = windowing.pane_start(windowing.event_time("2025-12-15T14:30:00"))
+        self.assertEqual(data_aggregator.window_table.items[("S1", pane)]['record_count'], 2)
+        print("Panes merge across invocations and the watermark drops late data.")
+
+    def test_future_event_time_does_not_move_watermark(self):
+        print("\nTesting clock skew bound...")
+        future = datetime.fromtimestamp(time.time() + 3600).isoformat(timespec="seconds")
+        with patch.object(data_aggregator, "ship_dead_letters") as ship:
+            data_aggregator.persist_windows([dict(record(30, 10, 40, "A"), timestamp=future)])
+        self.assertEqual([d["payload"]["timestamp"] for d in ship.call_args.args[0]], [future])
+        self.assertNotIn(data_aggregator.WATERMARK_KEY["street_id"],
+                         {s_id for s_id, _ in data_aggregator.window_table.items})
+
+        # On-time records of other streets are still counted
+        data_aggregator.persist_windows([record(30, 10, 40, "B", street="S2"), record(30, 20, 60, "C", street="S3")])
+        self.assertEqual(data_aggregator.table.rows["S2"]['record_count'], 1)
+        self.assertEqual(data_aggregator.table.rows["S3"]['record_count'], 1)
+        print("A record from the future is dead-lettered and leaves the watermark alone.")
+
+    def test_density_uses_window_length(self):
+        print("\nTesting density over windows longer than a minute...")
+        data_aggregator.CONGESTION_MODEL = 'density'
+        try:
+            data_aggregator.persist_windows([record(30, 10, 40, "A"), record(30, 50, 60, "B")])
+        finally:
+            data_aggregator.CONGESTION_MODEL = 'speed_ratio'
+        item = data_aggregator.table.rows["S1"]
+        # 2 vehicles at 50 km/h on one lane: 120 vehicles/h over a minute, 24 vehicles/h over 5 minutes
+        for window, interval in ((item, 60), (item['windows']['300'], 300), (item['windows']['900'], 900)):
+            expected = 2 * 3600 / interval / 50 / congestion_calculation.JAM_DENSITY
+            self.assertAlmostEqual(float(window['congestion_index']), expected, places=4)
+        print("Each window's density is computed over its own length.")
+
+    def test_watermark_finalizes_windows(self):
+        print("\nTesting watermark closing windows...")
+        data_aggregator.persist_windows([record(30, 10, 40, "A"), record(40, 0, 50, "B", street="S2")])
+        written = data_aggregator.table.rows
+        self.assertTrue(written["S1"]['window_final'])
+        self.assertFalse(written["S2"]['window_final'])
+        self.assertTrue(written["S1"]['windows']['900']['window_final'])
+        self.assertFalse(written["S2"]['windows']['900']['window_final'])
+        snapshot = {}
+        for key in latest_state.snapshot_keys():
+            snapshot.update(written.get(key['street_id'], {}))
+        self.assertEqual(snapshot["S1"], written["S1"])
+        self.assertEqual(snapshot["S2"], written["S2"])
+        self.assertEqual(written["S1"]['latest_shard'], latest_state.shard_of("S1"))
+        self.assertGreater(written["S1"]['updated_at'], 0)
+        print("Windows ending before the watermark are final, the latest-state snapshot follows the rows.")
+
+    def test_stale_snapshot_does_not_overwrite(self):
+        print("\nTesting merge-on-write under concurrent invocations...")
+        data_aggregator.persist_windows([record(30, 10, 40, "A")])
+        pane = windowing.pane_start(windowing.event_time("2025-12-15T14:30:00"))
+        stale = data_aggregator.street_windows(data_aggregator.window_table.query(
+            ExpressionAttributeValues={':s': "S1", ':from': 0})['Items'])
+        stale[windowing.PANE_SECONDS] = stale[60]
+
+        # A second invocation merges into the same pane and writes the combined totals
+        data_aggregator.persist_windows([record(30, 40, 60, "B")])
+        self.assertEqual(data_aggregator.window_table.items[("S1", pane)]['record_count'], 2)
+        self.assertEqual(data_aggregator.table.rows["S1"]['record_count'], 2)
+        self.assertEqual(data_aggregator.table.rows["S1"]['average_speed_kph'], 50)
+
+        # The first invocation's older snapshot lands last and is rejected
+        data_aggregator.persist_window_results({"S1": stale}, None)
+        self.assertEqual(data_aggregator.table.rows["S1"]['record_count'], 2)
+        self.assertEqual(data_aggregator.table.puts[-1]['record_count'], 1)
+        print("The row keeps the combined totals, stale snapshots are discarded.")
+
+    def test_redelivered_messages_merge_once(self):
+        print("\nTesting idempotent pane merges...")
+        first = json.dumps(record(30, 10, 40, "A"))
+        second = json.dumps(record(30, 40, 60, "B"))
+        data_aggregator.lambda_handler({'Records': [{'body': first}]}, None)
+
+        # SQS redelivers the first message next to a new one, and then the whole batch again
+        for _ in range(2):
+            data_aggregator.lambda_handler({'Records': [{'body': first}, {'body': second}]}, None)
+
+        pane = windowing.pane_start(windowing.event_time("2025-12-15T14:30:00"))
+        self.assertEqual(data_aggregator.window_table.items[("S1", pane)]['record_count'], 2)
+        self.assertEqual(data_aggregator.table.rows["S1"]['average_speed_kph'], 50)
+        print("Each message is counted once however often it is delivered.")
+
+    def test_dimension_cells_merge_across_panes(self):
+        print("\nTesting per lane, vehicle type and violation breakdowns...")
+        def detailed(minute, second, speed, plate, lane, vehicle_type, violation):
+            return dict(record(minute, second, speed, plate), lane_id=lane, vehicle_type=vehicle_type,
+                        is_violation=violation)
+
+        data_aggregator.persist_windows([detailed(30, 10, 40, "A", 1, "Car", False),
+                                         detailed(30, 20, 80, "B", 2, "Truck", True)])
+        # Partials from the validator carry the same cells
+        data_aggregator.persist_windows(partial_aggregates.build_partials([
+            detailed(31, 5, 60, "C", 2, "Truck", False), detailed(31, 30, 20, "D", 2, "Car", True)
+        ]))
+
+        item = data_aggregator.table.rows["S1"]
+        self.assertEqual(item['dimensions']['lane']['2']['count'], 2)
+        window = item['windows']['300']['dimensions']
+        self.assertEqual(window['lane']['2']['count'], 3)
+        self.assertEqual(window['vehicle_type']['Truck']['average_speed_kph'], 70)
+        self.assertEqual(window['violation']['true']['count'], 2)
+        self.assertEqual(window['violation']['false']['speed_sum'], 100)
+
+        # Crossed groupings key their cells by every value
+        original = dimensions.GROUPINGS
+        dimensions.GROUPINGS = [("lane+vehicle_type", ["lane", "vehicle_type"])]
+        try:
+            cells = dimensions.group({"lane": [1, 2, 2], "vehicle_type": ["Car", "Car", "Car"]}, [30, 50, 70])
+        finally:
+            dimensions.GROUPINGS = original
+        self.assertEqual(cells, {"lane+vehicle_type": {"1|Car": [1, 30], "2|Car": [2, 120]}})
+        print("Dimension cells add up like the street totals.")
+
+    def test_write_behind_coalesces_rows(self):
+        print("\nTesting write-behind coalescing...")
+        data_aggregator.WRITE_BEHIND_SECONDS = 60
+        data_aggregator.street_rows = WriteBehindBuffer(60)
+        history.history_table = MagicMock()
+        context = MagicMock()
+        context.get_remaining_time_in_millis.return_value = 15000
+        try:
+            for second, plate in ((10, "A"), (20, "B"), (30, "C")):
+                data_aggregator.persist_windows([record(30, second, 40, plate)])
+                data_aggregator.flush_write_behind(context)
+
+            # The first row is written at once, the next two are merged in memory
+            pane = windowing.pane_start(windowing.event_time("2025-12-15T14:30:00"))
+            self.assertEqual(data_aggregator.window_table.items[("S1", pane)]['record_count'], 3)
+            self.assertEqual(len(data_aggregator.table.puts), 1)
+            self.assertEqual(data_aggregator.street_rows.stats, {'buffered': 3, 'coalesced': 1, 'written': 1})
+            # History rows are not held back, a closed pane's row would never be written again
+            self.assertEqual(history.history_table.put_item.call_count, 3)
+
+            # Close to the timeout everything pending is written
+            context.get_remaining_time_in_millis.return_value = 1000
+            data_aggregator.flush_write_behind(context)
+            self.assertEqual(len(data_aggregator.table.puts), 2)
+            self.assertEqual(data_aggregator.table.rows["S1"]['record_count'], 3)
+            self.assertEqual(len(data_aggregator.street_rows), 0)
+        finally:
+            data_aggregator.WRITE_BEHIND_SECONDS = 0
+        print("Rows of one street are written twice for three invocations.")
+
+    def test_write_behind_flushes_quiet_street(self):
+        print("\nTesting write-behind for a street that goes quiet...")
+        data_aggregator.WRITE_BEHIND_SECONDS = 60
+        data_aggregator.street_rows = WriteBehindBuffer(60)
+        history.history_table = MagicMock()
+        context = MagicMock()
+        context.get_remaining_time_in_millis.return_value = 15000
+        try:
+            for second, plate in ((10, "A"), (20, "B")):
+                data_aggregator.lambda_handler({'Records': [{'body': json.dumps(record(30, second, 40, plate))}]}, context)
+            self.assertEqual(len(data_aggregator.street_rows), 1)
+
+            # The next invocation carries no S1 records, its pending row is written at once
+            quiet = json.dumps(record(30, 30, 40, "C", street="S2"))
+            data_aggregator.lambda_handler({'Records': [{'body': quiet}]}, context)
+            self.assertEqual(data_aggregator.table.rows["S1"]['record_count'], 2)
+            self.assertEqual(len(data_aggregator.street_rows), 0)
+        finally:
+            data_aggregator.WRITE_BEHIND_SECONDS = 0
+        print("The last row of a quiet street is not held back.")
+
+
+if __name__ == '__main__':
+    unittest.main()